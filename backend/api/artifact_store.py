@@ -0,0 +1,306 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from typing import Dict, Iterator
+
+from .job_ids import is_legacy_id, is_ulid
+from .paths import get_generated_dir, get_output_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Vercel only offers a small /tmp
+VERCEL_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 3600
+DEFAULT_SWEEP_INTERVAL = 30.0
+
+# Directories scanned per sweep tick; a full pass is spread over many ticks
+SWEEP_BATCH = 64
+
+# Runs modified more recently than this are never evicted, even if no job
+# record claims them (e.g. a run started by another process)
+MIN_AGE_SECONDS = 600.0
+
+PIN_FILENAME = ".pinned"
+CACHE_DIRNAME = "_cache"
+
+
+def _dir_size(path: str) -> int:
+    """
+    Bytes held by a directory tree. Hard-linked files (shared with the result
+    cache) are split evenly between their links, so evicting one link is not
+    credited with the whole file.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += st.st_size // max(st.st_nlink, 1)
+    return total
+
+
+class _Entry:
+    __slots__ = ("size", "accessed")
+
+    def __init__(self, size: int, accessed: float):
+        self.size = size
+        self.accessed = accessed
+
+
+class ArtifactStore:
+    """
+    Keeps the generated/ tree under a byte quota and a maximum age.
+
+    Every run directory (and every result cache entry) is an entry whose last
+    access time is the directory's mtime, so the LRU order survives restarts.
+    Entries are indexed incrementally by a background sweeper that scans a
+    small batch of directories per tick; eviction works from that index
+    and never walks the whole tree on a request.
+
+    Pinned runs (a `.pinned` marker), runs still being produced and runs
+    accessed or modified within MIN_AGE_SECONDS are never evicted.
+    """
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+                 sweep_interval: float = DEFAULT_SWEEP_INTERVAL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval = sweep_interval
+
+        self._entries: Dict[str, _Entry] = {}
+        self._active = set()
+        # Accesses not yet written back to directory mtimes
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._scan = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Access tracking ---
+
+    def begin(self, path: str):
+        """Marks a run directory as being produced."""
+        with self._lock:
+            self._active.add(path)
+
+    def finish(self, path: str):
+        """Indexes a finished run and evicts if it pushed the store over quota."""
+        with self._lock:
+            self._active.discard(path)
+        self._index(path)
+        self.evict()
+
+    def touch(self, job_id: str):
+        """
+        Records an access to a run. Only updates memory; the sweeper writes
+        accesses back to the directory mtime, so this never blocks on disk.
+        """
+        try:
+            path = get_output_dir(job_id)
+        except ValueError:
+            return
+        self.touch_path(path)
+
+    def touch_path(self, path: str):
+        now = time.time()
+        with self._lock:
+            self._touched[path] = now
+            entry = self._entries.get(path)
+            if entry is not None:
+                entry.accessed = now
+
+    def _flush_touched(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        for path, accessed in touched.items():
+            try:
+                os.utime(path, (accessed, accessed))
+            except OSError:
+                pass
+
+    def pin(self, job_id: str):
+        open(os.path.join(get_output_dir(job_id), PIN_FILENAME), "w").close()
+
+    def unpin(self, job_id: str):
+        try:
+            os.remove(os.path.join(get_output_dir(job_id), PIN_FILENAME))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(e.size for e in self._entries.values())
+
+    # --- Indexing ---
+
+    def _iter_entry_dirs(self) -> Iterator[str]:
+        """Yields every run directory and result cache entry under the root."""
+        try:
+            top = sorted(os.scandir(self.root), key=lambda e: e.name)
+        except OSError:
+            return
+        for item in top:
+            if not item.is_dir(follow_symlinks=False):
+                continue
+            if is_legacy_id(item.name):
+                yield item.path
+            elif item.name == CACHE_DIRNAME:
+                for entry in os.scandir(item.path):
+                    # Skip in-flight ".staging-*" directories
+                    if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+                        yield entry.path
+            elif len(item.name) == 4:
+                for shard in os.scandir(item.path):
+                    if not shard.is_dir(follow_symlinks=False):
+                        continue
+                    for run in os.scandir(shard.path):
+                        if run.is_dir(follow_symlinks=False) and is_ulid(run.name):
+                            yield run.path
+
+    def _index(self, path: str):
+        try:
+            accessed = os.stat(path).st_mtime
+        except OSError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return
+        size = _dir_size(path)
+        with self._lock:
+            accessed = max(accessed, self._touched.get(path, 0.0))
+            self._entries[path] = _Entry(size, accessed)
+
+    def sweep_step(self, batch: int = SWEEP_BATCH) -> int:
+        """Indexes the next `batch` directories of the current pass. Returns how many."""
+        if self._scan is None:
+            self._scan = self._iter_entry_dirs()
+        done = 0
+        while done < batch:
+            try:
+                path = next(self._scan)
+            except StopIteration:
+                self._scan = None
+                break
+            except OSError:
+                # Directory vanished mid-scan; restart the pass next tick
+                self._scan = None
+                break
+            self._index(path)
+            done += 1
+        return done
+
+    # --- Eviction ---
+
+    def _is_protected(self, path: str, entry: _Entry, now: float) -> bool:
+        with self._lock:
+            if path in self._active:
+                return True
+        if now - entry.accessed < MIN_AGE_SECONDS:
+            return True
+        if os.path.exists(os.path.join(path, PIN_FILENAME)):
+            return True
+        try:
+            return now - os.stat(path).st_mtime < MIN_AGE_SECONDS
+        except OSError:
+            return False
+
+    def evict(self) -> int:
+        """
+        Removes expired entries, then least-recently-accessed ones until the
+        indexed total is within quota. Returns the number of bytes freed.
+        """
+        now = time.time()
+        with self._lock:
+            candidates = sorted(self._entries.items(), key=lambda item: item[1].accessed)
+            total = sum(e.size for e in self._entries.values())
+
+        freed = 0
+        for path, entry in candidates:
+            expired = now - entry.accessed > self.max_age_seconds
+            if not expired and total - freed <= self.max_bytes:
+                break
+            if self._is_protected(path, entry, now):
+                continue
+            self._remove(path)
+            freed += entry.size
+        if freed:
+            logger.info(f"Evicted {freed / 1e6:.1f} MB of generated artifacts")
+        return freed
+
+    def _remove(self, path: str):
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._entries.pop(path, None)
+        # Drop shard directories left empty
+        parent = os.path.dirname(path)
+        while parent != self.root and os.path.dirname(parent) != parent:
+            if os.path.basename(parent) == CACHE_DIRNAME:
+                break
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    # --- Background sweeper ---
+
+    def start(self):
+        """Starts the background sweeper thread (idempotent)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._sweep_loop, name="artifact-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sweep_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._flush_touched()
+                self.sweep_step()
+                self.evict()
+            except Exception as e:
+                logger.warning(f"Artifact sweep failed: {e!r}")
+            self._stop.wait(self.sweep_interval)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """
+    Returns the process-wide artifact store and starts its sweeper. Limits are
+    configured via SQUISHY_ARTIFACT_MAX_MB, SQUISHY_ARTIFACT_MAX_AGE (seconds)
+    and SQUISHY_ARTIFACT_SWEEP_INTERVAL (seconds).
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            max_mb = os.environ.get("SQUISHY_ARTIFACT_MAX_MB")
+            max_age = os.environ.get("SQUISHY_ARTIFACT_MAX_AGE")
+            interval = os.environ.get("SQUISHY_ARTIFACT_SWEEP_INTERVAL")
+            if max_mb:
+                max_bytes = int(float(max_mb) * 1024 * 1024)
+            else:
+                max_bytes = VERCEL_MAX_BYTES if os.environ.get("VERCEL") else DEFAULT_MAX_BYTES
+            _store = ArtifactStore(
+                get_generated_dir(),
+                max_bytes=max_bytes,
+                max_age_seconds=float(max_age) if max_age else DEFAULT_MAX_AGE_SECONDS,
+                sweep_interval=float(interval) if interval else DEFAULT_SWEEP_INTERVAL,
+            )
+            _store.start()
+        return _store
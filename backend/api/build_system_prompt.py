@@ -125,3 +125,37 @@ Rules
 """
 
     return textwrap.dedent(prompt)
+
+
+def build_fused_scene_system_prompt(material_table: str) -> str:
+    """
+    Build a system prompt that makes the LLM polish the user's description and
+    compile it to a scene JSON in a single response.
+    """
+
+    fused = """
+====================
+Single-pass mode
+====================
+
+Before writing the scene, first refine the user's request into a clear,
+behavioral and physical description (the "polished description"):
+- How the object moves (e.g. undulatory locomotion, tumbling under gravity).
+- The physical regime, qualitatively (e.g. soft biological tissue, stiff rubber).
+  Actuated bodies must be soft enough to be bent by internal muscles.
+- The environment (e.g. anisotropic frictional ground for propulsion).
+- The actuation mechanism (e.g. internal muscle torques, endpoint force).
+- Stability: a small time step and appropriate damping (nu).
+Do NOT invent specific numbers in the description unless the user gave them.
+
+Then compile the polished description into the scene JSON described above.
+
+Output a single JSON object with exactly these two keys, in this order:
+
+{
+  "polished_description": string,
+  "scene": { ... scene JSON following the schema above ... }
+}
+"""
+
+    return build_scene_system_prompt(material_table) + textwrap.dedent(fused)
@@ -0,0 +1,167 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from .paths import get_generated_dir
+from .scene_to_code import compute_frame_count, compute_time_step, normalize_scene
+from .trajectory import CHUNK_FRAMES
+
+logger = logging.getLogger(__name__)
+
+# Feature vector of a scene, see `scene_features`
+FEATURES = ("steps", "rod_steps", "element_steps", "connection_steps", "records")
+
+# Seconds per unit of each feature on a warm worker, measured on a reference
+# machine (per step: ~33 us + 12 us per rod + 0.2 us per element + 12.6 us
+# per joint; ~5 us per recorded rod snapshot). Calibration rescales or refits them.
+DEFAULT_COEFFICIENTS = (33e-6, 11.7e-6, 0.21e-6, 12.6e-6, 5e-6)
+
+# Building, finalizing and pickling, independent of the step count
+FIXED_OVERHEAD_SECONDS = 0.5
+
+# Resident memory of a warm worker before the scene is built
+BASE_MEMORY_BYTES = 250 * 1024 * 1024
+
+MAX_OBSERVATIONS = 500
+# Observations needed before all coefficients are refit instead of only rescaled
+MIN_OBSERVATIONS_FOR_FIT = 20
+
+
+def scene_features(scene_data: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Cost drivers of a scene, derived the same way the simulation derives them:
+    the step count is duration / dt with dt from `compute_time_step`, and
+    every rod records `compute_frame_count` snapshots.
+    """
+    scene = normalize_scene(scene_data)
+    rods = scene["objects"]
+    dt = compute_time_step(scene)
+    steps = int(scene["render"]["duration"] / dt)
+    elements = sum(rod["n_elem"] for rod in rods)
+    connections = len(scene.get("connections", []))
+    snapshots = compute_frame_count(scene, dt)
+    return {
+        "steps": steps,
+        "rod_steps": steps * len(rods),
+        "element_steps": steps * elements,
+        "connection_steps": steps * connections,
+        "records": snapshots * len(rods),
+        # Not part of the runtime model
+        "dt": dt,
+        "rods": len(rods),
+        "elements": elements,
+        "connections": connections,
+        # One float64 (3, nodes) frame of every rod
+        "frame_bytes": sum(24 * (rod["n_elem"] + 1) for rod in rods),
+    }
+
+
+class CostModel:
+    """
+    Predicts simulation wall time and peak memory from a scene.
+
+    Wall time is linear in FEATURES. The coefficients start at
+    DEFAULT_COEFFICIENTS and are calibrated from observed runs: with few
+    observations the defaults are rescaled by the median observed/predicted
+    ratio (which absorbs the host's speed); with enough, they are refit by
+    least squares. Observations persist in a JSON file.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.coefficients = np.array(DEFAULT_COEFFICIENTS)
+        self._observations: List[List[float]] = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                self._observations = json.load(f)["observations"][-MAX_OBSERVATIONS:]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable cost model file {self.path}: {e}")
+            return
+        self._calibrate()
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"features": FEATURES, "observations": self._observations}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save cost model observations: {e}")
+
+    def _calibrate(self):
+        if not self._observations:
+            return
+        data = np.array(self._observations, dtype=float)
+        X, y = data[:, :-1], data[:, -1]
+        defaults = np.array(DEFAULT_COEFFICIENTS)
+
+        if len(y) >= MIN_OBSERVATIONS_FOR_FIT:
+            # Scale columns so the least-squares problem is well conditioned
+            scale = np.maximum(X.max(axis=0), 1.0)
+            fit, _, rank, _ = np.linalg.lstsq(X / scale, y, rcond=None)
+            fit = fit / scale
+            if rank == X.shape[1] and np.all(fit >= 0):
+                self.coefficients = fit
+                return
+
+        predicted = X @ defaults
+        valid = predicted > 0
+        if np.any(valid):
+            self.coefficients = defaults * float(np.median(y[valid] / predicted[valid]))
+
+    def observe(self, scene_data: Dict[str, Any], integration_seconds: float):
+        """Records the measured integration time of a scene and recalibrates."""
+        features = scene_features(scene_data)
+        row = [float(features[name]) for name in FEATURES] + [float(integration_seconds)]
+        with self._lock:
+            self._observations.append(row)
+            del self._observations[:-MAX_OBSERVATIONS]
+            self._calibrate()
+            self._save()
+
+    def estimate(self, scene_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the predicted cost of a scene:
+        {"wall_seconds", "peak_memory_mb", "steps", "elements", "connections",
+        "records", "calibrated_from"}.
+        """
+        features = scene_features(scene_data)
+        x = np.array([features[name] for name in FEATURES], dtype=float)
+        wall_seconds = FIXED_OVERHEAD_SECONDS + float(x @ self.coefficients)
+        # The trajectory is streamed to disk, so only a chunk of frames is held
+        peak_bytes = BASE_MEMORY_BYTES + CHUNK_FRAMES * features["frame_bytes"]
+        return {
+            "wall_seconds": round(wall_seconds, 2),
+            "peak_memory_mb": round(peak_bytes / (1024 * 1024), 1),
+            "steps": features["steps"],
+            "elements": features["elements"],
+            "connections": features["connections"],
+            "records": features["records"],
+            "calibrated_from": len(self._observations),
+        }
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_cost_model() -> CostModel:
+    """Returns the shared cost model, calibrated from generated/_cost_model.json."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            os.makedirs(get_generated_dir(), exist_ok=True)
+            _model = CostModel(os.path.join(get_generated_dir(), "_cost_model.json"))
+        return _model
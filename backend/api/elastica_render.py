@@ -1,62 +1,61 @@
-import pickle
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from mpl_toolkits.mplot3d import Axes3D
-import sys
 import os
+import argparse
+import multiprocessing
+from collections import deque
+from contextlib import ExitStack
+
+from PIL import Image
+
+# Run as a script from backend/api, so the sibling module imports directly
+from fast_render import (
+    AZIMUTH,
+    DEFAULT_RENDERER,
+    DPI,
+    ELEVATION,
+    FRAME_SIZE,
+    GIF_TRAILER,
+    PALETTE,
+    PALETTE_RGB,
+    RENDERERS,
+    FastRenderer,
+    encode_gif_frame,
+    gif_header,
+)
+from trajectory import (
+    LEGACY_FILENAME,
+    TRAJECTORY_FILENAME,
+    read_legacy_trajectory,
+    read_trajectory,
+)
+from video import (
+    QUALITY_PRESETS,
+    VIDEO_FORMATS,
+    VideoWriter,
+    ffmpeg_executable,
+    video_filename,
+)
+
+
+def load(filename: str):
+    """Reads a trajectory file, or a pickle from before the trajectory format."""
+    try:
+        return read_trajectory(filename)
+    except ValueError:
+        return read_legacy_trajectory(filename)
 
 
-def main():
-    # Default filename, can be overridden by command line argument
-    filename = "simulation_data.pkl"
-    if len(sys.argv) > 1:
-        filename = sys.argv[1]
+FORMATS = ("gif", *VIDEO_FORMATS)
 
-    # Fallback for the tutorial
-    if not os.path.exists(filename) and os.path.exists("simulation_data.dat"):
-        filename = "simulation_data.dat"
+# Frames per unit of work of a rendering process
+SLICE_FRAMES = 16
 
-    if not os.path.exists(filename):
-        print(f"File {filename} not found.")
-        print("Please run the simulation script first to generate the data.")
-        return
-
-    print(f"Loading simulation data from {filename}...")
-    with open(filename, "rb") as f:
-        data = pickle.load(f)
+# Frame size (pixels), dpi and camera angles of the matplotlib default view
+DEFAULT_VIEW = {"size": FRAME_SIZE, "dpi": DPI, "elevation": ELEVATION, "azimuth": AZIMUTH}
 
-    # Check for expected data structure
-    if "rods" not in data:
-        print("Error: 'rods' key not found in data.")
-        print(
-            "Expected format: {'rods': [{'time': [], 'position': []}, ...], 'metadata': {...}}")
-        return
 
-    rods_history = data["rods"]
-    metadata = data.get("metadata", {})
-    fps = metadata.get("fps", 30)
-
-    if not rods_history:
-        print("No rod history found.")
-        return
-
-    # Assuming all rods have the same time steps
-    times = rods_history[0]["time"]
-    n_steps = len(times)
-    print(f"Loaded {len(rods_history)} rods with {n_steps} frames.")
-
-    # Determine bounds for plotting (consider all rods)
-    all_pos_list = []
-    for history in rods_history:
-        # history["position"] is a list of (3, n_nodes) arrays
-        # Convert to a single array for this rod: (n_steps, 3, n_nodes)
-        rod_pos = np.array(history["position"])
-        all_pos_list.append(rod_pos)
-
-    # Concatenate all positions to find global min/max
-    # Shape: (n_rods * n_steps * n_nodes, 3) - flattened for easier min/max
-    # Or just iterate
+def compute_bounds(all_pos_list):
+    """Returns the center and side of the cube enclosing every rod position."""
     min_vals = np.array([np.inf, np.inf, np.inf])
     max_vals = np.array([-np.inf, -np.inf, -np.inf])
 
@@ -67,94 +66,308 @@ def main():
         min_vals = np.minimum(min_vals, current_min)
         max_vals = np.maximum(max_vals, current_max)
 
-    # Add some margin
     ranges = max_vals - min_vals
     max_range = np.max(ranges)
     if max_range == 0:
         max_range = 1.0
 
     mid_vals = (max_vals + min_vals) / 2
-
-    # Create figure
-    fig = plt.figure(figsize=(10, 8), facecolor='#0d0d0d')
-    ax = fig.add_subplot(111, projection='3d')
-    ax.set_facecolor('#0d0d0d')
-
-    # Styling colors
-    bg_color = '#0d0d0d'
-    fg_color = '#5a9ade'
-
-    ax.xaxis.label.set_color(fg_color)
-    ax.yaxis.label.set_color(fg_color)
-    ax.zaxis.label.set_color(fg_color)
-    ax.tick_params(axis='x', colors=fg_color)
-    ax.tick_params(axis='y', colors=fg_color)
-    ax.tick_params(axis='z', colors=fg_color)
-    ax.title.set_color(fg_color)
-
-    # 3D Pane styling
-    ax.xaxis.set_pane_color((0.05, 0.05, 0.05, 1.0))
-    ax.yaxis.set_pane_color((0.05, 0.05, 0.05, 1.0))
-    ax.zaxis.set_pane_color((0.05, 0.05, 0.05, 1.0))
-
-    # Remove grid or color it
-    ax.grid(color=fg_color, linestyle='--', linewidth=0.5, alpha=0.3)
-
-    ax.set_xlim(mid_vals[0] - max_range/2, mid_vals[0] + max_range/2)
-    ax.set_ylim(mid_vals[1] - max_range/2, mid_vals[1] + max_range/2)
-    ax.set_zlim(mid_vals[2] - max_range/2, mid_vals[2] + max_range/2)
-
-    ax.set_xlabel('X')
-    ax.set_ylabel('Y')
-    ax.set_zlabel('Z')
-    ax.set_title('Elastica Simulation Animation')
-
-    # Create lines for each rod
-    lines = []
-    for _ in rods_history:
-        line, = ax.plot([], [], [], 'o-', lw=2, markersize=2,
-                        color=fg_color, markeredgecolor=fg_color)
-        lines.append(line)
-
-    time_text = ax.text2D(
-        0.05, 0.95, '', transform=ax.transAxes, color=fg_color)
-
-    def init():
-        for line in lines:
-            line.set_data([], [])
-            line.set_3d_properties([])
-        time_text.set_text('')
-        return lines + [time_text]
-
-    def update(frame):
-        for i, line in enumerate(lines):
-            current_pos = all_pos_list[i][frame]  # (3, n_nodes)
+    return mid_vals, max_range
+
+
+class MatplotlibRenderer:
+    """Draws frames with a matplotlib 3D figure, returned as RGB arrays."""
+
+    def __init__(self, n_rods, mid_vals, max_range, view):
+        # Imported here so the fast renderer does not pay for matplotlib
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D
+
+        # Create figure
+        (width, height), dpi = view["size"], view["dpi"]
+        fig = plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi, facecolor='#0d0d0d')
+        ax = fig.add_subplot(111, projection='3d')
+        ax.set_facecolor('#0d0d0d')
+        ax.view_init(elev=view["elevation"], azim=view["azimuth"])
+
+        # Styling colors
+        bg_color = '#0d0d0d'
+        fg_color = '#5a9ade'
+
+        ax.xaxis.label.set_color(fg_color)
+        ax.yaxis.label.set_color(fg_color)
+        ax.zaxis.label.set_color(fg_color)
+        ax.tick_params(axis='x', colors=fg_color)
+        ax.tick_params(axis='y', colors=fg_color)
+        ax.tick_params(axis='z', colors=fg_color)
+        ax.title.set_color(fg_color)
+
+        # 3D Pane styling
+        ax.xaxis.set_pane_color((0.05, 0.05, 0.05, 1.0))
+        ax.yaxis.set_pane_color((0.05, 0.05, 0.05, 1.0))
+        ax.zaxis.set_pane_color((0.05, 0.05, 0.05, 1.0))
+
+        # Remove grid or color it
+        ax.grid(color=fg_color, linestyle='--', linewidth=0.5, alpha=0.3)
+
+        ax.set_xlim(mid_vals[0] - max_range/2, mid_vals[0] + max_range/2)
+        ax.set_ylim(mid_vals[1] - max_range/2, mid_vals[1] + max_range/2)
+        ax.set_zlim(mid_vals[2] - max_range/2, mid_vals[2] + max_range/2)
+
+        ax.set_xlabel('X')
+        ax.set_ylabel('Y')
+        ax.set_zlabel('Z')
+        ax.set_title('Elastica Simulation Animation')
+
+        # Create lines for each rod
+        lines = []
+        for _ in range(n_rods):
+            line, = ax.plot([], [], [], 'o-', lw=2, markersize=2,
+                            color=fg_color, markeredgecolor=fg_color)
+            lines.append(line)
+
+        time_text = ax.text2D(
+            0.05, 0.95, '', transform=ax.transAxes, color=fg_color)
+
+        self.fig = fig
+        self.lines = lines
+        self.time_text = time_text
+
+    def render(self, positions, time):
+        for line, current_pos in zip(self.lines, positions):
+            # current_pos shape: (3, n_nodes)
             line.set_data(current_pos[0], current_pos[1])
             line.set_3d_properties(current_pos[2])
 
-        time_text.set_text(f'Time: {times[frame]:.2f} s')
-        return lines + [time_text]
+        self.time_text.set_text(f'Time: {time:.2f} s')
+        self.fig.canvas.draw()
+        return np.asarray(self.fig.canvas.buffer_rgba())[..., :3]
+
+
+def make_renderer(renderer, n_rods, mid_vals, max_range, view):
+    if renderer == "fast":
+        return FastRenderer(mid_vals, max_range, size=view["size"], dpi=view["dpi"],
+                            elevation=view["elevation"], azimuth=view["azimuth"])
+    return MatplotlibRenderer(n_rods, mid_vals, max_range, view)
+
+
+# State of a rendering process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(filename, renderer, mid_vals, max_range, view, formats, fps):
+    trajectory = load(filename)
+    _worker["formats"] = formats
+    _worker["duration"] = 1000 / fps
+    _worker["video"] = any(fmt in VIDEO_FORMATS for fmt in formats)
+    _worker["trajectory"] = trajectory
+    _worker["rods"] = [trajectory.positions(i) for i in range(len(trajectory.rods))]
+    _worker["renderer"] = make_renderer(renderer, len(trajectory.rods), mid_vals, max_range,
+                                        view)
+
+
+def _draw(frame):
+    rods, times = _worker["rods"], _worker["trajectory"].times
+    return _worker["renderer"].render([rod[frame] for rod in rods], float(times[frame]))
+
+
+def _render_slice(frames):
+    """
+    Renders a range of frames into each output format: GIF blocks (the
+    frame before the range is redrawn for the first delta) and/or rgb24
+    frames for video encoders.
+    """
+    formats = _worker["formats"]
+    duration = _worker["duration"]
+    previous = None
+    if "gif" in formats and frames.start > 0:
+        previous = _draw(frames.start - frames.step).copy()
+    gif_blocks, raw_frames = [], []
+    for frame in frames:
+        image = _draw(frame)
+        if "gif" in formats:
+            gif_blocks.append(encode_gif_frame(image, previous, duration))
+            previous = image.copy()
+        if _worker["video"]:
+            raw_frames.append((PALETTE_RGB[image] if image.ndim == 2 else image).tobytes())
+    return b"".join(gif_blocks), b"".join(raw_frames)
+
+
+def _ordered_slices(pool, slices, window):
+    """Results of the slices in order, with at most `window` in flight."""
+    pending = deque()
+    for frames in slices:
+        pending.append(pool.apply_async(_render_slice, (frames,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def render_parallel(filename, base_name, renderer, mid_vals, max_range, frames, fps,
+                    workers, formats=("gif",), quality=None, view=DEFAULT_VIEW):
+    """
+    Renders the `frames` (a range) of a trajectory file, played at `fps`, to
+    `base_name` plus the extension of every output format (gif, mp4, webm),
+    splitting the frames into slices of SLICE_FRAMES rendered and
+    GIF-encoded by `workers` processes, each reading the memory-mapped
+    trajectory. Slices are written out in order as they complete, video
+    frames streamed into one ffmpeg process per format; with one worker
+    everything runs in this process.
+    """
+    slices = [frames[start:start + SLICE_FRAMES] for start in range(0, len(frames), SLICE_FRAMES)]
+    workers = max(1, min(workers, len(slices)))
+    init_args = (filename, renderer, mid_vals, max_range, view, tuple(formats), fps)
+    size = view["size"]
+
+    with ExitStack() as stack:
+        gif = None
+        if "gif" in formats:
+            gif = stack.enter_context(open(f"{base_name}.gif", "wb"))
+            gif.write(gif_header(size))
+        videos = [stack.enter_context(VideoWriter(video_filename(fmt, base_name), size,
+                                                  fps, fmt, quality))
+                  for fmt in formats if fmt in VIDEO_FORMATS]
+
+        if workers == 1:
+            _init_worker(*init_args)
+            results = map(_render_slice, slices)
+        else:
+            pool = stack.enter_context(multiprocessing.Pool(
+                workers, initializer=_init_worker, initargs=init_args))
+            results = _ordered_slices(pool, slices, workers + 1)
+
+        for gif_blocks, raw_frames in results:
+            if gif is not None:
+                gif.write(gif_blocks)
+            for video in videos:
+                video.write(raw_frames)
+        if gif is not None:
+            gif.write(GIF_TRAILER)
+
+
+def save_frame(filename, save_filename, renderer, mid_vals, max_range, frame, view=DEFAULT_VIEW):
+    """Renders one frame of a trajectory file to a PNG."""
+    _init_worker(filename, renderer, mid_vals, max_range, view, ("png",), 1.0)
+    image = Image.fromarray(np.ascontiguousarray(_draw(frame)))
+    if image.mode == "L":
+        image.putpalette(PALETTE)
+    image.save(save_filename, optimize=True)
+
+
+def _size(text):
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got '{text}'")
+    if width < 16 or height < 16:
+        raise argparse.ArgumentTypeError("frames must be at least 16x16 pixels")
+    return width, height
 
-    print("Creating animation...")
-    # Adjust interval based on fps
-    interval = 1000 / fps
-    ani = animation.FuncAnimation(
-        fig, update, frames=n_steps, init_func=init, blit=False, interval=interval)
 
-    save_filename = "simulation.gif"
-    if filename != "simulation_data.pkl":
-        base_name = os.path.splitext(filename)[0]
-        save_filename = f"{base_name}.gif"
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render a simulation trajectory to a GIF and/or video.")
+    parser.add_argument("filename", nargs="?", default=TRAJECTORY_FILENAME)
+    parser.add_argument("--renderer", choices=RENDERERS,
+                        default=os.environ.get("SQUISHY_RENDERER", DEFAULT_RENDERER))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("SQUISHY_RENDER_WORKERS", os.cpu_count() or 1)),
+                        help="Rendering processes")
+    parser.add_argument("--format", nargs="+", choices=FORMATS, dest="formats",
+                        default=os.environ.get("SQUISHY_RENDER_FORMATS", "gif").split(","),
+                        help="Output formats, rendered in one pass")
+    parser.add_argument("--quality", choices=tuple(QUALITY_PRESETS),
+                        help="Video quality preset (default: SQUISHY_VIDEO_QUALITY or medium)")
+    parser.add_argument("--output", help="Output path without extension (default: next to the input)")
+    parser.add_argument("--size", type=_size, default=FRAME_SIZE, help="Frame size, WIDTHxHEIGHT")
+    parser.add_argument("--dpi", type=float, default=DPI, help="Scale of text and lines")
+    parser.add_argument("--elev", type=float, default=ELEVATION, help="Camera elevation (degrees)")
+    parser.add_argument("--azim", type=float, default=AZIMUTH, help="Camera azimuth (degrees)")
+    parser.add_argument("--fps", type=float,
+                        help="Frame rate, at most the recorded one (default: as recorded)")
+    parser.add_argument("--frame", type=int, help="Render only this frame, as a PNG")
+    args = parser.parse_args()
+    unknown = set(args.formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"unknown output formats {sorted(unknown)}, expected {FORMATS}")
+    filename = args.filename
+
+    # Fallbacks for runs recorded before the trajectory format and the tutorial
+    for legacy_filename in (LEGACY_FILENAME, "simulation_data.dat"):
+        if not os.path.exists(filename) and os.path.exists(legacy_filename):
+            filename = legacy_filename
 
-    print(f"Saving animation to {save_filename}...")
+    if not os.path.exists(filename):
+        print(f"File {filename} not found.")
+        print("Please run the simulation script first to generate the data.")
+        return 1
+
+    print(f"Loading simulation data from {filename}...")
+    try:
+        trajectory = load(filename)
+    except (KeyError, IndexError, ValueError) as e:
+        print(f"Error: {filename} is not a readable trajectory ({e}).")
+        return 1
+
+    if not trajectory.rods:
+        print("No rod history found.")
+        return 1
+
+    print(f"Loaded {len(trajectory.rods)} rods with {trajectory.n_frames} frames.")
+
+    # (n_steps, 3, n_nodes) per rod, read in place from the memory map
+    all_pos_list = [trajectory.positions(i) for i in range(len(trajectory.rods))]
+    mid_vals, max_range = compute_bounds(all_pos_list)
+
+    base_name = "simulation"
+    if filename not in (TRAJECTORY_FILENAME, LEGACY_FILENAME):
+        base_name = os.path.splitext(filename)[0]
+    base_name = args.output or base_name
+    view = {"size": args.size, "dpi": args.dpi, "elevation": args.elev, "azimuth": args.azim}
+
+    if args.frame is not None:
+        if not 0 <= args.frame < trajectory.n_frames:
+            print(f"Error: frame {args.frame} out of range (0-{trajectory.n_frames - 1}).")
+            return 1
+        print(f"Saving frame {args.frame} to {base_name}.png ({args.renderer} renderer)...")
+        save_frame(filename, f"{base_name}.png", args.renderer, mid_vals, max_range,
+                   args.frame, view)
+        return 0
+
+    # Lower frame rates keep every n-th frame
+    step = 1
+    if args.fps:
+        step = max(1, round(trajectory.fps / args.fps))
+    frames = range(0, trajectory.n_frames, step)
+
+    formats = list(dict.fromkeys(args.formats))
+    if any(fmt in VIDEO_FORMATS for fmt in formats):
+        try:
+            ffmpeg_executable()
+        except FileNotFoundError as e:
+            # Video is an extra; the GIF still renders without ffmpeg
+            print(f"Skipping video output: {e}")
+            formats = [fmt for fmt in formats if fmt not in VIDEO_FORMATS]
+    if not formats:
+        return 1
+
+    outputs = ", ".join(f"{base_name}.{fmt}" for fmt in formats)
+    print(f"Saving animation to {outputs} ({args.renderer} renderer)...")
     try:
-        ani.save(save_filename, writer='pillow', fps=fps)
+        render_parallel(filename, base_name, args.renderer, mid_vals, max_range,
+                        frames, trajectory.fps / step, args.workers, formats,
+                        args.quality, view)
         print("Animation saved.")
     except Exception as e:
         print(f"Failed to save animation: {e}")
+        return 1
 
     # plt.show()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
@@ -0,0 +1,339 @@
+"""
+Rasterizing GIF renderer for trajectories, without matplotlib.
+
+Rod nodes are projected with a fixed orthographic camera (by default the
+matplotlib 3D view: elevation 30, azimuth -60, box aspect 4:4:3) and drawn
+as anti-aliased polylines with node markers by splatting coverage into a
+preallocated buffer. Every pixel is a blend of the background with the grid
+color and the foreground color, so frames are palette images over one fixed
+256-color palette and need no quantization before GIF encoding.
+Frames are GIF-encoded one at a time, so memory does not grow with the
+length of the run.
+
+The static parts (grid panes, ticks, labels and title) are rasterized once;
+each frame only adds the rods and the time overlay.
+
+Like trajectory.py, this module is imported by the renderer as a plain
+script, so it only depends on NumPy and Pillow.
+"""
+import math
+import struct
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageDraw, ImageFont
+
+# Renderers of elastica_render.py ("matplotlib" is the former animation);
+# the default is overridable via SQUISHY_RENDERER
+RENDERERS = ("fast", "matplotlib")
+DEFAULT_RENDERER = "fast"
+
+# Theme of the matplotlib renderer
+BG_COLOR = (0x0d, 0x0d, 0x0d)
+FG_COLOR = (0x5a, 0x9a, 0xde)
+GRID_COLOR = (0xb0, 0xb0, 0xb0)
+TITLE = "Elastica Simulation Animation"
+
+FRAME_SIZE = (1000, 800)
+DPI = 100
+ELEVATION = 30.0
+AZIMUTH = -60.0
+BOX_ASPECT = (4.0, 4.0, 3.0)
+
+# Pixel radii of rod lines, node markers and grid lines at DPI
+LINE_RADIUS = 1.4
+MARKER_RADIUS = 2.0
+GRID_RADIUS = 0.4
+# Spacing (pixels) of the coverage samples along a line
+SAMPLE_STEP = 0.5
+
+# Coverage levels of the grid and of the foreground in the palette
+LEVELS = 16
+
+
+def _palette() -> list:
+    bg, grid, fg = (np.array(c, dtype=float) for c in (BG_COLOR, GRID_COLOR, FG_COLOR))
+    palette = []
+    for g in range(LEVELS):
+        under = bg + (grid - bg) * g / (LEVELS - 1)
+        for a in range(LEVELS):
+            color = under + (fg - under) * a / (LEVELS - 1)
+            palette.extend(int(round(c)) for c in color)
+    return palette
+
+
+PALETTE = _palette()
+# (256, 3) lookup from palette indices to RGB
+PALETTE_RGB = np.array(PALETTE, dtype=np.uint8).reshape(-1, 3)
+
+
+def _ticks(low: float, high: float, target: int = 5) -> np.ndarray:
+    """Round tick values within [low, high], about `target` of them."""
+    span = high - low
+    if span <= 0:
+        return np.array([low])
+    raw = span / target
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw)
+    start = math.ceil(low / step - 1e-9) * step
+    return np.arange(start, high + step * 1e-6, step)
+
+
+def _format_ticks(values: np.ndarray) -> list:
+    """Tick labels sharing the decimals of the tick step, like matplotlib's."""
+    step = values[1] - values[0] if len(values) > 1 else 1.0
+    decimals = max(0, -math.floor(math.log10(step) + 1e-9)) if step > 0 else 0
+    # 2.5 x 10^k steps need one more decimal than their magnitude
+    while decimals < 10 and abs(round(step, decimals) - step) > step * 1e-6:
+        decimals += 1
+    if decimals == 0 and np.all(np.abs(values) < 10):
+        decimals = 1
+    return [f"{value + 0.0:.{decimals}f}" for value in values]
+
+
+class FastRenderer:
+    """
+    Renders frames of a scene within the cube of side `max_range` around
+    `mid` (see `elastica_render.compute_bounds`) as palette index arrays.
+    """
+
+    def __init__(self, mid: Sequence[float], max_range: float,
+                 size: Tuple[int, int] = FRAME_SIZE, dpi: float = DPI,
+                 elevation: float = ELEVATION, azimuth: float = AZIMUTH):
+        self.width, self.height = size
+        self.mid = np.asarray(mid, dtype=float)
+        self.max_range = float(max_range)
+        self.low = self.mid - self.max_range / 2
+        self.high = self.mid + self.max_range / 2
+        self._camera(elevation, azimuth)
+
+        # Text, lines and markers keep their point sizes, as in matplotlib
+        self.scale = scale = dpi / DPI
+        self.font = ImageFont.load_default(size=max(8, round(14 * scale)))
+        self.title_font = ImageFont.load_default(size=max(8, round(17 * scale)))
+
+        # Preallocated per-frame buffers
+        self.coverage = np.zeros((self.height, self.width), dtype=np.float32)
+        self._scratch = np.zeros_like(self.coverage)
+        self.indices = np.zeros((self.height, self.width), dtype=np.uint8)
+        self._time_box = (round(0.235 * self.width), round(0.14 * self.height))
+        self._time_image = Image.new("L", (round(0.3 * self.width), round(0.04 * self.height)))
+        self._time_draw = ImageDraw.Draw(self._time_image)
+
+        self.static_coverage, self.grid_base = self._static_layers()
+
+    # --- Projection ---
+
+    def _camera(self, elevation: float, azimuth: float):
+        elev, azim = math.radians(elevation), math.radians(azimuth)
+        self.eye = np.array([math.cos(elev) * math.cos(azim),
+                             math.cos(elev) * math.sin(azim), math.sin(elev)])
+        right = np.array([-math.sin(azim), math.cos(azim), 0.0])
+        up = np.array([-math.sin(elev) * math.cos(azim),
+                       -math.sin(elev) * math.sin(azim), math.cos(elev)])
+        # World -> unit box of the given aspect -> screen plane
+        box = np.array(BOX_ASPECT) / max(BOX_ASPECT)
+        rotation = np.stack([right, up]) * (box / self.max_range)
+
+        corners = np.array([[x, y, z] for x in (self.low[0], self.high[0])
+                            for y in (self.low[1], self.high[1])
+                            for z in (self.low[2], self.high[2])]).T
+        plane = rotation @ (corners - self.mid[:, None])
+        extent = plane.max(axis=1) - plane.min(axis=1)
+        pixels = min(0.58 * self.width / extent[0], 0.68 * self.height / extent[1])
+        # Flip the screen y axis, then center the cube in the plot area
+        self.matrix = rotation * np.array([[pixels], [-pixels]])
+        center = self.matrix @ ((corners.min(axis=1) + corners.max(axis=1)) / 2 - self.mid)
+        self.offset = np.array([0.52 * self.width, 0.51 * self.height]) - center
+        self.offset -= self.matrix @ self.mid
+
+    def project(self, points: np.ndarray) -> np.ndarray:
+        """(3, n) world points -> (2, n) pixel coordinates."""
+        return self.matrix @ points + self.offset[:, None]
+
+    # --- Rasterization ---
+
+    def _splat(self, coverage: np.ndarray, points: np.ndarray, radius: float):
+        """Max-blends anti-aliased discs of `radius` at (2, m) pixel points."""
+        points = points[:, np.all(np.isfinite(points), axis=0)]
+        if points.shape[1] == 0:
+            return
+        reach = int(math.ceil(radius + 0.5))
+        offsets = np.arange(-reach, reach + 1)
+        cells_x = np.floor(points[0])[:, None, None] + offsets[None, None, :]
+        cells_y = np.floor(points[1])[:, None, None] + offsets[None, :, None]
+        distance = np.hypot(cells_x + 0.5 - points[0][:, None, None],
+                            cells_y + 0.5 - points[1][:, None, None])
+        values = np.clip(radius + 0.5 - distance, 0.0, 1.0)
+        inside = ((values > 0) & (cells_x >= 0) & (cells_x < self.width)
+                  & (cells_y >= 0) & (cells_y < self.height))
+        flat = (cells_y * self.width + cells_x)[inside].astype(np.intp)
+        np.maximum.at(coverage.reshape(-1), flat, values[inside].astype(np.float32))
+
+    def _polyline(self, coverage: np.ndarray, points: np.ndarray, radius: float):
+        """Max-blends an anti-aliased polyline through (2, n) pixel points."""
+        if points.shape[1] < 2:
+            self._splat(coverage, points, radius)
+            return
+        start, vector = points[:, :-1], np.diff(points, axis=1)
+        lengths = np.hypot(vector[0], vector[1])
+        # Segments leaving the frame by far (blown-up runs) are not sampled
+        limit = 2 * (self.width + self.height)
+        valid = (np.isfinite(lengths) & (lengths < limit)
+                 & np.all(np.abs(start) < limit, axis=0))
+        counts = np.where(valid, np.ceil(lengths / SAMPLE_STEP), 0).astype(np.intp)
+        counts[valid] = np.maximum(counts[valid], 1)
+        segment = np.repeat(np.arange(len(counts)), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        t = (np.arange(len(segment)) - first) / counts[segment]
+        samples = start[:, segment] + vector[:, segment] * t
+        self._splat(coverage, np.concatenate([samples, points[:, -1:]], axis=1), radius)
+
+    def _text(self, draw: ImageDraw.ImageDraw, xy, text: str, font, anchor: str = "la"):
+        draw.text(xy, text, fill=255, font=font, anchor=anchor)
+
+    def _static_layers(self):
+        """Rasterizes panes, grid, ticks, labels and title once."""
+        grid = np.zeros_like(self.coverage)
+        labels = Image.new("L", (self.width, self.height))
+        draw = ImageDraw.Draw(labels)
+        fg = np.zeros_like(self.coverage)
+
+        # Panes on the far side of each axis from the eye
+        back = np.where(self.eye > 0, self.low, self.high)
+        front = np.where(self.eye > 0, self.high, self.low)
+        ticks = [_ticks(self.low[axis], self.high[axis]) for axis in range(3)]
+        for normal in range(3):
+            for axis in range(3):
+                if axis == normal:
+                    continue
+                other = 3 - normal - axis
+                for value in ticks[axis]:
+                    line = np.zeros((3, 2))
+                    line[normal] = back[normal]
+                    line[axis] = value
+                    line[other] = (self.low[other], self.high[other])
+                    self._polyline(grid, self.project(line), GRID_RADIUS * self.scale)
+
+        # Ticks and labels: x along the front-bottom edge, y along the side
+        # edge, z up the vertical edge at the back. Tick marks point along
+        # the neighbouring axis, away from the panes.
+        edges = {0: (1, front[1], 2, back[2]), 1: (0, front[0], 2, back[2]),
+                 2: (0, front[0], 1, back[1])}
+        names = "XYZ"
+        for axis, (a, a_value, b, b_value) in edges.items():
+            points = np.zeros((3, len(ticks[axis])))
+            points[axis] = ticks[axis]
+            points[a], points[b] = a_value, b_value
+            screen = self.project(points)
+            away = np.zeros(3)
+            away[a] = a_value - back[a]
+            outward = self.matrix @ away
+            outward /= max(np.hypot(*outward), 1e-9)
+            for text, xy in zip(_format_ticks(ticks[axis]), screen.T):
+                outward_px = outward * self.scale
+                tick = np.stack([xy - outward_px * 4, xy + outward_px * 8]).T
+                self._polyline(fg, tick, 0.5 * self.scale)
+                self._text(draw, tuple(xy + outward_px * 26), text, self.font, "mm")
+            label_xy = screen.mean(axis=1) + outward * self.scale * 56
+            self._text(draw, tuple(label_xy), names[axis], self.font, "mm")
+
+        self._text(draw, (self.width / 2, 0.1 * self.height), TITLE, self.title_font, "mm")
+        np.maximum(fg, np.asarray(labels, dtype=np.float32) / 255, out=fg)
+
+        grid_base = np.rint(grid * (LEVELS - 1)) * LEVELS
+        return fg, grid_base.astype(np.float32)
+
+    # --- Frames ---
+
+    def render(self, positions: Sequence[np.ndarray], time: Optional[float]) -> np.ndarray:
+        """
+        Renders one frame from each rod's (3, n_nodes) positions. Returns the
+        palette indices (height, width); the array is reused by the next call.
+        """
+        coverage = self.coverage
+        np.copyto(coverage, self.static_coverage)
+        for rod in positions:
+            screen = self.project(np.asarray(rod, dtype=float))
+            self._polyline(coverage, screen, LINE_RADIUS * self.scale)
+            self._splat(coverage, screen, MARKER_RADIUS * self.scale)
+
+        if time is not None:
+            self._time_draw.rectangle((0, 0) + self._time_image.size, fill=0)
+            self._time_draw.text((0, 0), f"Time: {time:.2f} s", fill=255, font=self.font)
+            x, y = self._time_box
+            w, h = self._time_image.size
+            region = coverage[y:y + h, x:x + w]
+            text = np.asarray(self._time_image, dtype=np.float32)[:region.shape[0], :region.shape[1]]
+            np.maximum(region, text / 255, out=region)
+
+        scratch = self._scratch
+        np.multiply(coverage, LEVELS - 1, out=scratch)
+        np.rint(scratch, out=scratch)
+        np.add(scratch, self.grid_base, out=scratch)
+        np.copyto(self.indices, scratch, casting="unsafe")
+        return self.indices
+
+
+# --- GIF encoding ---
+#
+# Frames are encoded one by one as blocks of a looping GIF, each holding only
+# the rectangle that changed since the previous frame. A block depends on
+# nothing but its frame and the previous one, so slices of an animation can
+# be encoded independently (see elastica_render.py) and joined in order.
+
+GIF_TRAILER = b";"
+
+
+def gif_header(size: Tuple[int, int], palette: Sequence[int] = PALETTE, loop: int = 0) -> bytes:
+    """GIF89a header with a 256-color global palette and a loop count."""
+    colors = bytes(palette[:768]).ljust(768, b"\0")
+    return (b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0xF7, 0, 0) + colors
+            + b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\0")
+
+
+def encode_gif_frame(frame: np.ndarray, previous: Optional[np.ndarray], duration: float) -> bytes:
+    """
+    Encodes a frame as a GIF block drawn over `previous` (None for the
+    first frame). (height, width) frames are indices into PALETTE, the
+    global palette; (height, width, 3) RGB frames get a local palette.
+    """
+    top, left, bottom, right = 0, 0, frame.shape[0], frame.shape[1]
+    if previous is not None:
+        changed = frame != previous
+        if changed.ndim == 3:
+            changed = changed.any(axis=2)
+        rows = np.flatnonzero(changed.any(axis=1))
+        columns = np.flatnonzero(changed.any(axis=0))
+        if len(rows):
+            top, bottom = rows[0], rows[-1] + 1
+            left, right = columns[0], columns[-1] + 1
+        else:
+            # Identical frames still take their time slot
+            bottom, right = 1, 1
+
+    image = Image.fromarray(np.ascontiguousarray(frame[top:bottom, left:right]))
+    params = {}
+    if frame.ndim == 2:
+        image.putpalette(PALETTE)
+    else:
+        image = image.convert("P", palette=Image.Palette.ADAPTIVE)
+        params["include_color_table"] = True
+    blocks = GifImagePlugin.getdata(image, offset=(int(left), int(top)),
+                                    duration=duration, disposal=1, **params)
+    return b"".join(blocks)
+
+
+def render_gif(trajectory, filename: str, mid: Sequence[float], max_range: float,
+               size: Tuple[int, int] = FRAME_SIZE):
+    """Renders every frame of a trajectory (see trajectory.py) to a GIF."""
+    renderer = FastRenderer(mid, max_range, size=size)
+    rods = [trajectory.positions(i) for i in range(len(trajectory.rods))]
+    previous = None
+    with open(filename, "wb") as f:
+        f.write(gif_header(size))
+        for frame in range(trajectory.n_frames):
+            indices = renderer.render([rod[frame] for rod in rods], float(trajectory.times[frame]))
+            f.write(encode_gif_frame(indices, previous, 1000 / trajectory.fps))
+            previous = indices.copy()
+        f.write(GIF_TRAILER)
@@ -0,0 +1,66 @@
+import os
+import re
+import time
+import threading
+
+# Crockford's base32 alphabet (no I, L, O, U); sorts the same as the values it encodes
+ENCODING = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+TIME_CHARS = 10  # 48-bit millisecond timestamp
+RANDOM_CHARS = 16  # 80 random bits
+ID_LENGTH = TIME_CHARS + RANDOM_CHARS
+
+_ULID_RE = re.compile(f"^[{ENCODING}]{{{ID_LENGTH}}}$")
+# IDs issued before ULIDs: datetime.now().strftime("%Y%m%d_%H%M%S")
+_LEGACY_RE = re.compile(r"^\d{8}_\d{6}$")
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(ENCODING[index])
+    return "".join(reversed(chars))
+
+
+def new_job_id() -> str:
+    """
+    Returns a new ULID: 26 characters, lexicographically sortable by creation
+    time and unique across concurrent requests. IDs created in the same
+    millisecond by this process increment the random part, so they still sort
+    in creation order.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = int(time.time() * 1000)
+        if now_ms <= _last_ms:
+            now_ms = _last_ms
+            _last_random = (_last_random + 1) % (1 << 80)
+        else:
+            _last_random = int.from_bytes(os.urandom(10), "big")
+        _last_ms = now_ms
+        return _encode(now_ms, TIME_CHARS) + _encode(_last_random, RANDOM_CHARS)
+
+
+def is_ulid(job_id: str) -> bool:
+    return bool(_ULID_RE.match(job_id))
+
+
+def is_legacy_id(job_id: str) -> bool:
+    return bool(_LEGACY_RE.match(job_id))
+
+
+def validate_job_id(job_id: str) -> str:
+    """
+    Returns job_id if it is a ULID or a legacy timestamp ID.
+
+    Raises:
+        ValueError: For anything else, including path components.
+    """
+    if not (is_ulid(job_id) or is_legacy_id(job_id)):
+        raise ValueError(f"Invalid job ID: {job_id!r}")
+    return job_id
@@ -0,0 +1,179 @@
+import time
+import asyncio
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+# Pipeline stages reported to clients, in order
+STAGES = ("queued", "polishing", "scene", "codegen", "simulating", "rendering", "done", "failed")
+
+# Seconds a finished job stays in the registry, and how many are kept at most
+DEFAULT_FINISHED_TTL = 3600.0
+DEFAULT_MAX_FINISHED = 1000
+
+# Job state -> status string of the /status API
+_STATUS = {"queued": "queued", "running": "processing",
+           "completed": "completed", "failed": "failed"}
+
+
+class Job:
+    """
+    In-memory record of a simulation job and its lifecycle.
+
+    States: queued -> running -> completed | failed
+    (prepared jobs generate their scene while running, then wait for a
+    simulation slot: running -> queued -> running -> completed | failed)
+
+    While running, the workflow moves the job through STAGES. Every change is
+    pushed to subscribers (see `subscribe`), so clients follow a job without
+    polling. Updates may come from any thread.
+    """
+
+    def __init__(self, job_id: str, priority: int = 0):
+        self.id = job_id
+        self.priority = priority
+        self.state = "queued"
+        self.stage = "queued"
+        # Percent complete of the current stage and its remaining time, when known
+        self.progress: Optional[float] = None
+        self.eta_seconds: Optional[float] = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Free-form metadata reported by the workflow
+        self.info: Dict[str, Any] = {}
+
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("completed", "failed")
+
+    def set_state(self, state: str, error: Optional[str] = None):
+        self.state = state
+        if state == "running":
+            self.started_at = time.time()
+        elif state in ("completed", "failed"):
+            self.finished_at = time.time()
+            self.error = error
+            self.stage = "done" if state == "completed" else "failed"
+            self.progress = None
+            self.eta_seconds = None
+        self.publish()
+
+    def set_stage(self, stage: str, progress: Optional[float] = None):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown job stage: {stage}")
+        self.stage = stage
+        self.progress = progress
+        self.eta_seconds = None
+        self.publish()
+
+    def report_progress(self, progress: float, eta_seconds: Optional[float] = None, **info):
+        """Updates progress within the current stage (and optionally `info`)."""
+        self.progress = progress
+        self.eta_seconds = eta_seconds
+        self.info.update(info)
+        self.publish()
+
+    def update(self, **info):
+        """Merges workflow metadata into `info` and notifies subscribers."""
+        self.info.update(info)
+        self.publish()
+
+    def status(self) -> Dict[str, Any]:
+        """Client-facing status, as served by /status and the events stream."""
+        status = {"status": _STATUS[self.state], "stage": self.stage}
+        if self.progress is not None:
+            status["progress"] = self.progress
+        if self.eta_seconds is not None:
+            status["eta_seconds"] = self.eta_seconds
+        if self.error is not None:
+            status["error"] = self.error
+        status.update(self.info)
+        return status
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Returns a queue receiving a status snapshot on every change.
+        Must be called from the event loop that will read the queue.
+        """
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[1] is not queue]
+
+    def publish(self):
+        """Pushes the current status to every subscriber."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        status = self.status()
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, status)
+            except RuntimeError:
+                # Subscriber's loop is closed
+                self.unsubscribe(queue)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "stage": self.stage,
+            "progress": self.progress,
+            "eta_seconds": self.eta_seconds,
+            "priority": self.priority,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.info,
+        }
+
+
+class JobRegistry:
+    """
+    Thread-safe map of job IDs to Job records.
+
+    Finished jobs are forgotten `finished_ttl` seconds after they finish, or
+    oldest first beyond `max_finished`; their status is then derived from
+    their artifacts like runs from before a restart.
+    """
+
+    def __init__(self, finished_ttl: float = DEFAULT_FINISHED_TTL,
+                 max_finished: int = DEFAULT_MAX_FINISHED):
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def add(self, job: Job) -> Job:
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if job.done),
+                          key=lambda job: job.finished_at or 0.0)
+        expired = time.time() - self.finished_ttl
+        excess = len(finished) - self.max_finished
+        for index, job in enumerate(finished):
+            if index >= excess and (job.finished_at or 0.0) > expired:
+                break
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def remove(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
@@ -0,0 +1,134 @@
+import os
+import signal
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Default budgets, overridable via SQUISHY_JOB_TIMEOUT, SQUISHY_SIM_CPU_SECONDS,
+# SQUISHY_WORKER_MAX_MEMORY_MB and SQUISHY_MAX_JOB_SECONDS (0 disables a limit)
+DEFAULT_JOB_TIMEOUT = 900.0
+DEFAULT_SIM_CPU_SECONDS = 600.0
+DEFAULT_WORKER_MAX_MEMORY_MB = 4096
+DEFAULT_MAX_JOB_SECONDS = 3600.0
+
+# Values of the `termination_reason` recorded on jobs
+CANCELLED = "cancelled"
+WALL_TIME_LIMIT = "wall_time_limit"
+CPU_TIME_LIMIT = "cpu_time_limit"
+MEMORY_LIMIT = "memory_limit"
+COST_LIMIT = "cost_limit"
+
+# SIGXCPU only aborts the job while a budget set by set_cpu_budget is active
+_cpu_budget_active = False
+
+
+class JobTerminatedError(RuntimeError):
+    """Raised when a job was stopped before finishing; `reason` says why."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class CPUTimeExceededError(JobTerminatedError):
+    """Raised inside a worker when its per-job CPU budget runs out (SIGXCPU)."""
+
+    def __init__(self, message: str = "CPU time limit exceeded"):
+        super().__init__(message, CPU_TIME_LIMIT)
+
+
+class CostLimitExceededError(JobTerminatedError):
+    """Raised at admission when a scene's estimated cost exceeds a limit."""
+
+    def __init__(self, message: str):
+        super().__init__(message, COST_LIMIT)
+
+
+def _env_float(name: str, default: float) -> Optional[float]:
+    value = float(os.environ.get(name, default))
+    return value if value > 0 else None
+
+
+def job_timeout() -> Optional[float]:
+    """Wall-clock seconds a job may run, or None for no limit."""
+    return _env_float("SQUISHY_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT)
+
+
+def sim_cpu_seconds() -> Optional[float]:
+    """CPU seconds a simulation may use, or None for no limit."""
+    return _env_float("SQUISHY_SIM_CPU_SECONDS", DEFAULT_SIM_CPU_SECONDS)
+
+
+def worker_memory_bytes() -> Optional[int]:
+    """Address-space limit of simulation processes, or None for no limit."""
+    mb = _env_float("SQUISHY_WORKER_MAX_MEMORY_MB", DEFAULT_WORKER_MAX_MEMORY_MB)
+    return int(mb * 1024 * 1024) if mb else None
+
+
+def max_job_seconds() -> Optional[float]:
+    """Largest estimated simulation runtime admitted, or None for no limit."""
+    return _env_float("SQUISHY_MAX_JOB_SECONDS", DEFAULT_MAX_JOB_SECONDS)
+
+
+def _soft_limit(kind: int, soft: int):
+    """Sets a soft limit, clamped to (and never lowering) the hard limit."""
+    _, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(kind, (soft, hard))
+
+
+def set_cpu_budget(seconds: Optional[float]):
+    """
+    Lets the calling process use `seconds` more CPU time before it receives
+    SIGXCPU. RLIMIT_CPU counts the whole process lifetime, so the soft limit is
+    set to the current usage plus the budget.
+    """
+    global _cpu_budget_active
+    if resource is None or seconds is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _soft_limit(resource.RLIMIT_CPU, int(usage.ru_utime + usage.ru_stime + seconds) + 1)
+    _cpu_budget_active = True
+
+
+def clear_cpu_budget():
+    global _cpu_budget_active
+    if resource is None:
+        return
+    _cpu_budget_active = False
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def set_memory_limit(max_bytes: Optional[int]):
+    if resource is None or max_bytes is None:
+        return
+    _soft_limit(resource.RLIMIT_AS, max_bytes)
+
+
+def raise_on_sigxcpu():
+    """Turns SIGXCPU (default action: kill) into a CPUTimeExceededError in the main thread."""
+    def handler(signum, frame):
+        if _cpu_budget_active:
+            raise CPUTimeExceededError()
+    if hasattr(signal, "SIGXCPU"):
+        signal.signal(signal.SIGXCPU, handler)
+
+
+def subprocess_limits(cpu_seconds: Optional[float], max_bytes: Optional[int]):
+    """Returns a preexec_fn applying CPU and memory limits to a child process."""
+    def apply():
+        set_cpu_budget(cpu_seconds)
+        set_memory_limit(max_bytes)
+    return apply
+
+
+def termination_from_returncode(returncode: int) -> Optional[JobTerminatedError]:
+    """Maps the exit status of a limited child process to the limit it hit."""
+    if hasattr(signal, "SIGXCPU") and returncode == -signal.SIGXCPU:
+        return CPUTimeExceededError()
+    return None
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from .paths import get_generated_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+
+def normalize_prompt(text: str) -> str:
+    """Collapses whitespace and case so trivially different prompts share an entry."""
+    return " ".join(text.split()).casefold()
+
+
+class LLMResponseCache:
+    """
+    Disk-backed cache of chat-completion responses with an LRU byte limit and a TTL.
+
+    Entries are keyed by model, system-prompt hash, temperature and normalized
+    user text (see `make_key`), and stored in a single SQLite file so the cache
+    survives restarts and is shared by every worker of the server.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10.0)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(kind: str, model: str, system_prompt: str, temperature: float, user_text: str) -> str:
+        """
+        Builds the cache key for one completion.
+
+        Args:
+            kind: Pipeline step the completion belongs to (e.g. "polish", "scene").
+        """
+        system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        payload = json.dumps(
+            [kind, model, system_hash, float(temperature), normalize_prompt(user_text)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """Drops expired entries, then least-recently-used ones until under the byte limit."""
+        self._conn.execute(
+            "DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+_cache = None
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """
+    Returns the shared LLM response cache, or None when disabled with
+    SQUISHY_LLM_CACHE=0. Location, size and TTL are configured via
+    SQUISHY_LLM_CACHE_PATH, SQUISHY_LLM_CACHE_MAX_MB and SQUISHY_LLM_CACHE_TTL.
+    """
+    global _cache
+    if os.environ.get("SQUISHY_LLM_CACHE", "1").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        path = os.environ.get("SQUISHY_LLM_CACHE_PATH") or os.path.join(
+            get_generated_dir(), "_llm_cache.sqlite3")
+        max_mb = os.environ.get("SQUISHY_LLM_CACHE_MAX_MB")
+        ttl = os.environ.get("SQUISHY_LLM_CACHE_TTL")
+        try:
+            _cache = LLMResponseCache(
+                path,
+                max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else DEFAULT_MAX_BYTES,
+                ttl_seconds=float(ttl) if ttl else DEFAULT_TTL_SECONDS,
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"LLM response cache unavailable: {e}")
+            return None
+    return _cache
@@ -0,0 +1,36 @@
+import os
+
+from .job_ids import is_legacy_id, validate_job_id
+
+
+def get_backend_dir() -> str:
+    """Absolute path of the backend/ directory."""
+    # backend/api/paths.py -> backend/api -> backend
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_generated_dir() -> str:
+    """Root directory under which every run's artifacts are written."""
+    if os.environ.get("VERCEL"):
+        # On Vercel, we can only write to /tmp
+        return os.path.join("/tmp", "generated")
+    return os.path.join(get_backend_dir(), "generated")
+
+
+def get_output_dir(job_id: str) -> str:
+    """
+    Directory holding one run's artifacts.
+
+    ULID runs are sharded by the leading characters of their timestamp,
+    generated/<id[:4]>/<id[4:6]>/<id>: a new top-level shard starts about every
+    12 days and holds at most 1024 sub-shards of ~17 minutes each, so no
+    directory grows without bound and old runs stay grouped together.
+    Legacy timestamp IDs keep their flat generated/<id> location.
+
+    Raises:
+        ValueError: If job_id is not a valid job ID.
+    """
+    validate_job_id(job_id)
+    if is_legacy_id(job_id):
+        return os.path.join(get_generated_dir(), job_id)
+    return os.path.join(get_generated_dir(), job_id[:4], job_id[4:6], job_id)
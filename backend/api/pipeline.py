@@ -1,13 +1,15 @@
 import os
 import json
 import logging
-from typing import Optional, Dict, Any
-from openai import OpenAI
+from typing import Optional, Dict, Any, Callable
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 
-from .build_system_prompt import build_scene_system_prompt
+from .build_system_prompt import build_scene_system_prompt, build_fused_scene_system_prompt
+from .llm_cache import LLMResponseCache, get_llm_cache
 from .materials import get_material_table_str
-from .scene_to_code import generate_script_from_scene
+from .scene_to_code import generate_script_from_scene, validate_scene
+from .stream_parser import StreamingJSONParser, SceneStreamState, scene_objects_paths
 
 # Load environment variables
 load_dotenv()
@@ -16,19 +18,29 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# "two_step": polish the prompt, then generate the scene (two round-trips).
+# "fused": one round-trip returning both the polished description and the scene.
+SCENE_MODES = ("two_step", "fused")
+
 
 class SceneGeneratorPipeline:
     """
     Pipeline to generate PyElastica scene specifications (JSON) using Keywords AI.
     """
 
-    def __init__(self, api_key: Optional[str] = None, base_url: str = "https://api.keywordsai.co/api/"):
+    client_class = OpenAI
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = "https://api.keywordsai.co/api/",
+                 cache: Optional[LLMResponseCache] = None, on_step: Optional[Callable[[str], None]] = None):
         """
         Initialize the pipeline with Keywords AI credentials.
 
         Args:
             api_key: Keywords AI API Key. Defaults to KEYWORDSAI_API_KEY env var.
             base_url: Keywords AI API Base URL.
+            cache: LLM response cache. Defaults to the shared on-disk cache.
+            on_step: Called with the step name ("polish", "scene" or "fused")
+                     whenever an LLM step starts.
         """
         self.api_key = os.environ.get("KEYWORDSAI_API_KEY")
         if not self.api_key:
@@ -36,14 +48,18 @@ class SceneGeneratorPipeline:
                 "KEYWORDSAI_API_KEY not found in environment variables.")
 
         # Keywords AI is OpenAI-compatible
-        self.client = OpenAI(
+        self.client = self.client_class(
             api_key=self.api_key,
             base_url=base_url
         )
+        self.cache = cache if cache is not None else get_llm_cache()
+        self.on_step = on_step
 
         # Pre-build the system prompt with materials
         self.material_table = get_material_table_str()
         self.system_prompt = build_scene_system_prompt(self.material_table)
+        self.fused_system_prompt = build_fused_scene_system_prompt(
+            self.material_table)
 
         # System prompt for the prompt polisher
         self.polisher_system_prompt = """
@@ -67,24 +83,108 @@ class SceneGeneratorPipeline:
         Output ONLY the polished prompt text. Do not add conversational filler.
         """
 
+    def _cache_lookup(self, kind: str, system_prompt: str, user_text: str, model: str, temperature: float):
+        """Returns (cache_key, cached_content); both are None when the cache is disabled."""
+        if self.on_step is not None:
+            self.on_step(kind)
+        if self.cache is None:
+            return None, None
+        key = LLMResponseCache.make_key(
+            kind, model, system_prompt, temperature, user_text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM cache hit ({kind})")
+        return key, cached
+
+    def _cache_store(self, key: Optional[str], content: str, parse=None):
+        """Caches a fresh response after `parse` (if given) accepted it."""
+        if parse is not None:
+            parse(content)
+        if key is not None:
+            self.cache.put(key, content)
+
+    @staticmethod
+    def _messages(system_prompt: str, user_text: str):
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_text}
+        ]
+
+    def _check_request(self, mode: str):
+        if mode not in SCENE_MODES:
+            raise ValueError(f"Unknown scene generation mode: {mode}")
+        if not self.client.api_key:
+            raise ValueError(
+                "API Key is missing. Please set KEYWORDSAI_API_KEY.")
+
+    def _complete(self, kind: str, system_prompt: str, user_text: str, model: str, temperature: float,
+                  parse=None, **create_kwargs) -> str:
+        """
+        Runs a chat completion, answering from the response cache when possible.
+
+        Args:
+            kind: Pipeline step, part of the cache key.
+            parse: Optional callable run on the response before it is cached;
+                   if it raises, the response is not cached.
+        """
+        key, cached = self._cache_lookup(
+            kind, system_prompt, user_text, model, temperature)
+        if cached is not None:
+            return cached
+
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=self._messages(system_prompt, user_text),
+            temperature=temperature,
+            **create_kwargs,
+        )
+        content = response.choices[0].message.content
+        self._cache_store(key, content, parse)
+        return content
+
+    def _complete_streaming(self, kind: str, system_prompt: str, user_text: str, model: str, temperature: float,
+                            parser: StreamingJSONParser, parse=None, **create_kwargs) -> str:
+        """
+        Streams a JSON completion into `parser`, which processes each scene object
+        as soon as it is complete. Malformed output raises ValueError and closes
+        the stream immediately instead of after the full response. Like in
+        `_complete`, the full response is only cached if `parse` accepts it.
+        """
+        key, cached = self._cache_lookup(
+            kind, system_prompt, user_text, model, temperature)
+        if cached is not None:
+            # Run cached responses through the same checks as streamed ones
+            parser.feed(cached)
+            parser.close()
+            return cached
+
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=self._messages(system_prompt, user_text),
+            temperature=temperature,
+            stream=True,
+            **create_kwargs,
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parser.feed(chunk.choices[0].delta.content)
+        finally:
+            stream.close()
+
+        parser.close()
+        self._cache_store(key, parser.text, parse)
+        return parser.text
+
     def polish_prompt(self, raw_prompt: str, model: str = "gpt-4o-mini") -> str:
         """
         Refines the user's raw prompt into a technical description.
         """
         logger.info(f"Polishing prompt: {raw_prompt}")
 
-        messages = [
-            {"role": "system", "content": self.polisher_system_prompt},
-            {"role": "user", "content": raw_prompt}
-        ]
-
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0.3,
-            )
-            polished = response.choices[0].message.content.strip()
+            polished = self._complete(
+                "polish", self.polisher_system_prompt, raw_prompt, model, temperature=0.3).strip()
             logger.info(f"Polished prompt: {polished}")
             return polished
         except Exception as e:
@@ -92,20 +192,28 @@ class SceneGeneratorPipeline:
             # Fallback to original prompt if polishing fails
             return raw_prompt
 
-    def generate_scene(self, user_description: str, model: str = "gpt-4o-mini") -> Dict[str, Any]:
+    def generate_scene(self, user_description: str, model: str = "gpt-4o-mini", mode: str = "two_step",
+                       stream: bool = True, on_object=None) -> Dict[str, Any]:
         """
         Generates a JSON scene specification from a natural language description.
 
         Args:
             user_description: The user's request (e.g., "A rubber rod falling under gravity")
             model: The model to use via Keywords AI (default: gpt-4o-mini)
+            mode: "two_step" (polish, then scene) or "fused" (single round-trip)
+            stream: Stream the scene completion and validate each rod as it arrives.
+            on_object: With stream=True, called as on_object(index, rod, dt_estimate)
+                       for every validated rod while the response is still streaming.
 
         Returns:
             A dictionary containing the scene specification.
         """
-        if not self.client.api_key:
-            raise ValueError(
-                "API Key is missing. Please set KEYWORDSAI_API_KEY.")
+        self._check_request(mode)
+
+        if stream:
+            return self._generate_scene_streaming(user_description, model, mode, on_object)
+        if mode == "fused":
+            return self._generate_scene_fused(user_description, model)
 
         # Step 1: Polish the prompt
         polished_description = self.polish_prompt(
@@ -113,26 +221,17 @@ class SceneGeneratorPipeline:
 
         logger.info(f"Generating scene for: {polished_description}")
 
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": polished_description}
-        ]
-
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
+            content = self._complete(
+                "scene", self.system_prompt, polished_description, model,
+                temperature=0.2,  # Low temperature for consistent JSON
+                parse=parse_scene_response,  # Never cache malformed or invalid scenes
                 # Enforce JSON mode if supported
                 response_format={"type": "json_object"},
-                temperature=0.2,  # Low temperature for consistent JSON
             )
-
-            content = response.choices[0].message.content
             logger.debug(f"Raw response: {content}")
 
-            # Parse JSON
-            scene_data = json.loads(content)
-            return scene_data
+            return parse_scene_response(content)
 
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {e}")
@@ -141,8 +240,225 @@ class SceneGeneratorPipeline:
             logger.error(f"Error communicating with Keywords AI: {e}")
             raise
 
+    def _generate_scene_fused(self, user_description: str, model: str) -> Dict[str, Any]:
+        """
+        Polishes the description and generates the scene in one completion.
+        """
+        logger.info(f"Generating scene (fused) for: {user_description}")
+
+        try:
+            content = self._complete(
+                "fused", self.fused_system_prompt, user_description, model,
+                temperature=0.2,
+                parse=parse_fused_response,  # Never cache malformed output
+                response_format={"type": "json_object"},
+            )
+            logger.debug(f"Raw response: {content}")
+
+            polished_description, scene_data = parse_fused_response(content)
+            logger.info(f"Polished prompt: {polished_description}")
+            return scene_data
+
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Failed to parse fused response: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error communicating with Keywords AI: {e}")
+            raise
+
+    def _generate_scene_streaming(self, user_description: str, model: str, mode: str, on_object=None) -> Dict[str, Any]:
+        """Streamed variant of the scene step (both modes)."""
+        fused = mode == "fused"
+        parser = StreamingJSONParser(
+            scene_objects_paths(fused), SceneStreamState(on_object))
+
+        try:
+            if fused:
+                logger.info(f"Streaming scene (fused) for: {user_description}")
+                content = self._complete_streaming(
+                    "fused", self.fused_system_prompt, user_description, model,
+                    temperature=0.2, parser=parser, parse=parse_fused_response,
+                    response_format={"type": "json_object"},
+                )
+                polished_description, scene_data = parse_fused_response(content)
+                logger.info(f"Polished prompt: {polished_description}")
+                return scene_data
+
+            polished_description = self.polish_prompt(
+                user_description, model=model)
+            logger.info(f"Streaming scene for: {polished_description}")
+            content = self._complete_streaming(
+                "scene", self.system_prompt, polished_description, model,
+                temperature=0.2, parser=parser, parse=parse_scene_response,
+                response_format={"type": "json_object"},
+            )
+            return parse_scene_response(content)
+
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Aborted scene stream: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error communicating with Keywords AI: {e}")
+            raise
+
     def generate_python_script(self, scene_data: Dict[str, Any]) -> str:
         """
         Converts a JSON scene specification into a PyElastica Python script.
         """
         return generate_script_from_scene(scene_data)
+
+
+class AsyncSceneGeneratorPipeline(SceneGeneratorPipeline):
+    """
+    Asynchronous variant of SceneGeneratorPipeline built on AsyncOpenAI.
+
+    Waiting on the LLM costs no thread, so many in-flight generations can share
+    a single event loop. Prompts, caching and modes match the sync pipeline.
+    """
+
+    client_class = AsyncOpenAI
+
+    async def _complete(self, kind: str, system_prompt: str, user_text: str, model: str, temperature: float,
+                        parse=None, **create_kwargs) -> str:
+        key, cached = self._cache_lookup(
+            kind, system_prompt, user_text, model, temperature)
+        if cached is not None:
+            return cached
+
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=self._messages(system_prompt, user_text),
+            temperature=temperature,
+            **create_kwargs,
+        )
+        content = response.choices[0].message.content
+        self._cache_store(key, content, parse)
+        return content
+
+    async def _complete_streaming(self, kind: str, system_prompt: str, user_text: str, model: str,
+                                  temperature: float, parser: StreamingJSONParser, parse=None,
+                                  **create_kwargs) -> str:
+        key, cached = self._cache_lookup(
+            kind, system_prompt, user_text, model, temperature)
+        if cached is not None:
+            parser.feed(cached)
+            parser.close()
+            return cached
+
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=self._messages(system_prompt, user_text),
+            temperature=temperature,
+            stream=True,
+            **create_kwargs,
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parser.feed(chunk.choices[0].delta.content)
+        finally:
+            await stream.close()
+
+        parser.close()
+        self._cache_store(key, parser.text, parse)
+        return parser.text
+
+    async def polish_prompt(self, raw_prompt: str, model: str = "gpt-4o-mini") -> str:
+        logger.info(f"Polishing prompt: {raw_prompt}")
+
+        try:
+            polished = (await self._complete(
+                "polish", self.polisher_system_prompt, raw_prompt, model, temperature=0.3)).strip()
+            logger.info(f"Polished prompt: {polished}")
+            return polished
+        except Exception as e:
+            logger.error(f"Error polishing prompt: {e}")
+            # Fallback to original prompt if polishing fails
+            return raw_prompt
+
+    async def generate_scene(self, user_description: str, model: str = "gpt-4o-mini", mode: str = "two_step",
+                             stream: bool = True, on_object=None) -> Dict[str, Any]:
+        self._check_request(mode)
+        fused = mode == "fused"
+        parser = StreamingJSONParser(
+            scene_objects_paths(fused), SceneStreamState(on_object)) if stream else None
+
+        try:
+            if fused:
+                logger.info(f"Generating scene (fused) for: {user_description}")
+                if stream:
+                    content = await self._complete_streaming(
+                        "fused", self.fused_system_prompt, user_description, model,
+                        temperature=0.2, parser=parser, parse=parse_fused_response,
+                        response_format={"type": "json_object"},
+                    )
+                else:
+                    content = await self._complete(
+                        "fused", self.fused_system_prompt, user_description, model,
+                        temperature=0.2,
+                        parse=parse_fused_response,
+                        response_format={"type": "json_object"},
+                    )
+                polished_description, scene_data = parse_fused_response(content)
+                logger.info(f"Polished prompt: {polished_description}")
+                return scene_data
+
+            polished_description = await self.polish_prompt(
+                user_description, model=model)
+            logger.info(f"Generating scene for: {polished_description}")
+            if stream:
+                content = await self._complete_streaming(
+                    "scene", self.system_prompt, polished_description, model,
+                    temperature=0.2, parser=parser, parse=parse_scene_response,
+                    response_format={"type": "json_object"},
+                )
+            else:
+                content = await self._complete(
+                    "scene", self.system_prompt, polished_description, model,
+                    temperature=0.2,
+                    parse=parse_scene_response,
+                    response_format={"type": "json_object"},
+                )
+            return parse_scene_response(content)
+
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Failed to parse scene response: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error communicating with Keywords AI: {e}")
+            raise
+
+
+def parse_scene_response(content: str) -> Dict[str, Any]:
+    """
+    Parses a scene-step response and checks that the scene can be simulated.
+
+    Raises:
+        ValueError: If the response is not JSON or not a valid scene.
+    """
+    scene_data = json.loads(content)
+    if not isinstance(scene_data, dict):
+        raise ValueError("Scene response is not a JSON object")
+    validate_scene(scene_data)
+    return scene_data
+
+
+def parse_fused_response(content: str):
+    """
+    Splits a fused-mode response into (polished_description, scene_data).
+
+    Raises:
+        ValueError: If the response does not contain a valid scene object.
+    """
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("Fused response is not a JSON object")
+    scene_data = data.get("scene")
+    if scene_data is None and "objects" in data:
+        # The model skipped the wrapper and emitted the scene directly
+        scene_data = {k: v for k, v in data.items() if k !=
+                      "polished_description"}
+    if not isinstance(scene_data, dict):
+        raise ValueError("Fused response has no 'scene' object")
+    validate_scene(scene_data)
+    return data.get("polished_description", ""), scene_data
@@ -0,0 +1,145 @@
+"""
+Compact binary trajectory payload for client-side playback (e.g. WebGL).
+
+    magic (8 bytes) | version (uint32) | header length (uint32)
+    | JSON header (padded to 8 bytes) | times | frames
+
+All numbers are little-endian. `times` holds one float32 per frame. Frames
+follow in order, each holding every rod's nodes as interleaved x, y, z
+(n_nodes, 3), ready to upload as a vertex buffer. With the "float32"
+encoding positions are stored as is; with "uint16" each coordinate is
+quantized over the run's bounds and decodes as `min + q * scale` per axis.
+
+The header gives the encoding, frame count, fps, frame stride, the byte
+offsets of the times and frames, the bytes per frame, each rod's node count
+and byte offset within a frame, and the bounds (and scale for uint16).
+Frames are emitted in chunks, so payloads of long runs stream with bounded
+memory and clients can start playing before the download finishes.
+"""
+import json
+import struct
+from typing import Any, Dict, Iterator
+
+import numpy as np
+
+from .trajectory import Trajectory
+
+MAGIC = b"SQPLAY\x00\x00"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+
+ENCODINGS = {"float32": np.dtype("<f4"), "uint16": np.dtype("<u2")}
+
+# Frames encoded per chunk of the payload
+CHUNK_FRAMES = 64
+
+_UINT16_MAX = np.iinfo(np.uint16).max
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // 8) * 8
+
+
+def _bounds(trajectory: Trajectory):
+    """Per-axis min and max of every finite position, read chunk by chunk."""
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    for index in range(len(trajectory.rods)):
+        positions = trajectory.positions(index)
+        for start in range(0, trajectory.n_frames, CHUNK_FRAMES):
+            chunk = np.asarray(positions[start:start + CHUNK_FRAMES], dtype=float)
+            chunk = np.where(np.isfinite(chunk), chunk, np.nan)
+            low = np.fmin(low, np.fmin.reduce(chunk, axis=(0, 2)))
+            high = np.fmax(high, np.fmax.reduce(chunk, axis=(0, 2)))
+    if not np.all(np.isfinite(low)):
+        low = high = np.zeros(3)
+    return low, high
+
+
+def playback_header(trajectory: Trajectory, encoding: str = "float32",
+                    stride: int = 1) -> Dict[str, Any]:
+    """
+    Header of the playback payload of a trajectory.
+
+    Raises:
+        ValueError: If the encoding or stride is not supported.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding '{encoding}', expected one of {tuple(ENCODINGS)}")
+    if stride < 1:
+        raise ValueError("stride must be at least 1")
+    dtype = ENCODINGS[encoding]
+
+    n_frames = len(range(0, trajectory.n_frames, stride))
+    rods, frame_bytes = [], 0
+    for index in range(len(trajectory.rods)):
+        n_nodes = trajectory.positions(index).shape[-1]
+        rods.append({"n_nodes": n_nodes, "offset": frame_bytes})
+        frame_bytes += 3 * n_nodes * dtype.itemsize
+
+    low, high = _bounds(trajectory)
+    header = {
+        "version": FORMAT_VERSION,
+        "encoding": encoding,
+        "layout": "frame, rod, node, xyz",
+        "n_frames": n_frames,
+        "fps": trajectory.fps / stride,
+        "stride": stride,
+        "complete": trajectory.complete,
+        "frame_bytes": frame_bytes,
+        "rods": rods,
+        "bounds": {"min": low.tolist(), "max": high.tolist()},
+    }
+    if encoding == "uint16":
+        header["scale"] = ((high - low) / _UINT16_MAX).tolist()
+
+    # Offsets depend on the header length, which depends on the offsets
+    header_length = 0
+    while True:
+        header["times_offset"] = _aligned(_PREAMBLE.size + header_length)
+        header["frames_offset"] = _aligned(header["times_offset"] + 4 * n_frames)
+        if len(json.dumps(header)) <= header_length:
+            return header
+        header_length = len(json.dumps(header))
+
+
+def _encode_frames(positions: np.ndarray, header: Dict[str, Any]) -> bytes:
+    """(frames, 3, n_nodes) positions -> (frames, n_nodes, 3) in the payload encoding."""
+    nodes = np.swapaxes(positions, 1, 2)
+    if header["encoding"] == "float32":
+        return np.ascontiguousarray(nodes, dtype="<f4").tobytes()
+    low = np.array(header["bounds"]["min"])
+    scale = np.array(header["scale"])
+    scale[scale == 0] = 1.0
+    quantized = np.rint((np.nan_to_num(nodes, nan=0.0) - low) / scale)
+    return np.clip(quantized, 0, _UINT16_MAX).astype("<u2").tobytes()
+
+
+def encode_playback(trajectory: Trajectory, header: Dict[str, Any]) -> Iterator[bytes]:
+    """Yields the playback payload of a trajectory in chunks, given its `playback_header`."""
+    times_offset, frames_offset = header["times_offset"], header["frames_offset"]
+    encoded = json.dumps(header).encode("utf-8")
+    yield _PREAMBLE.pack(MAGIC, FORMAT_VERSION, times_offset - _PREAMBLE.size)
+    yield encoded.ljust(times_offset - _PREAMBLE.size)
+
+    stride = header["stride"]
+    frames = range(0, header["n_frames"] * stride, stride)
+    times = np.asarray(trajectory.times[::stride][:len(frames)], dtype="<f4").tobytes()
+    yield times.ljust(frames_offset - times_offset, b"\0")
+
+    rods = [trajectory.positions(index) for index in range(len(trajectory.rods))]
+    if not rods:
+        return
+    for first in range(0, len(frames), CHUNK_FRAMES):
+        selected = frames[first:first + CHUNK_FRAMES]
+        chunk = slice(selected.start, selected.stop, stride)
+        # (frames, bytes per frame) per rod, interleaved into whole frames
+        encoded_rods = [np.frombuffer(_encode_frames(np.asarray(rod[chunk]), header),
+                                      dtype=np.uint8).reshape(len(selected), -1)
+                        for rod in rods]
+        yield np.concatenate(encoded_rods, axis=1).tobytes()
+
+
+def payload_size(header: Dict[str, Any]) -> int:
+    """Bytes of the payload described by a header."""
+    return header["frames_offset"] + header["n_frames"] * header["frame_bytes"]
@@ -0,0 +1,323 @@
+"""
+On-demand rendering of run trajectories, cached by content.
+
+Nothing is rendered when a simulation finishes. The first request for a GIF,
+video or frame of a run renders it with elastica_render.py into
+`generated/_cache/render-<key>/`, where the key hashes the trajectory
+file's content, the render parameters (format, size, dpi, camera, fps,
+renderer, quality, frame) and the renderer sources. Later requests, from
+this run or any run with an identical trajectory, are served from there;
+a different size or camera only costs a render, never a simulation.
+Concurrent requests for the same key share one render (single flight), and
+at most SQUISHY_MAX_RENDERS renders run at a time.
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from . import limits
+from .artifact_store import get_artifact_store
+from .fast_render import AZIMUTH, DEFAULT_RENDERER, DPI, ELEVATION, FRAME_SIZE, RENDERERS
+from .paths import get_backend_dir, get_generated_dir
+from .trajectory import LEGACY_FILENAME, TRAJECTORY_FILENAME, open_trajectory
+from .video import VIDEO_FORMATS, video_quality
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("gif", "png", *VIDEO_FORMATS)
+
+DEFAULT_MAX_RENDERS = 2
+
+# Prefix of render entries among the result cache entries in generated/_cache
+ENTRY_PREFIX = "render-"
+
+# Sources that determine what a trajectory renders to
+RENDER_SOURCES = ("elastica_render.py", "fast_render.py", "video.py", "trajectory.py")
+
+# Lines of the renderer's log reported when it fails
+LOG_TAIL_LINES = 20
+
+_HASH_BLOCK = 1024 * 1024
+
+# Trajectory digests remembered, least recently used forgotten first
+DIGEST_CACHE_SIZE = 256
+
+
+class RenderError(RuntimeError):
+    """Raised when the renderer fails on a trajectory."""
+
+
+class RenderParams(NamedTuple):
+    """What to render: output format, frame size, text scale, camera and frame rate."""
+    format: str = "gif"
+    width: int = FRAME_SIZE[0]
+    height: int = FRAME_SIZE[1]
+    dpi: float = DPI
+    elevation: float = ELEVATION
+    azimuth: float = AZIMUTH
+    # Frames per second, at most the recorded rate; None plays every recorded frame
+    fps: Optional[float] = None
+    renderer: Optional[str] = None
+    # Video quality preset (videos only)
+    quality: Optional[str] = None
+    # Frame index (PNG only)
+    frame: Optional[int] = None
+
+    def resolve(self) -> "RenderParams":
+        """
+        Fills in the configured renderer and video quality and drops the
+        parameters that do not apply to the format.
+
+        Raises:
+            ValueError: If a parameter is invalid for the format.
+        """
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown format '{self.format}', expected one of {FORMATS}")
+        renderer = self.renderer or os.environ.get("SQUISHY_RENDERER", DEFAULT_RENDERER)
+        if renderer not in RENDERERS:
+            raise ValueError(f"Unknown renderer '{renderer}', expected one of {RENDERERS}")
+        if self.width < 16 or self.height < 16:
+            raise ValueError("Frames must be at least 16x16 pixels")
+        if self.dpi <= 0:
+            raise ValueError("dpi must be positive")
+        if self.fps is not None and self.fps <= 0:
+            raise ValueError("fps must be positive")
+
+        video = self.format in VIDEO_FORMATS
+        if video and (self.width % 2 or self.height % 2):
+            # yuv420p subsamples chroma by 2 in both directions
+            raise ValueError("Video frames must have an even width and height")
+        if self.format == "png":
+            if self.frame is None:
+                raise ValueError("A frame index is required for PNG output")
+        elif self.frame is not None:
+            raise ValueError("A frame index only applies to PNG output")
+        return self._replace(
+            renderer=renderer,
+            fps=None if self.format == "png" else self.fps,
+            quality=video_quality(self.quality) if video else None)
+
+    @property
+    def filename(self) -> str:
+        return f"render.{self.format}"
+
+    def command(self, trajectory_path: str, output_dir: str, workers: int):
+        """Renderer command writing this output to `output_dir`/`filename`."""
+        renderer_path = os.path.join(get_backend_dir(), "api", "elastica_render.py")
+        cmd = [sys.executable, renderer_path, trajectory_path,
+               "--renderer", self.renderer, "--workers", str(workers),
+               "--output", os.path.join(output_dir, "render"),
+               "--size", f"{self.width}x{self.height}", "--dpi", f"{self.dpi:g}",
+               "--elev", f"{self.elevation:g}", "--azim", f"{self.azimuth:g}"]
+        if self.format == "png":
+            return cmd + ["--frame", str(self.frame)]
+        cmd += ["--format", self.format]
+        if self.fps is not None:
+            cmd += ["--fps", repr(self.fps)]
+        if self.quality is not None:
+            cmd += ["--quality", self.quality]
+        return cmd
+
+
+def _render_fingerprint() -> str:
+    digest = hashlib.sha256()
+    api_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in RENDER_SOURCES:
+        path = os.path.join(api_dir, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+_RENDER_FINGERPRINT = _render_fingerprint()
+
+
+def trajectory_path(output_dir: str) -> str:
+    """
+    The trajectory file of a run directory (or its legacy pickle).
+
+    Raises:
+        FileNotFoundError: If the run has no recorded trajectory.
+    """
+    for name in (TRAJECTORY_FILENAME, LEGACY_FILENAME):
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No trajectory in {output_dir}")
+
+
+class RenderCache:
+    """
+    Content-addressed store of rendered outputs, see the module docstring.
+
+    Entries are built in a `.staging-*` directory and renamed into place, so
+    a partial output is never served. `render` must be awaited on the
+    server's event loop.
+    """
+
+    def __init__(self, cache_dir: str, max_renders: int = DEFAULT_MAX_RENDERS):
+        self.cache_dir = cache_dir
+        self.max_renders = max_renders
+        # Renderer processes per render, sharing the CPUs between concurrent renders
+        self.workers = max(1, (os.cpu_count() or 1) // max_renders)
+        self._semaphore = asyncio.Semaphore(max_renders)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # (path, inode, size, mtime) -> content digest of completed trajectories
+        self._digests: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._digests_lock = threading.Lock()
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, ENTRY_PREFIX + key)
+
+    def _digest(self, path: str) -> str:
+        st = os.stat(path)
+        stamp = (path, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._digests_lock:
+            digest = self._digests.get(stamp)
+            if digest is not None:
+                self._digests.move_to_end(stamp)
+        if digest is None:
+            hasher = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+                    hasher.update(block)
+            digest = hasher.hexdigest()
+            with self._digests_lock:
+                self._digests[stamp] = digest
+                while len(self._digests) > DIGEST_CACHE_SIZE:
+                    self._digests.popitem(last=False)
+        return digest
+
+    def prepare(self, output_dir: str, params: RenderParams) -> Tuple[str, RenderParams, str]:
+        """
+        Resolves a request for a run's trajectory. Blocking (hashes the
+        trajectory on first use). Returns (trajectory path, params, key).
+
+        Raises:
+            FileNotFoundError: If the run has no complete trajectory yet.
+            ValueError: If the parameters are invalid for the trajectory.
+        """
+        params = params.resolve()
+        path = trajectory_path(output_dir)
+        trajectory = open_trajectory(output_dir)
+        if not trajectory.complete:
+            raise FileNotFoundError(f"Trajectory in {output_dir} is still being recorded")
+        if params.frame is not None and not 0 <= params.frame < trajectory.n_frames:
+            raise ValueError(f"Frame {params.frame} out of range (0-{trajectory.n_frames - 1})")
+        if params.fps is not None:
+            # The renderer keeps every n-th frame; equivalent rates share an entry
+            step = max(1, round(trajectory.fps / params.fps))
+            params = params._replace(fps=None if step == 1 else trajectory.fps / step)
+
+        key = hashlib.sha256(json.dumps(
+            {"renderer": _RENDER_FINGERPRINT, "trajectory": self._digest(path),
+             "params": params._asdict()},
+            sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+        return path, params, key
+
+    def lookup(self, key: str, params: RenderParams) -> Optional[str]:
+        """Returns the path of a rendered output, or None."""
+        path = os.path.join(self.entry_dir(key), params.filename)
+        return path if os.path.exists(path) else None
+
+    async def render(self, output_dir: str, params: RenderParams) -> str:
+        """
+        Returns the path of a run's output for `params`, rendering it unless
+        it is cached. Raises like `prepare`, or RenderError.
+        """
+        traj_path, params, key = await asyncio.to_thread(self.prepare, output_dir, params)
+        path = self.lookup(key, params)
+        if path is not None:
+            get_artifact_store().touch_path(self.entry_dir(key))
+            return path
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(traj_path, params, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # A disconnecting client does not cancel the render others wait for
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Marks the exception retrieved when every waiter has gone
+            task.exception()
+
+    async def _render(self, traj_path: str, params: RenderParams, key: str) -> str:
+        async with self._semaphore:
+            # Rendered by someone else while this request waited for a slot
+            path = self.lookup(key, params)
+            if path is not None:
+                return path
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            staging = tempfile.mkdtemp(prefix=".staging-", dir=self.cache_dir)
+            try:
+                await self._run(params.command(traj_path, staging, self.workers),
+                                os.path.join(staging, "render.log"))
+                if not os.path.exists(os.path.join(staging, params.filename)):
+                    raise RenderError(f"Renderer produced no {params.format.upper()}:\n"
+                                      f"{_log_tail(os.path.join(staging, 'render.log'))}")
+                entry = self.entry_dir(key)
+                os.rename(staging, entry)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+        get_artifact_store().finish(entry)
+        return os.path.join(entry, params.filename)
+
+    @staticmethod
+    async def _run(cmd, log_path: str):
+        """Runs the renderer under the job limits; killed if the render is cancelled."""
+        with open(log_path, "w") as log_file:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=log_file, stderr=asyncio.subprocess.STDOUT,
+                preexec_fn=limits.subprocess_limits(limits.sim_cpu_seconds(),
+                                                    limits.worker_memory_bytes()))
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                await asyncio.shield(process.wait())
+                raise
+        if returncode != 0:
+            terminated = limits.termination_from_returncode(returncode)
+            if terminated is not None:
+                raise terminated
+            raise RenderError(f"Renderer exited with {returncode}:\n{_log_tail(log_path)}")
+
+
+def _log_tail(log_path: str) -> str:
+    try:
+        with open(log_path, "r", errors="replace") as f:
+            return "".join(f.readlines()[-LOG_TAIL_LINES:]).strip()
+    except OSError:
+        return ""
+
+
+_render_cache = None
+
+
+def get_render_cache() -> RenderCache:
+    """
+    Returns the process-wide render cache. Concurrent renders are limited
+    via SQUISHY_MAX_RENDERS (default 2).
+    """
+    global _render_cache
+    if _render_cache is None:
+        max_renders = int(os.environ.get("SQUISHY_MAX_RENDERS", DEFAULT_MAX_RENDERS))
+        _render_cache = RenderCache(os.path.join(get_generated_dir(), "_cache"),
+                                    max_renders=max(1, max_renders))
+    return _render_cache
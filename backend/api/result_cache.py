@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from typing import Optional, Dict, Any
+
+from .paths import get_generated_dir
+from .scene_to_code import normalize_scene
+from .trajectory import TRAJECTORY_FILENAME
+from .video import VIDEO_FORMATS, video_filename
+
+logger = logging.getLogger(__name__)
+
+# Artifacts a completed run must have for it to be reusable; renders are
+# cached separately, keyed by the trajectory (see render_cache)
+CACHED_ARTIFACTS = (TRAJECTORY_FILENAME,)
+# Artifacts reused along with them when the run produced them (runs from
+# before rendering was on request)
+OPTIONAL_ARTIFACTS = ("simulation.gif", *(video_filename(fmt) for fmt in VIDEO_FORMATS))
+
+# Fields that stay integers in the canonical form; every other number is a float
+INTEGER_FIELDS = ("n_elem", "rod_a_index", "rod_b_index")
+
+# Significant digits kept when normalizing floats
+FLOAT_DIGITS = 12
+
+# Sources that determine what a scene simulates to; editing any of them
+# changes every hash so stale results are never served.
+ENGINE_SOURCES = ("templates.py", "scene_to_code.py", "scene_runner.py",
+                  "materials.py", "trajectory.py")
+
+
+def _engine_fingerprint() -> str:
+    digest = hashlib.sha256()
+    api_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in ENGINE_SOURCES:
+        path = os.path.join(api_dir, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+_ENGINE_FINGERPRINT = _engine_fingerprint()
+
+
+def _normalize_numbers(value, key: Optional[str] = None):
+    if isinstance(value, dict):
+        return {k: _normalize_numbers(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize_numbers(v, key) for v in value]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    if key in INTEGER_FIELDS and float(value).is_integer():
+        return int(value)
+    normalized = float(f"{value:.{FLOAT_DIGITS}g}")
+    # Avoid distinct hashes for -0.0 and 0.0
+    return normalized + 0.0
+
+
+def canonicalize_scene(scene_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the canonical form of a scene: every default filled in the way
+    scene_to_code fills it, and every number normalized.
+    """
+    return _normalize_numbers(normalize_scene(scene_data))
+
+
+def hash_scene(scene_data: Dict[str, Any]) -> str:
+    """Content hash of the canonical scene JSON (sorted keys, compact separators)."""
+    canonical = json.dumps(
+        {"engine": _ENGINE_FINGERPRINT, "scene": canonicalize_scene(scene_data)},
+        sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Hard links are not possible across devices or on some filesystems
+        shutil.copy2(src, dst)
+
+
+def _present(directory: str, names) -> tuple:
+    return tuple(name for name in names if os.path.exists(os.path.join(directory, name)))
+
+
+class ResultCache:
+    """
+    Content-addressed store of completed simulation artifacts.
+
+    Entries live in `<cache_dir>/<hash>/` and are hard-linked into run
+    directories, so a hit costs no simulation and no extra disk.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def entry_dir(self, scene_hash: str) -> str:
+        return os.path.join(self.cache_dir, scene_hash)
+
+    def lookup(self, scene_hash: str) -> Optional[str]:
+        """Returns the entry directory if every cached artifact is present."""
+        entry = self.entry_dir(scene_hash)
+        for name in CACHED_ARTIFACTS:
+            if not os.path.exists(os.path.join(entry, name)):
+                return None
+        return entry
+
+    def restore(self, scene_hash: str, output_dir: str) -> bool:
+        """Links a cached result into `output_dir`. Returns False on a miss."""
+        entry = self.lookup(scene_hash)
+        if entry is None:
+            return False
+        linked = []
+        try:
+            for name in CACHED_ARTIFACTS + _present(entry, OPTIONAL_ARTIFACTS):
+                path = os.path.join(output_dir, name)
+                _link_or_copy(os.path.join(entry, name), path)
+                linked.append(path)
+        except OSError as e:
+            # Entry evicted while we were linking it; treat as a miss. The
+            # simulation that follows must not write into the cache's files.
+            logger.warning(f"Failed to restore cached result {scene_hash}: {e}")
+            for path in linked:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            return False
+        return True
+
+    def store(self, scene_hash: str, output_dir: str):
+        """Adds the artifacts of a completed run to the cache."""
+        if self.lookup(scene_hash) is not None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.cache_dir)
+        try:
+            for name in CACHED_ARTIFACTS + _present(output_dir, OPTIONAL_ARTIFACTS):
+                _link_or_copy(os.path.join(output_dir, name),
+                              os.path.join(staging, name))
+            # Publish atomically; a concurrent identical run may have won the race
+            os.rename(staging, self.entry_dir(scene_hash))
+        except OSError as e:
+            logger.info(f"Not caching result {scene_hash}: {e}")
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def get_result_cache() -> ResultCache:
+    return ResultCache(os.path.join(get_generated_dir(), "_cache"))
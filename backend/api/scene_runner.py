@@ -0,0 +1,166 @@
+import os
+from typing import Dict, Any, Optional
+
+from . import templates
+from .materials import MATERIALS_DB
+from .trajectory import TRAJECTORY_FILENAME, TrajectoryWriter
+from .scene_to_code import (
+    compute_frame_count,
+    compute_step_skip,
+    compute_time_step,
+    map_offset,
+    validate_scene,
+)
+
+
+class SceneRunner:
+    """
+    Builds a PyElastica simulator directly from a scene dict by calling the
+    template helpers, without generating or executing a Python script.
+
+    The simulator is assembled in exactly the same order and with exactly the
+    same values as the script produced by `generate_script_from_scene`, so both
+    paths integrate the same system.
+    """
+
+    def __init__(self, scene_data: Dict[str, Any]):
+        self.scene = validate_scene(scene_data)
+        self.dt = compute_time_step(self.scene)
+        self.final_time = self.scene["render"]["duration"]
+        self.fps = self.scene["render"]["fps"]
+
+        self.sim = None
+        self.rods = []
+        self.history_list = []
+
+    def build(self, writer: Optional[TrajectoryWriter] = None):
+        """
+        Creates the simulator with all rods, constraints, forces, joints and
+        recorders. Histories are kept in memory (`history_list`), or streamed
+        to `writer` if one is given.
+        """
+        sim = templates.create_simulator()
+        dt = self.dt
+        rods = []
+
+        for obj in self.scene["objects"]:
+            mat_props = MATERIALS_DB[obj["material"]]
+            rod = templates.make_rod(
+                sim,
+                n_elem=obj["n_elem"],
+                length=obj["length"],
+                radius=obj["radius"],
+                density=mat_props["density"],
+                youngs_modulus=mat_props["youngs_modulus"],
+                poisson_ratio=mat_props["poisson_ratio"],
+                start=obj["start"],
+                direction=obj["direction"],
+                normal=obj["normal"],
+                velocity=obj["velocity"],
+                omega=obj["omega"],
+                nu=obj["nu"],
+                dt=dt,
+            )
+            rods.append(rod)
+
+            for constraint in obj["constraints"]:
+                if constraint == "clamped_start":
+                    templates.clamp_start(sim, rod)
+                elif constraint == "clamped_end":
+                    templates.clamp_end(sim, rod)
+
+            for params in obj["forces"]:
+                force_type = params["type"]
+                if force_type == "gravity":
+                    templates.add_gravity(
+                        sim, rod, g=1.0, direction=list(params["acc"]))
+                elif force_type == "endpoint_force":
+                    templates.add_endpoint_force(
+                        sim, rod, force=list(params["force"]), ramp_up_time=params["ramp"])
+                elif force_type == "muscle_activity":
+                    templates.add_muscle_activity(
+                        sim, rod,
+                        amplitude=params["amplitude"],
+                        wave_length=params["wave_length"],
+                        frequency=params["frequency"],
+                        phase=params["phase"],
+                        ramp=params["ramp"],
+                    )
+                elif force_type == "anisotropic_friction":
+                    templates.add_anisotropic_friction(
+                        sim, rod,
+                        static_friction=list(params["static_friction"]),
+                        kinetic_friction=list(params["kinetic_friction"]),
+                        plane_normal=list(params["plane_normal"]),
+                        plane_origin=list(params["plane_origin"]),
+                    )
+
+        for conn in self.scene["connections"]:
+            rod_a = rods[conn["rod_a_index"]]
+            rod_b = rods[conn["rod_b_index"]]
+            idx_one = map_offset(conn["offset_a"])
+            idx_two = map_offset(conn["offset_b"])
+
+            if conn["type"] == "spherical_joint":
+                templates.connect_spherical(
+                    sim, rod_a, rod_b, index_one=idx_one, index_two=idx_two)
+            elif conn["type"] == "hinge_joint":
+                templates.connect_hinge(
+                    sim, rod_a, rod_b, index_one=idx_one, index_two=idx_two, normal=conn["normal"])
+            else:
+                templates.connect_fixed(
+                    sim, rod_a, rod_b, index_one=idx_one, index_two=idx_two)
+
+        step_skip = compute_step_skip(self.scene, dt)
+        if writer is None:
+            self.history_list = [
+                templates.record_history(sim, rod, step_skip=step_skip,
+                                         n_frames=compute_frame_count(self.scene, dt))
+                for rod in rods
+            ]
+        else:
+            for index, rod in enumerate(rods):
+                templates.record_trajectory(sim, rod, writer, index, step_skip=step_skip)
+        self.sim = sim
+        self.rods = rods
+        return sim
+
+    def _integrate(self, progress_callback=None):
+        total_steps = int(self.final_time / self.dt)
+        print(
+            f'Running simulation for {self.final_time}s ({total_steps} steps)...')
+        templates.finalize_and_integrate(
+            self.sim, final_time=self.final_time, total_steps=total_steps,
+            progress_callback=progress_callback)
+
+    def run(self, progress_callback=None) -> Dict[str, Any]:
+        """
+        Integrates the scene and returns the recorded data:
+        {'rods': [history, ...], 'metadata': {'fps': ...}}.
+
+        progress_callback is passed on to `finalize_and_integrate`.
+        """
+        if self.sim is None:
+            self.build()
+        self._integrate(progress_callback)
+        return {'rods': self.history_list, 'metadata': {'fps': self.fps}}
+
+    def run_to_file(self, output_dir: str, filename: str = TRAJECTORY_FILENAME,
+                    progress_callback=None, dtype: Optional[str] = None) -> str:
+        """
+        Runs the scene, streaming the trajectory next to where the script
+        would have written it. `dtype` is the storage dtype of positions
+        (see trajectory.py). If the run fails, the frames recorded so far
+        stay readable.
+        """
+        data_path = os.path.join(output_dir, filename)
+        writer = TrajectoryWriter(
+            data_path, n_frames=compute_frame_count(self.scene, self.dt),
+            n_nodes=[obj["n_elem"] + 1 for obj in self.scene["objects"]],
+            metadata={'fps': self.fps}, dtype=dtype)
+        with writer:
+            self.build(writer=writer)
+            self._integrate(progress_callback)
+            print(f'Saving results to {filename}...')
+        print('Done.')
+        return data_path
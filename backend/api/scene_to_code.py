@@ -1,7 +1,311 @@
-import json
 import os
+import math
 from typing import Dict, Any, List
 from .materials import MATERIALS_DB
+from .trajectory import TRAJECTORY_FILENAME
+
+# Modules inlined into generated scripts, in order
+INLINED_MODULES = ("templates.py", "trajectory.py")
+
+CONSTRAINT_TYPES = ("clamped_start", "clamped_end")
+JOINT_TYPES = ("fixed_joint", "spherical_joint", "hinge_joint")
+
+# Cap on muscle wave amplitude (meters) to keep actuation within the stable regime
+MAX_MUSCLE_AMPLITUDE = 0.02
+
+# Spring constants (k, kt) of the joints built by connect_fixed,
+# connect_spherical and connect_hinge in templates.py
+JOINT_STIFFNESS = {
+    "fixed_joint": (1e5, 1e5),
+    "spherical_joint": (1e5, 0.0),
+    "hinge_joint": (1e5, 1e1),
+}
+# Wall stiffness of the plane in add_anisotropic_friction
+FRICTION_PLANE_STIFFNESS = 1.0
+# Shear correction factor PyElastica applies to circular cross-sections
+SHEAR_CORRECTION = 4.0 / 3.0
+
+# Fraction of the position Verlet stability limit (2 / omega_max) used as dt
+TIME_STEP_SAFETY = 0.5
+# Muscle waves are resolved with at least this many steps per period
+STEPS_PER_ACTUATION_PERIOD = 50
+
+
+def normalize_force(force_spec) -> Dict[str, Any]:
+    """
+    Returns the force spec with every parameter resolved to the value the
+    generated script uses. Unknown force types are returned as None.
+    """
+    # Handle both string (old schema) and dict (new schema)
+    if isinstance(force_spec, str):
+        force_type = force_spec
+        params = {}
+    else:
+        force_type = force_spec.get("type")
+        params = force_spec
+
+    if force_type == "gravity":
+        return {"type": force_type, "acc": params.get("acc", [0.0, 0.0, -9.81])}
+
+    if force_type == "endpoint_force":
+        return {
+            "type": force_type,
+            "force": params.get("force", [0.1, 0.0, 0.0]),
+            "ramp": params.get("ramp", 0.1),
+        }
+
+    if force_type == "muscle_activity":
+        return {
+            "type": force_type,
+            "amplitude": min(abs(params.get("amplitude", 0.0)), MAX_MUSCLE_AMPLITUDE),
+            "wave_length": params.get("wave_length", 1.0),
+            "frequency": params.get("frequency", 1.0),
+            "phase": params.get("phase", 0.0),
+            "ramp": params.get("ramp", 0.0),
+        }
+
+    if force_type == "anisotropic_friction":
+        return {
+            "type": force_type,
+            "static_friction": params.get("static_friction", [0.0, 0.0, 0.0]),
+            "kinetic_friction": params.get("kinetic_friction", [0.0, 0.0, 0.0]),
+            "plane_normal": params.get("plane_normal", [0.0, 1.0, 0.0]),
+            "plane_origin": params.get("plane_origin", [0.0, -0.025, 0.0]),
+        }
+
+    return None
+
+
+def normalize_rod(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Fills in every default of a rod object the way the generated script does."""
+    material_name = obj.get("material", "rubber")
+    if material_name not in MATERIALS_DB:
+        material_name = "rubber"
+
+    forces = [normalize_force(f) for f in obj.get("forces", [])]
+
+    return {
+        "type": "rod",
+        "material": material_name,
+        "length": obj.get("length", 1.0),
+        "radius": obj.get("radius", 0.025),
+        "n_elem": obj.get("n_elem", 50),
+        # Parse positions and orientation from JSON, defaulting if missing
+        "start": obj.get("start", [0.0, 0.0, 0.0]),
+        "direction": obj.get("direction", [0.0, 0.0, 1.0]),
+        "normal": obj.get("normal", [0.0, 1.0, 0.0]),
+        "velocity": obj.get("velocity", [0.0, 0.0, 0.0]),
+        "omega": obj.get("omega", [0.0, 0.0, 0.0]),
+        "nu": obj.get("nu", 1e-4),  # Default damping if not specified
+        "constraints": [c for c in obj.get("constraints", []) if c in CONSTRAINT_TYPES],
+        "forces": [f for f in forces if f is not None],
+    }
+
+
+def normalize_connection(conn: Dict[str, Any]) -> Dict[str, Any]:
+    """Fills in connection defaults; unknown joint types become fixed joints."""
+    conn_type = conn.get("type", "fixed_joint")
+    if conn_type not in JOINT_TYPES:
+        conn_type = "fixed_joint"
+
+    normalized = {
+        "type": conn_type,
+        "rod_a_index": conn.get("rod_a_index"),
+        "rod_b_index": conn.get("rod_b_index"),
+        "offset_a": conn.get("offset_a", "end"),
+        "offset_b": conn.get("offset_b", "start"),
+    }
+    if conn_type == "hinge_joint":
+        normalized["normal"] = conn.get("normal", [0.0, 1.0, 0.0])
+    return normalized
+
+
+def normalize_scene(scene_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns a copy of the scene with every default filled in, exactly as the
+    generated script (and SceneRunner) will interpret it. Objects other than
+    rods are dropped since they are never simulated.
+    """
+    render_settings = scene_data.get("render", {})
+    return {
+        "objects": [normalize_rod(obj) for obj in scene_data.get("objects", [])
+                    if obj.get("type") == "rod"],
+        "connections": [normalize_connection(c) for c in scene_data.get("connections", [])],
+        "render": {
+            "duration": render_settings.get("duration", 10.0),
+            "fps": render_settings.get("fps", 60),
+        },
+    }
+
+
+def map_offset(x) -> int:
+    """Maps connection offset strings to node indices: "start" -> 0, "end" -> -1."""
+    return 0 if x == "start" else -1
+
+
+def _rod_inertia(rod: Dict[str, Any]) -> Dict[str, float]:
+    """Element length, node mass and element rotational inertia of a rod."""
+    density = MATERIALS_DB[rod["material"]]["density"]
+    radius = rod["radius"]
+    dl = rod["length"] / rod["n_elem"]
+    area = math.pi * radius ** 2
+    return {
+        "dl": dl,
+        # End nodes carry half an element
+        "end_mass": density * area * dl / 2,
+        "element_inertia": density * math.pi * radius ** 4 / 4 * dl,
+    }
+
+
+def rod_frequencies(rod: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Highest natural frequencies (rad/s) of a discretized rod, per mode. A mode
+    with wave speed c on elements of length dl peaks at 2 c / dl; bending is
+    dispersive and peaks at (2 / dl)^2 sqrt(EI / rho A). The shear/rotation
+    mode of each element oscillates at sqrt(kappa G A / rho I) regardless of dl.
+    """
+    material = MATERIALS_DB[rod["material"]]
+    density = material["density"]
+    youngs_modulus = material["youngs_modulus"]
+    # Same shear modulus as make_rod
+    shear_modulus = youngs_modulus / (material["poisson_ratio"] + 1.0)
+    radius = rod["radius"]
+    dl = rod["length"] / rod["n_elem"]
+
+    axial_speed = math.sqrt(youngs_modulus / density)
+    shear_speed = math.sqrt(SHEAR_CORRECTION * shear_modulus / density)
+    twist_speed = math.sqrt(shear_modulus / density)
+    # sqrt(I / A) of a circular cross-section
+    gyration_radius = radius / 2
+    return {
+        "axial": 2 * axial_speed / dl,
+        "shear": 2 * shear_speed / dl,
+        "twist": 2 * twist_speed / dl,
+        "bending": (2 / dl) ** 2 * gyration_radius * axial_speed,
+        "rotation": shear_speed / gyration_radius,
+    }
+
+
+def joint_frequencies(scene: Dict[str, Any], conn: Dict[str, Any]) -> Dict[str, float]:
+    """Frequencies (rad/s) of a joint's springs acting on the rod ends it connects."""
+    k, kt = JOINT_STIFFNESS[conn["type"]]
+    rod_a = _rod_inertia(scene["objects"][conn["rod_a_index"]])
+    rod_b = _rod_inertia(scene["objects"][conn["rod_b_index"]])
+    return {
+        "joint": math.sqrt(k * (1 / rod_a["end_mass"] + 1 / rod_b["end_mass"])),
+        "joint_rotation": math.sqrt(
+            kt * (1 / rod_a["element_inertia"] + 1 / rod_b["element_inertia"])),
+    }
+
+
+def compute_time_step(scene: Dict[str, Any]) -> float:
+    """
+    Determines the time step (dt) of a normalized scene.
+
+    Position Verlet is stable while dt < 2 / omega_max, omega_max being the
+    highest natural frequency of the discretized system: the axial, shear,
+    twist, bending and shear/rotation modes of every rod (from its material,
+    radius and element length), the joint springs and the friction plane.
+    dt is TIME_STEP_SAFETY of that limit, further capped so muscle waves and
+    recorded frames are resolved.
+    """
+    omega_max = 0.0
+    # Partial scenes (rods streamed so far) may lack render settings and joints
+    fps = scene.get("render", {}).get("fps")
+    dt_max = 1.0 / fps if fps else math.inf
+
+    for rod in scene["objects"]:
+        omega_max = max(omega_max, *rod_frequencies(rod).values())
+        for force in rod["forces"]:
+            if force["type"] == "anisotropic_friction":
+                end_mass = _rod_inertia(rod)["end_mass"]
+                omega_max = max(omega_max, math.sqrt(FRICTION_PLANE_STIFFNESS / end_mass))
+            elif force["type"] == "muscle_activity" and force["frequency"] > 0:
+                dt_max = min(dt_max, 1.0 / (STEPS_PER_ACTUATION_PERIOD * force["frequency"]))
+
+    for conn in scene.get("connections", []):
+        omega_max = max(omega_max, *joint_frequencies(scene, conn).values())
+
+    if omega_max == 0.0:
+        return dt_max
+    return min(TIME_STEP_SAFETY * 2.0 / omega_max, dt_max)
+
+
+def compute_step_skip(scene: Dict[str, Any], dt: float) -> int:
+    """Integration steps between recorded frames, one frame per 1 / fps of simulated time."""
+    return max(1, round(1.0 / (scene["render"]["fps"] * dt)))
+
+
+def compute_frame_count(scene: Dict[str, Any], dt: float) -> int:
+    """
+    Frames a run records per rod: one at t = 0, then one every
+    `compute_step_skip` of the int(duration / dt) integration steps.
+    """
+    return int(scene["render"]["duration"] / dt) // compute_step_skip(scene, dt) + 1
+
+
+def _is_vector(value) -> bool:
+    return (isinstance(value, (list, tuple)) and len(value) == 3
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value))
+
+
+def validate_rod(rod: Dict[str, Any], idx: int) -> List[str]:
+    """Returns the problems found in a normalized rod (empty if it is valid)."""
+    errors = []
+    n_elem = rod["n_elem"]
+    if not isinstance(n_elem, int) or isinstance(n_elem, bool) or n_elem < 1:
+        errors.append(f"objects[{idx}].n_elem must be a positive integer")
+    for key in ("length", "radius"):
+        value = rod[key]
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+            errors.append(f"objects[{idx}].{key} must be a positive number")
+    if not isinstance(rod["nu"], (int, float)) or rod["nu"] < 0:
+        errors.append(f"objects[{idx}].nu must be a non-negative number")
+    for key in ("start", "direction", "normal", "velocity", "omega"):
+        if not _is_vector(rod[key]):
+            errors.append(f"objects[{idx}].{key} must be a 3-vector")
+    for f_idx, force in enumerate(rod["forces"]):
+        for key, value in force.items():
+            if isinstance(value, list) and not _is_vector(value):
+                errors.append(
+                    f"objects[{idx}].forces[{f_idx}].{key} must be a 3-vector")
+    return errors
+
+
+def validate_scene(scene_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validates a scene and returns its normalized form.
+
+    Raises:
+        ValueError: If the scene cannot be simulated.
+    """
+    if not isinstance(scene_data.get("objects", []), list):
+        raise ValueError("Invalid scene: 'objects' must be a list")
+
+    scene = normalize_scene(scene_data)
+    errors = []
+    if not scene["objects"]:
+        errors.append("scene contains no rods")
+    for idx, rod in enumerate(scene["objects"]):
+        errors.extend(validate_rod(rod, idx))
+
+    n_rods = len(scene["objects"])
+    for c_idx, conn in enumerate(scene["connections"]):
+        for key in ("rod_a_index", "rod_b_index"):
+            value = conn[key]
+            if not isinstance(value, int) or not 0 <= value < n_rods:
+                errors.append(
+                    f"connections[{c_idx}].{key} must index one of the {n_rods} rods")
+
+    render = scene["render"]
+    if not isinstance(render["duration"], (int, float)) or render["duration"] <= 0:
+        errors.append("render.duration must be a positive number")
+    if not isinstance(render["fps"], (int, float)) or render["fps"] <= 0:
+        errors.append("render.fps must be a positive number")
+
+    if errors:
+        raise ValueError("Invalid scene: " + "; ".join(errors))
+    return scene
 
 
 def generate_script_from_scene(scene_data: Dict[str, Any]) -> str:
@@ -9,36 +313,39 @@ def generate_script_from_scene(scene_data: Dict[str, Any]) -> str:
     Converts a JSON scene description into a runnable PyElastica Python script.
     """
 
-    objects = scene_data.get("objects", [])
-    render_settings = scene_data.get("render", {})
+    scene = normalize_scene(scene_data)
+    objects = scene["objects"]
 
-    duration = render_settings.get("duration", 10.0)
-    fps = render_settings.get("fps", 60)
-    total_steps = int(duration * 1e4)  # Approximation, refined below
+    duration = scene["render"]["duration"]
+    fps = scene["render"]["fps"]
 
     # Start building the script content
     script_lines = [
+        "import os",
+        "import json",
+        "import pickle",
+        "import struct",
         "import numpy as np",
         "import elastica as ea",
-        "from collections import defaultdict",
-        "import pickle",
         "",
         "# --- INLINED TEMPLATES ---",
     ]
 
-    # Read the templates content and inline it
-    try:
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        template_path = os.path.join(current_dir, "templates.py")
-        with open(template_path, "r") as f:
-            template_code = f.read()
-            # Remove imports from templates as we already imported them
-            lines = template_code.split('\n')
-            filtered_lines = [l for l in lines if not l.startswith("import")]
-            script_lines.extend(filtered_lines)
-    except FileNotFoundError:
-        # Fallback if file not found (though it should exist)
-        script_lines.append(f"# Error: {template_path} not found.")
+    # Read the templates and the trajectory writer and inline them
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    for module_name in INLINED_MODULES:
+        module_path = os.path.join(current_dir, module_name)
+        try:
+            with open(module_path, "r") as f:
+                module_code = f.read()
+        except FileNotFoundError:
+            # Fallback if file not found (though it should exist)
+            script_lines.append(f"# Error: {module_path} not found.")
+            continue
+        # Remove imports from the modules as we already imported them
+        lines = module_code.split('\n')
+        filtered_lines = [l for l in lines if not l.startswith("import")]
+        script_lines.extend(filtered_lines)
 
     script_lines.extend([
         "",
@@ -48,23 +355,8 @@ def generate_script_from_scene(scene_data: Dict[str, Any]) -> str:
         "    sim = create_simulator()",
     ])
 
-    # Determine dynamic time step (dt) based on rod discretization
-    # We scan all rods to find the minimum element length (dl)
-    min_dl = 1e9
-
-    for obj in objects:
-        if obj.get("type") == "rod":
-            l = obj.get("length", 1.0)
-            n = obj.get("n_elem", 50)
-            if n > 0:
-                min_dl = min(min_dl, l/n)
-    if min_dl == 1e9:
-        min_dl = 0.02
-
-    # Heuristic: dt should be small enough relative to wave speed and element size
-    # For stability, dt < 0.1 * dl / wave_speed usually.
-    # We use a safe conservative estimate.
-    dt = 0.01 * min_dl
+    # Stable time step from the scene's materials, discretization and joints
+    dt = compute_time_step(scene)
 
     # Write dt to the script
     script_lines.append(f"    dt = {dt}")
@@ -77,126 +369,86 @@ def generate_script_from_scene(scene_data: Dict[str, Any]) -> str:
 
     # Process objects
     for idx, obj in enumerate(objects):
-        obj_type = obj.get("type")
-
-        if obj_type == "rod":
-            material_name = obj.get("material", "rubber")
-            mat_props = MATERIALS_DB.get(material_name, MATERIALS_DB["rubber"])
-
-            length = obj.get("length", 1.0)
-            radius = obj.get("radius", 0.025)
-            n_elem = obj.get("n_elem", 50)
-
-            # Parse positions and orientation from JSON, defaulting if missing
-            start_pos = obj.get("start", [0.0, 0.0, 0.0])
-            direction = obj.get("direction", [0.0, 0.0, 1.0])
-            normal = obj.get("normal", [0.0, 1.0, 0.0])
-
-            script_lines.append(f"    # Rod {idx} ({material_name})")
-            script_lines.append(f"    rod_{idx} = make_rod(")
-            script_lines.append(f"        sim,")
-            script_lines.append(f"        n_elem={n_elem},")
-            script_lines.append(f"        length={length},")
-            script_lines.append(f"        radius={radius},")
-            script_lines.append(f"        density={mat_props['density']},")
-            script_lines.append(
-                f"        youngs_modulus={mat_props['youngs_modulus']},")
-            script_lines.append(
-                f"        poisson_ratio={mat_props['poisson_ratio']},")
-            script_lines.append(f"        start={start_pos},")
-            script_lines.append(f"        direction={direction},")
-            script_lines.append(f"        normal={normal},")
-
-            # New fields for physics
-            velocity = obj.get("velocity", [0.0, 0.0, 0.0])
-            omega = obj.get("omega", [0.0, 0.0, 0.0])
-            nu = obj.get("nu", 1e-4)  # Default damping if not specified
-
-            script_lines.append(f"        velocity={velocity},")
-            script_lines.append(f"        omega={omega},")
-            script_lines.append(f"        nu={nu},")
-            script_lines.append(f"        dt=dt")
-            script_lines.append(f"    )")
-            script_lines.append(f"    rods.append(rod_{idx})")
-
-            # Process constraints
-            constraints = obj.get("constraints", [])
-            for constraint in constraints:
-                if constraint == "clamped_start":
-                    script_lines.append(f"    clamp_start(sim, rod_{idx})")
-                elif constraint == "clamped_end":
-                    script_lines.append(f"    clamp_end(sim, rod_{idx})")
-
-            # Process forces
-            forces = obj.get("forces", [])
-            for force_spec in forces:
-                # Handle both string (old schema) and dict (new schema)
-                if isinstance(force_spec, str):
-                    force_type = force_spec
-                    params = {}
-                else:
-                    force_type = force_spec.get("type")
-                    params = force_spec
-
-                if force_type == "gravity":
-                    acc = params.get("acc", [0.0, 0.0, -9.81])
-                    # Calculate direction and g from acc vector
-                    acc_np = f"[{acc[0]}, {acc[1]}, {acc[2]}]"
-                    # We can pass the vector directly if we modify add_gravity,
-                    # but the current add_gravity takes g and direction.
-                    # Let's just pass the vector as 'direction' and g=1.0 or modify add_gravity.
-                    # Actually, looking at templates.py:
-                    # def add_gravity(sim, rod, g=9.81, direction=(0.0, 0.0, -1.0)):
-                    #    acc_gravity = np.array(direction) * g
-                    # So we can just pass g=1.0 and direction=acc
-                    script_lines.append(
-                        f"    add_gravity(sim, rod_{idx}, g=1.0, direction={acc_np})")
-
-                elif force_type == "endpoint_force":
-                    force_vec = params.get("force", [0.1, 0.0, 0.0])
-                    ramp = params.get("ramp", 0.1)
-                    force_str = f"[{force_vec[0]}, {force_vec[1]}, {force_vec[2]}]"
-                    script_lines.append(
-                        f"    add_endpoint_force(sim, rod_{idx}, force={force_str}, ramp_up_time={ramp})")
-
-                elif force_type == "muscle_activity":
-                    amp = min(abs(params.get("amplitude", 0.0)), 0.02)
-                    wave = params.get("wave_length", 1.0)
-                    freq = params.get("frequency", 1.0)
-                    phase = params.get("phase", 0.0)
-                    ramp = params.get("ramp", 0.0)
-                    # Use default direction (0,1,0) which is usually the normal for a rod along z or x
-                    script_lines.append(
-                        f"    add_muscle_activity(sim, rod_{idx}, amplitude={amp}, wave_length={wave}, frequency={freq}, phase={phase}, ramp={ramp})")
-
-                elif force_type == "anisotropic_friction":
-                    static = params.get("static_friction", [0.0, 0.0, 0.0])
-                    kinetic = params.get("kinetic_friction", [0.0, 0.0, 0.0])
-                    p_norm = params.get("plane_normal", [0.0, 1.0, 0.0])
-                    p_orig = params.get("plane_origin", [0.0, -0.025, 0.0])
-
-                    s_str = f"[{static[0]}, {static[1]}, {static[2]}]"
-                    k_str = f"[{kinetic[0]}, {kinetic[1]}, {kinetic[2]}]"
-                    n_str = f"[{p_norm[0]}, {p_norm[1]}, {p_norm[2]}]"
-                    o_str = f"[{p_orig[0]}, {p_orig[1]}, {p_orig[2]}]"
-
-                    script_lines.append(
-                        f"    add_anisotropic_friction(sim, rod_{idx}, static_friction={s_str}, kinetic_friction={k_str}, plane_normal={n_str}, plane_origin={o_str})")
+        material_name = obj["material"]
+        mat_props = MATERIALS_DB[material_name]
+
+        script_lines.append(f"    # Rod {idx} ({material_name})")
+        script_lines.append(f"    rod_{idx} = make_rod(")
+        script_lines.append(f"        sim,")
+        script_lines.append(f"        n_elem={obj['n_elem']},")
+        script_lines.append(f"        length={obj['length']},")
+        script_lines.append(f"        radius={obj['radius']},")
+        script_lines.append(f"        density={mat_props['density']},")
+        script_lines.append(
+            f"        youngs_modulus={mat_props['youngs_modulus']},")
+        script_lines.append(
+            f"        poisson_ratio={mat_props['poisson_ratio']},")
+        script_lines.append(f"        start={obj['start']},")
+        script_lines.append(f"        direction={obj['direction']},")
+        script_lines.append(f"        normal={obj['normal']},")
+
+        # New fields for physics
+        script_lines.append(f"        velocity={obj['velocity']},")
+        script_lines.append(f"        omega={obj['omega']},")
+        script_lines.append(f"        nu={obj['nu']},")
+        script_lines.append(f"        dt=dt")
+        script_lines.append(f"    )")
+        script_lines.append(f"    rods.append(rod_{idx})")
+
+        # Process constraints
+        for constraint in obj["constraints"]:
+            if constraint == "clamped_start":
+                script_lines.append(f"    clamp_start(sim, rod_{idx})")
+            elif constraint == "clamped_end":
+                script_lines.append(f"    clamp_end(sim, rod_{idx})")
+
+        # Process forces
+        for params in obj["forces"]:
+            force_type = params["type"]
+
+            if force_type == "gravity":
+                acc = params["acc"]
+                # add_gravity computes acc = direction * g, so pass the vector as direction and g=1.0
+                acc_np = f"[{acc[0]}, {acc[1]}, {acc[2]}]"
+                script_lines.append(
+                    f"    add_gravity(sim, rod_{idx}, g=1.0, direction={acc_np})")
+
+            elif force_type == "endpoint_force":
+                force_vec = params["force"]
+                force_str = f"[{force_vec[0]}, {force_vec[1]}, {force_vec[2]}]"
+                script_lines.append(
+                    f"    add_endpoint_force(sim, rod_{idx}, force={force_str}, ramp_up_time={params['ramp']})")
+
+            elif force_type == "muscle_activity":
+                # Use default direction (0,1,0) which is usually the normal for a rod along z or x
+                script_lines.append(
+                    f"    add_muscle_activity(sim, rod_{idx}, amplitude={params['amplitude']}, wave_length={params['wave_length']}, frequency={params['frequency']}, phase={params['phase']}, ramp={params['ramp']})")
+
+            elif force_type == "anisotropic_friction":
+                static = params["static_friction"]
+                kinetic = params["kinetic_friction"]
+                p_norm = params["plane_normal"]
+                p_orig = params["plane_origin"]
+
+                s_str = f"[{static[0]}, {static[1]}, {static[2]}]"
+                k_str = f"[{kinetic[0]}, {kinetic[1]}, {kinetic[2]}]"
+                n_str = f"[{p_norm[0]}, {p_norm[1]}, {p_norm[2]}]"
+                o_str = f"[{p_orig[0]}, {p_orig[1]}, {p_orig[2]}]"
+
+                script_lines.append(
+                    f"    add_anisotropic_friction(sim, rod_{idx}, static_friction={s_str}, kinetic_friction={k_str}, plane_normal={n_str}, plane_origin={o_str})")
 
     # Process connections
-    connections = scene_data.get("connections", [])
+    connections = scene["connections"]
     if connections:
         script_lines.append("    # Process Connections")
         for conn in connections:
-            idx_a = conn.get("rod_a_index")
-            idx_b = conn.get("rod_b_index")
-            offset_a_str = conn.get("offset_a", "end")
-            offset_b_str = conn.get("offset_b", "start")
-            conn_type = conn.get("type", "fixed_joint")
-
-            # Map offset strings to indices
-            # "start" -> 0, "end" -> -1
-            def map_offset(x): return 0 if x == "start" else -1
+            idx_a = conn["rod_a_index"]
+            idx_b = conn["rod_b_index"]
+            offset_a_str = conn["offset_a"]
+            offset_b_str = conn["offset_b"]
+            conn_type = conn["type"]
+
             idx_one = map_offset(offset_a_str)
             idx_two = map_offset(offset_b_str)
 
@@ -208,13 +460,13 @@ def generate_script_from_scene(scene_data: Dict[str, Any]) -> str:
                     f"    connect_spherical(sim, rods[{idx_a}], rods[{idx_b}], index_one={idx_one}, index_two={idx_two})")
 
             elif conn_type == "hinge_joint":
-                normal = conn.get("normal", [0.0, 1.0, 0.0])
+                normal = conn["normal"]
                 script_lines.append(
                     f"    # Connection: Rod {idx_a} ({offset_a_str}) -> Rod {idx_b} ({offset_b_str}) (Hinge)")
                 script_lines.append(
                     f"    connect_hinge(sim, rods[{idx_a}], rods[{idx_b}], index_one={idx_one}, index_two={idx_two}, normal={normal})")
 
-            else:  # fixed_joint or default
+            else:  # fixed_joint
                 script_lines.append(
                     f"    # Connection: Rod {idx_a} ({offset_a_str}) -> Rod {idx_b} ({offset_b_str}) (Fixed)")
                 script_lines.append(
@@ -223,11 +475,13 @@ def generate_script_from_scene(scene_data: Dict[str, Any]) -> str:
         script_lines.append("")
 
     # Diagnostics
-    script_lines.append("    # 3. Setup Diagnostics")
-    script_lines.append("    history_list = []")
-    script_lines.append("    for rod in rods:")
+    script_lines.append("    # 3. Setup Diagnostics (streamed to the trajectory file in chunks)")
+    script_lines.append(
+        f"    writer = TrajectoryWriter('{TRAJECTORY_FILENAME}', n_frames={compute_frame_count(scene, dt)}, "
+        "n_nodes=[rod.n_elems + 1 for rod in rods], metadata={'fps': " + str(fps) + "})")
+    script_lines.append("    for index, rod in enumerate(rods):")
     script_lines.append(
-        "        history_list.append(record_history(sim, rod, step_skip=200))")
+        f"        record_trajectory(sim, rod, writer, index, step_skip={compute_step_skip(scene, dt)})")
     script_lines.append("")
 
     # 4. Run Simulation
@@ -237,18 +491,12 @@ def generate_script_from_scene(scene_data: Dict[str, Any]) -> str:
     script_lines.append("    total_steps = int(final_time / dt)")
     script_lines.append(
         "    print(f'Running simulation for {final_time}s ({total_steps} steps)...')")
+    # Frames recorded so far stay readable if the run fails
+    script_lines.append("    with writer:")
     script_lines.append(
-        "    finalize_and_integrate(sim, final_time=final_time, total_steps=total_steps)")
-    script_lines.append("")
-
-    # Save results
-    script_lines.append("    # 5. Save Results")
-    script_lines.append(
-        "    print('Saving results to simulation_data.pkl...')")
+        "        finalize_and_integrate(sim, final_time=final_time, total_steps=total_steps)")
     script_lines.append(
-        "    data = {'rods': history_list, 'metadata': {'fps': " + str(fps) + "}}")
-    script_lines.append("    with open('simulation_data.pkl', 'wb') as f:")
-    script_lines.append("        pickle.dump(data, f)")
+        "        print('Saving results to " + TRAJECTORY_FILENAME + "...')")
     script_lines.append("    print('Done.')")
 
     script_lines.append("")
@@ -0,0 +1,401 @@
+import os
+import math
+import heapq
+import asyncio
+import inspect
+import logging
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Dict, Any, NamedTuple
+
+from . import limits
+from .jobs import Job, JobRegistry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_QUEUE = 64
+
+# Assumed job duration (seconds) until real runs have been observed
+DEFAULT_JOB_SECONDS = 30.0
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _SlotGrant(NamedTuple):
+    """Queue entry target of a `slot` request: resolved when a slot is free."""
+    granted: asyncio.Future
+    released: asyncio.Event
+
+
+class JobScheduler:
+    """
+    Runs jobs with a bounded number of concurrent simulations and a bounded
+    priority queue (FIFO among equal priorities; higher priority runs first).
+
+    Must be used from within a running asyncio event loop. Synchronous targets
+    are executed on a dedicated thread pool sized to `max_concurrent`.
+
+    Jobs running longer than `job_timeout` seconds are cancelled. Cancellation
+    (see `cancel`) interrupts coroutine targets at their next await; a
+    synchronous target keeps its thread until it returns.
+
+    A job whose cost is only known part-way through (the scene comes from an
+    LLM) is started with `prepare` instead: its target runs right away without
+    a slot and acquires one with `async with scheduler.slot(job, estimate)`
+    once it has a cost estimate. Waiting jobs of equal priority are served
+    shortest estimated job first, and estimates above `max_job_seconds` or
+    `max_memory_bytes` are rejected before they take a slot.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, max_queue: int = DEFAULT_MAX_QUEUE,
+                 job_timeout: Optional[float] = None, max_job_seconds: Optional[float] = None,
+                 max_memory_bytes: Optional[int] = None):
+        self.max_concurrent = max_concurrent or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.max_job_seconds = max_job_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.registry = JobRegistry()
+
+        # heap of (-priority, estimated seconds, seq, job, target, args, kwargs)
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._active = set()
+        # Prepared jobs that have not asked for a slot yet
+        self._preparing = set()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # job id -> (timer handle, armed at, budget) of the wall-clock limit
+        self._timers: Dict[str, tuple] = {}
+        # Jobs to drop from the registry when they settle
+        self._forget = set()
+        self._avg_job_seconds = DEFAULT_JOB_SECONDS
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrent, thread_name_prefix="job")
+        self._available = None
+        self._workers = []
+
+    def submit(self, job: Job, target: Callable, /, *args, **kwargs) -> Job:
+        """
+        Queues `target(*args, **kwargs)` to run as `job`.
+
+        Raises:
+            QueueFullError: If the queue already holds `max_queue` jobs.
+        """
+        if self.queue_length >= self.max_queue:
+            raise QueueFullError(self.retry_after())
+
+        self._ensure_started()
+        self.registry.add(job)
+        # Without an estimate the job is assumed to take an average time
+        heapq.heappush(self._queue, (-job.priority, self._avg_job_seconds, next(self._seq),
+                                     job, target, args, kwargs))
+        self._available.release()
+        return job
+
+    def prepare(self, job: Job, target: Callable, /, *args, **kwargs) -> Job:
+        """
+        Starts the coroutine function `target(*args, **kwargs)` as `job` right
+        away, outside the simulation slots. The target takes a slot with
+        `slot` for its expensive part; the job completes when the target
+        returns. Preparing jobs count towards `max_queue`.
+
+        Raises:
+            QueueFullError: If the queue already holds `max_queue` jobs.
+        """
+        if self.queue_length >= self.max_queue:
+            raise QueueFullError(self.retry_after())
+
+        self._ensure_started()
+        self.registry.add(job)
+        self._preparing.add(job)
+        job.set_state("running")
+        task = asyncio.ensure_future(target(*args, **kwargs))
+        self._tasks[job.id] = task
+        self._arm_timer(job, self.job_timeout)
+        asyncio.ensure_future(self._supervise_prepared(job, task))
+        return job
+
+    def track(self, job: Job, target: Callable, /, *args, **kwargs) -> Job:
+        """
+        Runs the coroutine function `target(*args, **kwargs)` as `job` right
+        away, holding no slot and with no wall-clock limit. For jobs that only
+        coordinate other jobs, such as parameter sweeps waiting for their points.
+        """
+        self._ensure_started()
+        self.registry.add(job)
+        job.set_state("running")
+        task = asyncio.ensure_future(target(*args, **kwargs))
+        self._tasks[job.id] = task
+        asyncio.ensure_future(self._settle(job, task, timed=False))
+        return job
+
+    def admit(self, estimate: Dict[str, Any]):
+        """
+        Checks a cost estimate (see `cost_model.CostModel.estimate`) against
+        the admission limits.
+
+        Raises:
+            CostLimitExceededError: If the estimated runtime or memory is too large.
+        """
+        seconds = estimate["wall_seconds"]
+        if self.max_job_seconds is not None and seconds > self.max_job_seconds:
+            raise limits.CostLimitExceededError(
+                f"Estimated runtime {_format_seconds(seconds)} exceeds the limit "
+                f"of {_format_seconds(self.max_job_seconds)}")
+        memory_mb = estimate["peak_memory_mb"]
+        if self.max_memory_bytes is not None and memory_mb * 1024 * 1024 > self.max_memory_bytes:
+            raise limits.CostLimitExceededError(
+                f"Estimated peak memory {memory_mb:.0f} MB exceeds the limit "
+                f"of {self.max_memory_bytes / (1024 * 1024):.0f} MB")
+
+    @contextlib.asynccontextmanager
+    async def slot(self, job: Job, estimate: Dict[str, Any]):
+        """
+        Holds one of the `max_concurrent` slots for the duration of the block,
+        after admitting `estimate`. The job waits in the queue (state "queued")
+        until a slot is free; time spent waiting does not count towards its
+        wall-clock limit. Reentrant for jobs started with `submit`, which
+        already hold a slot.
+
+        Raises:
+            CostLimitExceededError: If the estimate is not admitted.
+        """
+        self.admit(estimate)
+        if job in self._active:
+            yield
+            return
+
+        self._ensure_started()
+        grant = _SlotGrant(asyncio.get_running_loop().create_future(), asyncio.Event())
+        entry = (-job.priority, estimate["wall_seconds"], next(self._seq), job, grant, (), {})
+        self._preparing.discard(job)
+        budget = self._disarm_timer(job)
+        heapq.heappush(self._queue, entry)
+        job.set_state("queued")
+        self._available.release()
+        try:
+            await grant.granted
+        except asyncio.CancelledError:
+            self._queue = [e for e in self._queue if e is not entry]
+            heapq.heapify(self._queue)
+            for e in self._queue:
+                e[3].publish()
+            grant.released.set()
+            raise
+
+        self._arm_timer(job, budget)
+        try:
+            yield
+        finally:
+            grant.released.set()
+
+    def cancel(self, job_id: str, reason: str = limits.CANCELLED) -> bool:
+        """
+        Stops a job. A queued job is removed from the queue; a running job's
+        task is cancelled, which stops whatever stage it is in. The reason is
+        recorded as the job's `termination_reason`. Returns False if the job is
+        unknown or already finished.
+        """
+        job = self.registry.get(job_id)
+        if job is None or job.done:
+            return False
+
+        task = self._tasks.get(job_id)
+        if job.state == "queued" and task is None:
+            self._queue = [entry for entry in self._queue if entry[3] is not job]
+            heapq.heapify(self._queue)
+            job.update(termination_reason=reason)
+            job.set_state("failed", error=_termination_message(reason, self.job_timeout))
+            for entry in self._queue:
+                entry[3].publish()
+            return True
+
+        # Running, or a prepared job (waiting for a slot or not)
+        if task is None:
+            return False
+        if task.done():
+            # Finished but not settled yet
+            return task.cancelled()
+        job.update(termination_reason=reason)
+        task.cancel()
+        return True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.registry.get(job_id)
+
+    def forget(self, job_id: str):
+        """
+        Drops a job's record, once it has finished if it is still running;
+        its status is then derived from its artifacts.
+        """
+        job = self.registry.get(job_id)
+        if job is not None and job.id in self._tasks:
+            self._forget.add(job_id)
+        else:
+            self.registry.remove(job_id)
+
+    @property
+    def queue_length(self) -> int:
+        """Jobs waiting for a slot, including prepared jobs that will ask for one."""
+        return len(self._queue) + len(self._preparing)
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """1-based position of a queued job, or None if it is not waiting."""
+        for position, entry in enumerate(sorted(self._queue, key=lambda e: e[:3]), start=1):
+            if entry[3].id == job_id:
+                return position
+        return None
+
+    def retry_after(self) -> int:
+        """
+        Seconds until roughly one queue slot should free up: the shortest ETA
+        reported by a running job when known, otherwise the average job time.
+        """
+        etas = [job.eta_seconds for job in self._active if job.eta_seconds is not None]
+        if etas:
+            return max(1, math.ceil(min(etas)))
+        return max(1, math.ceil(self._avg_job_seconds / self.max_concurrent))
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._available = asyncio.Semaphore(0)
+        self._workers = [asyncio.create_task(self._worker_loop())
+                         for _ in range(self.max_concurrent)]
+
+    def _arm_timer(self, job: Job, budget: Optional[float]):
+        if budget is None:
+            return
+        loop = asyncio.get_running_loop()
+        handle = loop.call_later(budget, self.cancel, job.id, limits.WALL_TIME_LIMIT)
+        self._timers[job.id] = (handle, loop.time(), budget)
+
+    def _disarm_timer(self, job: Job) -> Optional[float]:
+        """Stops a job's wall-clock timer. Returns the unused budget."""
+        timer = self._timers.pop(job.id, None)
+        if timer is None:
+            return None
+        handle, armed_at, budget = timer
+        handle.cancel()
+        return max(budget - (asyncio.get_running_loop().time() - armed_at), 0.0)
+
+    async def _worker_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._available.acquire()
+            if not self._queue:
+                # The job this permit was for has been cancelled
+                continue
+            _, _, _, job, target, args, kwargs = heapq.heappop(self._queue)
+            # Every job behind this one moved up a position
+            for entry in self._queue:
+                entry[3].publish()
+
+            job.set_state("running")
+            self._running += 1
+            self._active.add(job)
+            try:
+                if isinstance(target, _SlotGrant):
+                    # A prepared job runs its slot-holding block itself
+                    if not target.granted.done():
+                        target.granted.set_result(None)
+                        await target.released.wait()
+                    continue
+
+                if inspect.iscoroutinefunction(target):
+                    task = asyncio.ensure_future(target(*args, **kwargs))
+                else:
+                    task = asyncio.ensure_future(loop.run_in_executor(
+                        self._executor, lambda: target(*args, **kwargs)))
+                self._tasks[job.id] = task
+                self._arm_timer(job, self.job_timeout)
+                await self._settle(job, task)
+            finally:
+                self._running -= 1
+                self._active.discard(job)
+
+    async def _supervise_prepared(self, job: Job, task: asyncio.Task):
+        try:
+            await self._settle(job, task)
+        finally:
+            self._preparing.discard(job)
+
+    async def _settle(self, job: Job, task: asyncio.Task, timed: bool = True):
+        """
+        Waits for a job's task and records how it ended. Untimed jobs are
+        left out of the average job time.
+        """
+        try:
+            # wait() does not propagate the job's cancellation to the caller
+            await asyncio.wait([task])
+            if task.cancelled():
+                reason = job.info.get("termination_reason", limits.CANCELLED)
+                logger.info(f"Job {job.id} terminated: {reason}")
+                job.set_state("failed", error=_termination_message(reason, self.job_timeout))
+            elif task.exception() is not None:
+                e = task.exception()
+                logger.error(f"Job {job.id} failed: {e}")
+                if isinstance(e, limits.JobTerminatedError):
+                    job.update(termination_reason=e.reason)
+                job.set_state("failed", error=str(e))
+            else:
+                job.set_state("completed")
+        finally:
+            self._disarm_timer(job)
+            self._tasks.pop(job.id, None)
+            if not job.done:
+                # Interrupted (e.g. the worker task was cancelled)
+                job.set_state("failed", error="Job was interrupted")
+            # Exponential moving average feeds the Retry-After estimate
+            if timed:
+                elapsed = job.finished_at - job.started_at
+                self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+            if job.id in self._forget:
+                self._forget.discard(job.id)
+                self.registry.remove(job.id)
+
+
+def _termination_message(reason: str, job_timeout: Optional[float]) -> str:
+    if reason == limits.WALL_TIME_LIMIT:
+        return f"Job exceeded its wall-clock limit of {job_timeout:g}s"
+    if reason == limits.CANCELLED:
+        return "Job was cancelled"
+    return f"Job was terminated ({reason})"
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f} h"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f} min"
+    return f"{seconds:.0f} s"
+
+
+_scheduler = None
+
+
+def get_scheduler() -> JobScheduler:
+    """
+    Returns the process-wide scheduler. Concurrency and queue size are
+    configured via SQUISHY_MAX_CONCURRENT (default: CPU count) and
+    SQUISHY_MAX_QUEUE, the per-job wall-clock limit via SQUISHY_JOB_TIMEOUT
+    and the admission limits via SQUISHY_MAX_JOB_SECONDS and
+    SQUISHY_WORKER_MAX_MEMORY_MB.
+    """
+    global _scheduler
+    if _scheduler is None:
+        max_concurrent = int(os.environ.get("SQUISHY_MAX_CONCURRENT", "0")) or None
+        max_queue = int(os.environ.get("SQUISHY_MAX_QUEUE", DEFAULT_MAX_QUEUE))
+        _scheduler = JobScheduler(
+            max_concurrent=max_concurrent, max_queue=max_queue,
+            job_timeout=limits.job_timeout(), max_job_seconds=limits.max_job_seconds(),
+            max_memory_bytes=limits.worker_memory_bytes())
+    return _scheduler
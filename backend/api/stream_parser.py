@@ -0,0 +1,190 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .materials import MATERIALS_DB
+from .scene_to_code import compute_time_step, normalize_rod, validate_rod
+
+_WHITESPACE = " \t\n\r"
+# Characters that may appear outside strings in valid JSON
+_SCALAR_CHARS = set("0123456789+-.eE" "truefalsn")
+
+
+class StreamingJSONParser:
+    """
+    Incremental JSON scanner that reports every element of one array (the
+    first one found at any of the key paths `array_paths`, such as
+    ("objects",) or ("scene", "objects")) as soon as the element's closing
+    brace arrives, without waiting for the rest of the document.
+
+    It also rejects output that can no longer be valid JSON (markdown fences,
+    prose, mismatched brackets, trailing text) at the first offending
+    character, so a bad stream can be aborted early.
+    """
+
+    def __init__(self, array_paths: Sequence[Tuple[str, ...]],
+                 on_element: Optional[Callable[[int, Any], None]] = None):
+        self.array_paths = tuple(tuple(path) for path in array_paths)
+        # Path of the array whose elements are reported, once found
+        self.array_path: Optional[Tuple[str, ...]] = None
+        self.on_element = on_element
+        self.elements: List[Any] = []
+
+        self._buffer = ""
+        # One frame per open container: [kind, current_key, expecting_key, is_target]
+        self._stack: List[list] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._element_start = None
+        self._started = False
+        self._finished = False
+
+    @property
+    def text(self) -> str:
+        return self._buffer
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Consumes the next chunk. Returns the elements completed by it.
+
+        Raises:
+            ValueError: As soon as the document is known to be malformed, or an
+                        `on_element` callback rejects an element.
+        """
+        base = len(self._buffer)
+        self._buffer += chunk
+        completed = []
+        for offset, ch in enumerate(chunk):
+            i = base + offset
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._end_string(i)
+                continue
+
+            if ch in _WHITESPACE:
+                continue
+            if self._finished:
+                raise ValueError(f"Unexpected text after JSON document at offset {i}")
+            if not self._started:
+                if ch != "{":
+                    raise ValueError(
+                        f"Expected a JSON object, got {ch!r} at offset {i}")
+                self._started = True
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._open(ch, i)
+            elif ch in "}]":
+                element = self._close(ch, i)
+                if element is not None:
+                    completed.append(element)
+            elif ch == ":":
+                if not self._stack or self._stack[-1][0] != "{":
+                    raise ValueError(f"Unexpected ':' at offset {i}")
+                self._stack[-1][2] = False
+            elif ch == ",":
+                if not self._stack:
+                    raise ValueError(f"Unexpected ',' at offset {i}")
+                if self._stack[-1][0] == "{":
+                    self._stack[-1][2] = True
+            elif ch not in _SCALAR_CHARS:
+                raise ValueError(f"Invalid character {ch!r} at offset {i}")
+        return completed
+
+    def close(self) -> Any:
+        """Parses and returns the full document once the stream has ended."""
+        if not self._finished:
+            raise ValueError("JSON document is incomplete")
+        return json.loads(self.text)
+
+    def _key_path(self) -> Tuple[str, ...]:
+        return tuple(frame[1] for frame in self._stack if frame[0] == "{")
+
+    def _end_string(self, end: int):
+        frame = self._stack[-1] if self._stack else None
+        if frame is not None and frame[0] == "{" and frame[2]:
+            frame[1] = json.loads(self._buffer[self._string_start:end + 1])
+
+    def _open(self, ch: str, i: int):
+        parent = self._stack[-1] if self._stack else None
+        if (ch == "[" and parent is not None and parent[0] == "{"
+                and self.array_path is None
+                and self._key_path() in self.array_paths):
+            self.array_path = self._key_path()
+            self._stack.append(["[", None, False, True])
+            return
+        if parent is not None and parent[3] and ch == "{":
+            # Direct child of the target array
+            self._element_start = i
+        self._stack.append([ch, None, ch == "{", False])
+
+    def _close(self, ch: str, i: int):
+        if not self._stack:
+            raise ValueError(f"Unexpected {ch!r} at offset {i}")
+        frame = self._stack.pop()
+        if (frame[0] == "{") != (ch == "}"):
+            raise ValueError(f"Mismatched {ch!r} at offset {i}")
+        if not self._stack:
+            self._finished = True
+            return None
+
+        parent = self._stack[-1]
+        if parent[3] and self._element_start is not None:
+            raw = self._buffer[self._element_start:i + 1]
+            self._element_start = None
+            try:
+                element = json.loads(raw)
+            except json.JSONDecodeError as e:
+                raise ValueError(
+                    f"Malformed element {len(self.elements)} of {'.'.join(self.array_path)}: {e}")
+            index = len(self.elements)
+            self.elements.append(element)
+            if self.on_element is not None:
+                self.on_element(index, element)
+            return element
+        return None
+
+
+def scene_objects_paths(fused: bool) -> Tuple[Tuple[str, ...], ...]:
+    """
+    Key paths of the rod list in a scene response ("two_step") or fused
+    response, which may also skip the "scene" wrapper.
+    """
+    return (("scene", "objects"), ("objects",)) if fused else (("objects",),)
+
+
+class SceneStreamState:
+    """
+    Early per-rod processing for streamed scenes: each rod is normalized,
+    validated and its material resolved as soon as it is complete, and the
+    time step estimate is refined rod by rod.
+    """
+
+    def __init__(self, on_object: Optional[Callable[[int, Dict[str, Any], float], None]] = None):
+        self.on_object = on_object
+        self.rods: List[Dict[str, Any]] = []
+        self.dt_estimate = None
+
+    def __call__(self, index: int, obj: Any):
+        if not isinstance(obj, dict):
+            raise ValueError(f"objects[{index}] is not a JSON object")
+        if obj.get("type") != "rod":
+            return
+
+        rod = normalize_rod(obj)
+        errors = validate_rod(rod, len(self.rods))
+        if errors:
+            raise ValueError("Invalid scene: " + "; ".join(errors))
+        rod["material_properties"] = MATERIALS_DB[rod["material"]]
+        self.rods.append(rod)
+
+        self.dt_estimate = compute_time_step({"objects": self.rods})
+        if self.on_object is not None:
+            self.on_object(len(self.rods) - 1, rod, self.dt_estimate)
@@ -0,0 +1,275 @@
+import os
+import math
+import copy
+import json
+import asyncio
+import logging
+import itertools
+import warnings
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from .artifact_store import get_artifact_store
+from .jobs import Job
+from .job_ids import new_job_id
+from .materials import MATERIALS_DB
+from .paths import get_output_dir
+from .scene_to_code import validate_scene
+from .scheduler import get_scheduler, QueueFullError
+from .trajectory import open_trajectory
+from .workflow import run_scene_workflow_async
+
+logger = logging.getLogger(__name__)
+
+SWEEP_FILENAME = "sweep.json"
+
+# Largest number of points a sweep may expand to, overridable via SQUISHY_MAX_SWEEP_POINTS
+DEFAULT_MAX_SWEEP_POINTS = 64
+
+# Summary metrics of every sweep point, in table column order
+METRICS = ("tip_displacement", "centroid_displacement", "centroid_speed",
+           "max_speed", "stretch", "stable", "wall_seconds")
+
+# Node speeds (m/s) above which a run counts as having blown up
+MAX_STABLE_SPEED = 50.0
+
+
+def max_sweep_points() -> int:
+    return int(os.environ.get("SQUISHY_MAX_SWEEP_POINTS", DEFAULT_MAX_SWEEP_POINTS))
+
+
+def _select(node, segment: str, path: str) -> List[Any]:
+    """Children of `node` matched by one path segment."""
+    if isinstance(node, dict):
+        if segment not in node:
+            raise ValueError(f"Sweep parameter '{path}': no key '{segment}'")
+        return [node[segment]]
+    if isinstance(node, list):
+        if segment == "*":
+            return list(node)
+        if segment.isdigit():
+            if int(segment) >= len(node):
+                raise ValueError(f"Sweep parameter '{path}': index {segment} out of range")
+            return [node[int(segment)]]
+        # Lists of typed entries (forces, connections) are addressed by type
+        matches = [item for item in node if isinstance(item, dict) and item.get("type") == segment]
+        if not matches:
+            raise ValueError(f"Sweep parameter '{path}': no entry of type '{segment}'")
+        return matches
+    raise ValueError(f"Sweep parameter '{path}': cannot descend into '{segment}'")
+
+
+def apply_parameter(scene: Dict[str, Any], path: str, value: Any):
+    """
+    Sets the value at a dotted path of a normalized scene, in place.
+
+    Numeric segments index lists, '*' matches every list entry and any other
+    segment on a list selects the entries of that `type`, e.g.
+    `objects.0.forces.muscle_activity.amplitude` or `objects.*.material`.
+
+    Raises:
+        ValueError: If the path matches nothing or the value is not allowed.
+    """
+    *parents, key = path.split(".")
+    if key == "material" and value not in MATERIALS_DB:
+        raise ValueError(f"Sweep parameter '{path}': unknown material '{value}'")
+
+    nodes = [scene]
+    for segment in parents:
+        nodes = [child for node in nodes for child in _select(node, segment, path)]
+    for node in nodes:
+        if isinstance(node, list) and key.isdigit() and int(key) < len(node):
+            node[int(key)] = value
+        elif isinstance(node, dict) and key in node:
+            node[key] = value
+        else:
+            raise ValueError(f"Sweep parameter '{path}': no key '{key}'")
+
+
+def expand_sweep(base_scene: Dict[str, Any],
+                 axes: Dict[str, List[Any]]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Returns the (params, scene) of every point of the Cartesian product of
+    the axes over the base scene, each scene validated.
+
+    Raises:
+        ValueError: If the base scene or a point is invalid, an axis is empty
+            or the sweep has more than `max_sweep_points()` points.
+    """
+    base = validate_scene(base_scene)
+    if not axes:
+        raise ValueError("A sweep needs at least one parameter axis")
+    for path, values in axes.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"Sweep parameter '{path}' needs a non-empty list of values")
+
+    n_points = int(np.prod([len(values) for values in axes.values()]))
+    if n_points > max_sweep_points():
+        raise ValueError(f"Sweep has {n_points} points, more than the limit of "
+                         f"{max_sweep_points()}")
+
+    points = []
+    for combination in itertools.product(*axes.values()):
+        params = dict(zip(axes, combination))
+        scene = copy.deepcopy(base)
+        for path, value in params.items():
+            apply_parameter(scene, path, value)
+        try:
+            points.append((params, validate_scene(scene)))
+        except ValueError as e:
+            raise ValueError(f"Sweep point {params}: {e}") from e
+    return points
+
+
+def summarize_run(output_dir: str) -> Dict[str, Any]:
+    """
+    Summary metrics of a finished run, from its trajectory: the
+    largest final tip and centroid displacements, the centroid's mean
+    speed, the peak node speed, the largest final stretch of a rod, and
+    whether the run stayed finite and below MAX_STABLE_SPEED. Blocking.
+    """
+    trajectory = open_trajectory(output_dir)
+    if not trajectory.rods or trajectory.n_frames == 0:
+        return {}
+    # (frames, 3, nodes) per rod
+    positions = [np.asarray(rod["position"], dtype=float) for rod in trajectory.rods]
+    times = np.asarray(trajectory.times)
+
+    nodes = np.concatenate(positions, axis=2)
+    duration = float(times[-1] - times[0])
+
+    def length(p):
+        return np.linalg.norm(np.diff(p, axis=1), axis=0).sum()
+
+    # Runs that blew up have non-finite positions; their metrics are None
+    with np.errstate(all="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        centroid = nodes.mean(axis=2)
+        centroid_displacement = float(np.linalg.norm(centroid[-1] - centroid[0]))
+        max_speed = 0.0
+        if len(times) > 1:
+            dt = np.diff(times)[:, None, None]
+            max_speed = float(np.nanmax(np.linalg.norm(np.diff(nodes, axis=0) / dt, axis=1)))
+        metrics = {
+            "tip_displacement": max(float(np.linalg.norm(p[-1, :, -1] - p[0, :, -1]))
+                                    for p in positions),
+            "centroid_displacement": centroid_displacement,
+            "centroid_speed": centroid_displacement / duration if duration > 0 else 0.0,
+            "max_speed": max_speed,
+            "stretch": max(float(length(p[-1]) / length(p[0]) - 1.0) for p in positions),
+        }
+
+    finite = bool(np.all(np.isfinite(nodes))) and math.isfinite(max_speed)
+    # NaN and infinity are not valid JSON
+    summary = {key: value if math.isfinite(value) else None for key, value in metrics.items()}
+    summary["stable"] = finite and max_speed < MAX_STABLE_SPEED
+    return summary
+
+
+async def _wait_for(job: Job):
+    queue = job.subscribe()
+    try:
+        while not job.done:
+            await queue.get()
+    finally:
+        job.unsubscribe(queue)
+
+
+async def _point_row(index: int, params: Dict[str, Any], point_job: Job) -> Dict[str, Any]:
+    await _wait_for(point_job)
+    row = {"index": index, "id": point_job.id, "status": point_job.state, **params}
+    if point_job.state != "completed":
+        row["error"] = point_job.error
+        return row
+    try:
+        row.update(await asyncio.to_thread(summarize_run, get_output_dir(point_job.id)))
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"Could not summarize sweep point {point_job.id}: {e}")
+        row["error"] = f"Could not summarize results: {e}"
+    wall_time = point_job.info.get("simulation", {}).get("wall_time")
+    if wall_time is not None:
+        row["wall_seconds"] = round(wall_time, 3)
+    return row
+
+
+def _write_sweep(output_dir: str, sweep: Dict[str, Any]):
+    with open(os.path.join(output_dir, SWEEP_FILENAME), "w") as f:
+        json.dump(sweep, f, indent=2)
+
+
+async def run_sweep_async(job: Job, base_scene: Dict[str, Any], axes: Dict[str, List[Any]],
+                          points: List[Tuple[Dict[str, Any], Job]]):
+    """
+    Waits for the points of a sweep and aggregates their summary metrics
+    into a table: {"columns": [...], "rows": [...]}, ordered by point index.
+    The table is published on the sweep job as rows finish and saved to
+    sweep.json in the sweep's own directory. Cancelling the sweep cancels
+    its unfinished points.
+    """
+    output_dir = get_output_dir(job.id)
+    os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+    os.mkdir(output_dir)
+    get_artifact_store().begin(output_dir)
+
+    columns = ["index", "id", "status", *axes, *METRICS, "error"]
+    rows = []
+    tasks = [asyncio.ensure_future(_point_row(index, params, point_job))
+             for index, (params, point_job) in enumerate(points)]
+    try:
+        job.set_stage("simulating", progress=0.0)
+        for finished in asyncio.as_completed(tasks):
+            rows.append(await finished)
+            rows.sort(key=lambda row: row["index"])
+            failed = sum(row["status"] == "failed" for row in rows)
+            job.report_progress(100.0 * len(rows) / len(points),
+                                completed=len(rows) - failed, failed=failed,
+                                table={"columns": columns, "rows": rows})
+
+        sweep = {"id": job.id, "scene": base_scene, "axes": axes,
+                 "table": {"columns": columns, "rows": rows}}
+        await asyncio.to_thread(_write_sweep, output_dir, sweep)
+        return job.id
+
+    except asyncio.CancelledError:
+        scheduler = get_scheduler()
+        for _, point_job in points:
+            scheduler.cancel(point_job.id)
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        get_artifact_store().finish(output_dir)
+
+
+def start_sweep(base_scene: Dict[str, Any], axes: Dict[str, List[Any]],
+                priority: int = -1, render: bool = False) -> Tuple[Job, List[Dict[str, Any]]]:
+    """
+    Expands a sweep and starts one scene job per point, plus the sweep job
+    aggregating them. Points share the scheduler's slots (and the warm
+    worker pool) with every other job, shortest first within a priority.
+    Returns the sweep job and the points as [{"index", "id", "params"}].
+
+    Raises:
+        ValueError: If the sweep is invalid (see `expand_sweep`).
+        QueueFullError: If the queue has no room for every point.
+    """
+    expanded = expand_sweep(base_scene, axes)
+    scheduler = get_scheduler()
+    if scheduler.queue_length + len(expanded) > scheduler.max_queue:
+        raise QueueFullError(scheduler.retry_after())
+
+    points = []
+    for params, scene in expanded:
+        point_id = new_job_id()
+        point_job = Job(point_id, priority=priority)
+        point_job.update(sweep_params=params)
+        scheduler.prepare(point_job, run_scene_workflow_async,
+                          scene, point_id, job=point_job, render=render)
+        points.append((params, point_job))
+
+    job = Job(new_job_id(), priority=priority)
+    job.update(sweep_points=len(points))
+    scheduler.track(job, run_sweep_async, job, base_scene, axes, points)
+    return job, [{"index": index, "id": point_job.id, "params": params}
+                 for index, (params, point_job) in enumerate(points)]
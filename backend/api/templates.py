@@ -1,6 +1,8 @@
 import numpy as np
 import elastica as ea
-from collections import defaultdict
+from time import perf_counter
+from tqdm import tqdm
+from numba import njit
 
 
 class BaseSimulator(
@@ -110,9 +112,29 @@ def fix_node(sim, rod, index):
 
 # --- Forcing ---
 
+@njit
+def _muscle_torques_kernel(external_torques, lengths, direction, amplitude,
+                           wave_number, angular_frequency, phase, time):
+    """
+    Adds the traveling wave amplitude * cos(k*s - w*t + phase) about
+    `direction` to external_torques in place, with s the arc length at the
+    element ends shifted back by half the first element.
+    """
+    offset = 0.5 * lengths[0]
+    s = 0.0
+    for i in range(lengths.shape[0]):
+        s += lengths[i]
+        magnitude = amplitude * np.cos(wave_number * (s - offset) - angular_frequency * time + phase)
+        for d in range(3):
+            external_torques[d, i] += direction[d] * magnitude
+
+
 class MuscleTorques(ea.NoForces):
     """
     Applies a traveling wave of torque to the rod to simulate snake locomotion.
+
+    The wave is evaluated by a Numba kernel that writes straight into
+    `external_torques`, so a time step allocates nothing.
     """
 
     def __init__(self, amplitude, wave_length, frequency, phase, ramp, n_elems, direction):
@@ -120,20 +142,13 @@ class MuscleTorques(ea.NoForces):
         self.amplitude = amplitude
         self.wave_number = 2 * np.pi / wave_length
         self.frequency = frequency
+        self.angular_frequency = 2 * np.pi * frequency
         self.phase = phase
         self.ramp = ramp
-        # Direction of the torque axis (usually normal to the plane)
-        self.direction = np.array(direction)
-
-        # Pre-compute spatial phase
-        # s varies from 0 to L. We assume uniform elements.
-        # We need the positions of the elements (s coordinate)
-        # But we don't have L here easily unless passed.
-        # We'll compute s on the fly or pass L.
-        # Better: pass 'rod' to init? No, Forcing init usually just takes params.
-        # We can compute s in apply_forces if we assume rod is uniform.
-        # Or just pass an array of 's' values.
-        pass
+        self.n_elems = n_elems
+        # Direction of the torque axis (usually normal to the plane), as the
+        # contiguous float array the kernel expects
+        self.direction = np.ascontiguousarray(direction, dtype=np.float64)
 
     def apply_torques(self, system, time: float = 0.0):
         # Ramp up
@@ -141,33 +156,11 @@ class MuscleTorques(ea.NoForces):
         if time < self.ramp:
             factor = time / self.ramp
 
-        # Calculate torque profile
-        # s is approximate arc length
-        # lengths = system.lengths # (n_elems,)
-        # s = np.cumsum(lengths) - 0.5 * lengths
-        # For efficiency, we can assume uniform initial s if small deformations,
-        # or recompute. Recomputing is safer.
-
-        s = np.cumsum(system.lengths)
-        s -= 0.5 * system.lengths[0]  # Center of elements
-        # Normalize s? No, wave_number handles it.
-
-        # Traveling wave: A * cos(k*s - w*t + phi)
-        torque_mag = factor * self.amplitude * np.cos(
-            self.wave_number * s - 2 * np.pi * self.frequency * time + self.phase
-        )
-
-        # Apply to system.external_torques
-        # shape: (3, n_elems)
-        # We apply torque about the 'direction' axis.
-        # direction shape: (3,)
-
-        # Broadcast direction to (3, n_elems)
-        # torque_mag shape: (n_elems,)
-
-        torques = np.outer(self.direction, torque_mag)
-
-        system.external_torques += torques
+        # Arc length is recomputed from the current element lengths every step
+        _muscle_torques_kernel(
+            system.external_torques, system.lengths, self.direction,
+            factor * self.amplitude, self.wave_number, self.angular_frequency,
+            self.phase, time)
 
 
 def add_gravity(sim, rod, g=9.81, direction=(0.0, 0.0, -1.0)):
@@ -308,35 +301,67 @@ def add_damping(sim, rod, damping_constant, time_step):
 
 class GenericRodCallBack(ea.CallBackBaseClass):
     """
-    Callback to record time, position, velocity, and directors.
+    Callback to record time and node positions every `step_skip` steps into
+    the preallocated arrays of `callback_params`, in place.
     """
 
     def __init__(self, step_skip: int, callback_params: dict):
         ea.CallBackBaseClass.__init__(self)
         self.every = step_skip
         self.callback_params = callback_params
+        self.frame = 0
 
     def make_callback(self, system, time, current_step):
-        if current_step % self.every == 0:
-            self.callback_params["time"].append(time)
-            self.callback_params["position"].append(
-                system.position_collection.copy())
-            # self.callback_params["velocity"].append(system.velocity_collection.copy())
-            # self.callback_params["directors"].append(system.director_collection.copy())
+        if current_step % self.every == 0 and self.frame < len(self.callback_params["time"]):
+            self.callback_params["time"][self.frame] = time
+            self.callback_params["position"][self.frame] = system.position_collection
+            self.frame += 1
 
 
-def record_history(sim, rod, step_skip=100):
+def record_history(sim, rod, step_skip, n_frames):
     """
     Attaches a callback to record the rod's history.
-    Returns a dictionary list that will be populated during simulation.
+    Returns {"time": (n_frames,), "position": (n_frames, 3, n_nodes)} arrays
+    that will be filled during simulation; see `compute_frame_count` in
+    scene_to_code for the number of frames a run records.
     """
-    history = defaultdict(list)
+    history = {
+        "time": np.zeros(n_frames),
+        "position": np.zeros((n_frames, 3, rod.n_elems + 1)),
+    }
     sim.collect_diagnostics(rod).using(
         GenericRodCallBack, step_skip=step_skip, callback_params=history
     )
     return history
 
 
+class TrajectoryCallBack(ea.CallBackBaseClass):
+    """
+    Callback to stream the rod's node positions every `step_skip` steps to
+    a `TrajectoryWriter` (see trajectory.py), as rod `rod_index`.
+    """
+
+    def __init__(self, step_skip: int, writer, rod_index: int):
+        ea.CallBackBaseClass.__init__(self)
+        self.every = step_skip
+        self.writer = writer
+        self.rod_index = rod_index
+
+    def make_callback(self, system, time, current_step):
+        if current_step % self.every == 0:
+            self.writer.record(self.rod_index, time, system.position_collection)
+
+
+def record_trajectory(sim, rod, writer, rod_index, step_skip):
+    """
+    Attaches a callback streaming the rod's history to a trajectory writer,
+    which holds only a chunk of frames in memory at a time.
+    """
+    sim.collect_diagnostics(rod).using(
+        TrajectoryCallBack, step_skip=step_skip, writer=writer, rod_index=rod_index
+    )
+
+
 # --- Simulation Loop ---
 
 def finalize_and_integrate(
@@ -344,8 +369,30 @@ def finalize_and_integrate(
     *,
     final_time: float,
     total_steps: int,
+    progress_callback=None,
+    progress_interval: float = 0.5,
 ):
-    """Finalizes the simulator and runs the integration loop."""
+    """
+    Finalizes the simulator and runs the integration loop.
+
+    If progress_callback is given, it is called at most every
+    progress_interval seconds (wall time), and after the last step, as
+    progress_callback(step, total_steps, sim_time, wall_time).
+    """
     sim.finalize()
     timestepper = ea.PositionVerlet()
-    ea.integrate(timestepper, sim, final_time, total_steps)
+    if progress_callback is None:
+        ea.integrate(timestepper, sim, final_time, total_steps)
+        return
+
+    # Same stepping as ea.integrate, with a progress hook between steps
+    dt = np.float64(float(final_time) / total_steps)
+    time = np.float64(0.0)
+    start = last_report = perf_counter()
+    for step in tqdm(range(1, total_steps + 1)):
+        time = timestepper.step(sim, time, dt)
+        now = perf_counter()
+        if now - last_report >= progress_interval or step == total_steps:
+            progress_callback(step, total_steps, float(time), now - start)
+            last_report = now
+    print("Final time of simulation is : ", time)
@@ -0,0 +1,302 @@
+"""
+On-disk trajectory format of a simulation run.
+
+A trajectory file holds a JSON header followed by raw little-endian arrays:
+
+    magic (8 bytes) | version (uint32) | header length (uint32)
+    | frames written (uint64) | complete (uint32) | padding (4 bytes)
+    | JSON header | arrays
+
+The header gives the frame capacity, the run metadata (e.g. fps) and, for
+the frame times and every field of every rod ("position", and optionally
+others such as "velocity"), the array's byte offset, dtype and shape at
+full capacity. Arrays start on ALIGNMENT-byte boundaries so they are read
+as zero-copy views of one memory map. Positions may be stored as float32;
+times are always float64.
+
+`TrajectoryWriter` streams frames into the file while the simulation runs,
+in chunks of CHUNK_FRAMES frames, and bumps the frames-written counter after
+each chunk; closing it sets the complete flag. Readers only see written
+frames, so a file is readable while it is being written and after a crash.
+
+Version 1 files (written in one go, without the progress block) and runs
+from before this format, which only have a pickled `simulation_data.pkl`,
+are still read.
+
+This module is inlined into generated simulation scripts and imported by
+the renderer as a plain script, so it only depends on the standard
+library and NumPy.
+"""
+import os
+import json
+import pickle
+import struct
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+TRAJECTORY_FILENAME = "trajectory.bin"
+LEGACY_FILENAME = "simulation_data.pkl"
+
+MAGIC = b"SQTRAJ\x00\x00"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+# Frames written and the complete flag, rewritten in place (version 2 on)
+_PROGRESS = struct.Struct("<QI4x")
+
+# Frames buffered in memory per rod before they are written out
+CHUNK_FRAMES = 32
+
+# Storage dtype of rod fields, overridable via SQUISHY_TRAJECTORY_DTYPE
+DEFAULT_DTYPE = "float64"
+DTYPES = ("float32", "float64")
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def trajectory_dtype(dtype: Optional[str] = None) -> str:
+    """Resolves the storage dtype of rod fields; raises ValueError if unsupported."""
+    dtype = dtype or os.environ.get("SQUISHY_TRAJECTORY_DTYPE", DEFAULT_DTYPE)
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported trajectory dtype '{dtype}', expected one of {DTYPES}")
+    return dtype
+
+
+def _layout(n_frames: int, n_nodes: Sequence[int], fields: Sequence[str],
+            metadata: Dict[str, Any], dtype: np.dtype):
+    """Returns the header of a version 2 file, its padded encoding and the file size."""
+    start = _PREAMBLE.size + _PROGRESS.size
+    # Offsets depend on the header length, which depends on the offsets
+    header_length = 0
+    while True:
+        offset = _aligned(start + header_length)
+        header = {"version": FORMAT_VERSION, "n_frames": n_frames,
+                  "chunk_frames": CHUNK_FRAMES, "metadata": metadata}
+        header["time"] = {"offset": offset, "dtype": "<f8", "shape": [n_frames]}
+        offset = _aligned(offset + 8 * n_frames)
+        header["rods"] = []
+        for nodes in n_nodes:
+            entries = {}
+            for name in fields:
+                entries[name] = {"offset": offset, "dtype": dtype.str,
+                                 "shape": [n_frames, 3, nodes]}
+                offset = _aligned(offset + dtype.itemsize * 3 * nodes * n_frames)
+            header["rods"].append(entries)
+        encoded = json.dumps(header).encode("utf-8")
+        if len(encoded) <= header_length:
+            return header, encoded.ljust(header_length), offset
+        header_length = len(encoded)
+
+
+class TrajectoryWriter:
+    """
+    Streams a run's frames to a trajectory file with bounded memory.
+
+    The file is laid out for `n_frames` frames up front. Frames are recorded
+    per rod with `record` into a CHUNK_FRAMES buffer, which is written to its
+    final place once every rod has filled it; only then is the frame counter
+    advanced. `close` writes the remaining frames and marks the file complete.
+    """
+
+    def __init__(self, path: str, n_frames: int, n_nodes: Sequence[int],
+                 metadata: Dict[str, Any], dtype: Optional[str] = None,
+                 fields: Sequence[str] = ("position",)):
+        self.path = path
+        self.n_frames = n_frames
+        self.fields = tuple(fields)
+        dtype = np.dtype(trajectory_dtype(dtype)).newbyteorder("<")
+        self.header, encoded, size = _layout(n_frames, n_nodes, self.fields, metadata, dtype)
+
+        self.frames_written = 0
+        self.closed = False
+        self._times = np.zeros(CHUNK_FRAMES)
+        self._buffers = [[np.zeros((CHUNK_FRAMES, 3, nodes), dtype=dtype) for _ in self.fields]
+                         for nodes in n_nodes]
+        # Frames buffered per rod
+        self._counts = [0] * len(n_nodes)
+
+        # Replace rather than truncate an existing file: it may be a hard
+        # link into the result cache
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self._file = open(path, "w+b")
+        self._file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        self._file.write(_PROGRESS.pack(0, 0))
+        self._file.write(encoded)
+        # Reserve the arrays (sparse where the filesystem allows)
+        self._file.truncate(size)
+        self._file.flush()
+
+    def record(self, rod_index: int, time: float, *values):
+        """Buffers one frame of a rod: one (3, n_nodes) array per field."""
+        count = self._counts[rod_index]
+        if count == CHUNK_FRAMES or self.frames_written + count >= self.n_frames:
+            return
+        if rod_index == 0:
+            self._times[count] = time
+        for buffer, value in zip(self._buffers[rod_index], values):
+            buffer[count] = value
+        self._counts[rod_index] = count + 1
+        if min(self._counts) == CHUNK_FRAMES:
+            self.flush()
+
+    def flush(self):
+        """Writes the frames every rod has buffered and advances the frame counter."""
+        frames = min(self._counts, default=0)
+        if frames == 0:
+            return
+        first = self.frames_written
+        self._write(self.header["time"], first, self._times[:frames])
+        for entries, buffers in zip(self.header["rods"], self._buffers):
+            for name, buffer in zip(self.fields, buffers):
+                self._write(entries[name], first, buffer[:frames])
+        self._file.flush()
+
+        # Leftover frames of rods that are ahead move to the front
+        for index, count in enumerate(self._counts):
+            for buffer in self._buffers[index]:
+                buffer[:count - frames] = buffer[frames:count]
+            self._counts[index] = count - frames
+        self._times[:CHUNK_FRAMES - frames] = self._times[frames:].copy()
+
+        self.frames_written = first + frames
+        self._write_progress(complete=False)
+
+    def close(self, complete: bool = True):
+        """Flushes buffered frames and, if `complete`, marks the file finished."""
+        if self.closed:
+            return
+        self.flush()
+        self._write_progress(complete=complete)
+        self._file.close()
+        self.closed = True
+
+    def _write(self, entry: Dict[str, Any], first: int, values: np.ndarray):
+        frame_bytes = values[0].nbytes
+        self._file.seek(entry["offset"] + first * frame_bytes)
+        self._file.write(values.tobytes())
+
+    def _write_progress(self, complete: bool):
+        self._file.seek(_PREAMBLE.size)
+        self._file.write(_PROGRESS.pack(self.frames_written, int(complete)))
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+
+def write_trajectory(path: str, times, rods: List[Dict[str, Any]],
+                     metadata: Dict[str, Any], dtype: Optional[str] = None) -> str:
+    """
+    Writes a whole recorded run as a trajectory file. `times` has one entry
+    per frame and every rod maps field names to (frames, 3, n) arrays.
+    """
+    fields = tuple(rods[0]) if rods else ("position",)
+    n_nodes = [np.shape(rod[fields[0]])[-1] for rod in rods]
+    with TrajectoryWriter(path, len(times), n_nodes, metadata, dtype=dtype,
+                          fields=fields) as writer:
+        for frame, time in enumerate(times):
+            for index, rod in enumerate(rods):
+                writer.record(index, time, *(rod[name][frame] for name in fields))
+    return path
+
+
+class Trajectory:
+    """
+    A run's recorded frames: `times` (frames,), and per rod in `rods` a dict
+    of fields such as "position" (frames, 3, n_nodes). Arrays read from a
+    trajectory file are read-only views of a memory map.
+    """
+
+    def __init__(self, times, rods: List[Dict[str, Any]], metadata: Dict[str, Any],
+                 version: int, complete: bool = True):
+        self.times = times
+        self.rods = rods
+        self.metadata = metadata
+        self.version = version
+        # False while the run is still writing (or if it stopped early)
+        self.complete = complete
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.times)
+
+    @property
+    def fps(self):
+        return self.metadata.get("fps", 30)
+
+    def positions(self, index: int):
+        return self.rods[index]["position"]
+
+
+def read_trajectory(path: str) -> Trajectory:
+    """
+    Memory-maps a trajectory file, including one still being written (only
+    its written frames are visible; see `Trajectory.complete`).
+
+    Raises:
+        ValueError: If the file is not a trajectory or has an unknown version.
+    """
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(buffer) < _PREAMBLE.size + _PROGRESS.size:
+        raise ValueError(f"{path} is not a trajectory file")
+    magic, version, header_length = _PREAMBLE.unpack(bytes(buffer[:_PREAMBLE.size]))
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a trajectory file")
+    if version not in (1, FORMAT_VERSION):
+        raise ValueError(f"{path} has unsupported trajectory version {version}")
+
+    start = _PREAMBLE.size
+    if version >= 2:
+        frames, complete = _PROGRESS.unpack(bytes(buffer[start:start + _PROGRESS.size]))
+        start += _PROGRESS.size
+    header = json.loads(bytes(buffer[start:start + header_length]))
+    if version == 1:
+        frames, complete = header["n_frames"], True
+
+    def view(entry):
+        dtype = np.dtype(entry["dtype"])
+        shape = [frames] + entry["shape"][1:]
+        count = int(np.prod(shape))
+        offset = entry["offset"]
+        return buffer[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+
+    rods = [{name: view(entry) for name, entry in fields.items()} for fields in header["rods"]]
+    return Trajectory(view(header["time"]), rods, header["metadata"], version,
+                      complete=bool(complete))
+
+
+def read_legacy_trajectory(path: str) -> Trajectory:
+    """Reads a pickled {'rods': [{'time', 'position'}, ...], 'metadata'} file."""
+    with open(path, "rb") as f:
+        data = pickle.load(f)
+    histories = data["rods"]
+    times = np.asarray(histories[0]["time"], dtype=float) if histories else np.zeros(0)
+    rods = [{"position": np.asarray(history["position"], dtype=float).reshape(len(times), 3, -1)}
+            for history in histories]
+    return Trajectory(times, rods, data.get("metadata", {}), 0)
+
+
+def open_trajectory(output_dir: str) -> Trajectory:
+    """
+    Opens the trajectory of a run directory, falling back to the legacy
+    pickle of older runs.
+
+    Raises:
+        FileNotFoundError: If the run has no recorded trajectory.
+    """
+    path = os.path.join(output_dir, TRAJECTORY_FILENAME)
+    if os.path.exists(path):
+        return read_trajectory(path)
+    legacy_path = os.path.join(output_dir, LEGACY_FILENAME)
+    if os.path.exists(legacy_path):
+        return read_legacy_trajectory(legacy_path)
+    raise FileNotFoundError(f"No trajectory in {output_dir}")
@@ -0,0 +1,145 @@
+"""
+Video output of the renderer: raw RGB frames streamed into an ffmpeg
+subprocess over stdin, encoded as H.264 MP4 or VP9 WebM.
+
+Like trajectory.py, this module is imported by the renderer as a plain
+script, so it only depends on the standard library.
+"""
+import os
+import shutil
+import tempfile
+import subprocess
+from typing import List, Sequence
+
+# Container -> media type and ffmpeg output arguments
+VIDEO_FORMATS = {
+    "mp4": {"media_type": "video/mp4",
+            "args": ["-f", "mp4", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                     "-movflags", "+faststart"]},
+    "webm": {"media_type": "video/webm",
+             "args": ["-f", "webm", "-c:v", "libvpx-vp9", "-pix_fmt", "yuv420p",
+                      "-b:v", "0", "-row-mt", "1"]},
+}
+
+# Quality preset -> encoder settings per container. Rod animations are mostly
+# flat background, so even the low presets stay sharp on the rods.
+QUALITY_PRESETS = {
+    "low": {"mp4": ["-preset", "veryfast", "-crf", "32"],
+            "webm": ["-crf", "42", "-deadline", "realtime", "-cpu-used", "8"]},
+    "medium": {"mp4": ["-preset", "veryfast", "-crf", "26"],
+               "webm": ["-crf", "36", "-deadline", "good", "-cpu-used", "5"]},
+    "high": {"mp4": ["-preset", "medium", "-crf", "20"],
+             "webm": ["-crf", "30", "-deadline", "good", "-cpu-used", "2"]},
+}
+
+# Preset used when none is given, overridable via SQUISHY_VIDEO_QUALITY
+DEFAULT_QUALITY = "medium"
+
+
+def video_filename(video_format: str, base_name: str = "simulation") -> str:
+    return f"{base_name}.{video_format}"
+
+
+def video_quality(quality: str = None) -> str:
+    """Resolves the quality preset; raises ValueError if unknown."""
+    quality = quality or os.environ.get("SQUISHY_VIDEO_QUALITY", DEFAULT_QUALITY)
+    if quality not in QUALITY_PRESETS:
+        raise ValueError(f"Unknown video quality '{quality}', expected one of "
+                         f"{tuple(QUALITY_PRESETS)}")
+    return quality
+
+
+def ffmpeg_executable() -> str:
+    """
+    The ffmpeg binary, from SQUISHY_FFMPEG or the PATH.
+
+    Raises:
+        FileNotFoundError: If ffmpeg is not installed.
+    """
+    executable = os.environ.get("SQUISHY_FFMPEG") or shutil.which("ffmpeg")
+    if not executable:
+        raise FileNotFoundError("ffmpeg not found; install it or set SQUISHY_FFMPEG")
+    return executable
+
+
+def ffmpeg_command(path: str, size: Sequence[int], fps: float, video_format: str,
+                   quality: str) -> List[str]:
+    """ffmpeg arguments encoding rgb24 frames read from stdin to `path`."""
+    return [ffmpeg_executable(), "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}",
+            "-framerate", f"{fps:g}", "-i", "-",
+            *VIDEO_FORMATS[video_format]["args"], *QUALITY_PRESETS[quality][video_format],
+            path]
+
+
+class VideoWriter:
+    """
+    Encodes frames to a video file as they are written. The video is
+    written next to `path` and only moved into place once ffmpeg succeeds,
+    so a partial file is never served.
+    """
+
+    def __init__(self, path: str, size: Sequence[int], fps: float, video_format: str,
+                 quality: str = None):
+        if video_format not in VIDEO_FORMATS:
+            raise ValueError(f"Unknown video format '{video_format}', expected one of "
+                             f"{tuple(VIDEO_FORMATS)}")
+        self.path = path
+        self._partial = f"{path}.part"
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            ffmpeg_command(self._partial, size, fps, video_format, video_quality(quality)),
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def write(self, frames: bytes):
+        """Writes one or more rgb24 frames."""
+        try:
+            self._process.stdin.write(frames)
+        except BrokenPipeError:
+            # ffmpeg exited early; close() reports why
+            self.close()
+
+    def close(self):
+        """
+        Finishes the video.
+
+        Raises:
+            RuntimeError: If ffmpeg failed.
+        """
+        if self._process.stdin.closed:
+            return
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._process.wait()
+        self._stderr.seek(0)
+        error = self._stderr.read().decode("utf-8", "replace").strip()
+        self._stderr.close()
+        if returncode != 0:
+            if os.path.exists(self._partial):
+                os.remove(self._partial)
+            raise RuntimeError(f"ffmpeg exited with {returncode}: {error}")
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        """Stops ffmpeg and discards the partial video."""
+        if not self._process.stdin.closed:
+            self._process.kill()
+            self._process.wait()
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self._stderr.close()
+        if os.path.exists(self._partial):
+            os.remove(self._partial)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,461 @@
+import os
+import sys
+import gc
+import queue
+import runpy
+import logging
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Callable
+
+from . import limits
+
+logger = logging.getLogger(__name__)
+
+# Number of jobs a worker runs before it is replaced by a fresh process.
+# Recycling bounds slow leaks (matplotlib/numba caches, fragmented heaps).
+DEFAULT_MAX_JOBS_PER_WORKER = 50
+
+# How long a freshly spawned worker may take to import and JIT-warm PyElastica.
+WORKER_STARTUP_TIMEOUT = 600.0
+
+
+# Receives {"step", "total_steps", "sim_time", "wall_time"} from a running job
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised when a worker process dies while it is running a job."""
+
+
+class SimulationJobError(RuntimeError):
+    """Raised when a job raised an exception inside the worker."""
+
+
+def use_worker_pool() -> bool:
+    """
+    Whether simulations should be dispatched to the warm worker pool.
+    Disabled on Vercel (no long-lived processes) or via SQUISHY_WORKER_POOL=0.
+    """
+    if os.environ.get("VERCEL"):
+        return False
+    return os.environ.get("SQUISHY_WORKER_POOL", "1").lower() not in ("0", "false", "no")
+
+
+# --- Worker process side ---
+
+def _warm_up():
+    """
+    Imports PyElastica and runs a tiny scene touching every template helper so
+    that all Numba kernels are compiled before the first real job arrives.
+    """
+    from backend.api import templates
+
+    dt = 1e-4
+    sim = templates.create_simulator()
+    rods = [
+        templates.make_rod(sim, n_elem=4, length=0.1, radius=0.01, density=1000.0,
+                           youngs_modulus=1e5, start=(0.0, 0.0, 0.1 * i), nu=1e-4, dt=dt)
+        for i in range(4)
+    ]
+    templates.clamp_start(sim, rods[0])
+    templates.clamp_end(sim, rods[3])
+    templates.add_gravity(sim, rods[0])
+    templates.add_endpoint_force(sim, rods[1], force=[0.0, 0.0, 1e-3], ramp_up_time=dt)
+    templates.add_muscle_activity(sim, rods[1], amplitude=0.01, wave_length=0.1,
+                                  frequency=1.0, phase=0.0, ramp=0.0)
+    templates.add_anisotropic_friction(sim, rods[2], static_friction=[0.1, 0.1, 0.1],
+                                       kinetic_friction=[0.1, 0.1, 0.1])
+    templates.connect_fixed(sim, rods[0], rods[1])
+    templates.connect_spherical(sim, rods[1], rods[2])
+    templates.connect_hinge(sim, rods[2], rods[3])
+    for rod in rods:
+        templates.record_history(sim, rod, step_skip=1, n_frames=11)
+    templates.finalize_and_integrate(sim, final_time=10 * dt, total_steps=10)
+
+
+class _redirect_output:
+    """
+    Points the worker's stdout/stderr file descriptors at a log file for the
+    duration of a job, so prints from Python, tqdm and native code all land in
+    the job's log exactly as they would with a subprocess.
+    """
+
+    def __init__(self, log_path: Optional[str]):
+        self.log_path = log_path
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = (os.dup(1), os.dup(2))
+        target = self.log_path or os.devnull
+        self.log_file = open(target, "w")
+        os.dup2(self.log_file.fileno(), 1)
+        os.dup2(self.log_file.fileno(), 2)
+        return self
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        os.close(self.saved[0])
+        os.close(self.saved[1])
+        self.log_file.close()
+        return False
+
+
+def _run_script(payload: Dict[str, Any], report: Callable[[Dict[str, Any]], None]):
+    """Executes a generated script as __main__ inside its output directory."""
+    script_path = payload["script_path"]
+    saved_cwd = os.getcwd()
+    saved_argv = sys.argv
+    try:
+        os.chdir(payload["cwd"])
+        sys.argv = [script_path]
+        runpy.run_path(script_path, run_name="__main__")
+    finally:
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+
+
+def _run_scene(payload: Dict[str, Any], report: Callable[[Dict[str, Any]], None]):
+    """Builds and integrates a scene in-process with SceneRunner, reporting progress."""
+    from backend.api.scene_runner import SceneRunner
+
+    def progress_callback(step, total_steps, sim_time, wall_time):
+        report({"step": step, "total_steps": total_steps,
+                "sim_time": sim_time, "wall_time": wall_time})
+
+    SceneRunner(payload["scene"]).run_to_file(
+        payload["output_dir"], progress_callback=progress_callback)
+
+
+JOB_HANDLERS = {
+    "script": _run_script,
+    "scene": _run_scene,
+}
+
+
+def _worker_main(conn, warm_up: bool = True, max_memory: Optional[int] = None):
+    """Entry point of a pool worker process."""
+    limits.set_memory_limit(max_memory)
+    limits.raise_on_sigxcpu()
+    if warm_up:
+        try:
+            with _redirect_output(None):
+                _warm_up()
+        except Exception as e:
+            # A cold worker is still better than no worker
+            logger.warning(f"Simulation worker warm-up failed: {e!r}")
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        kind, payload = message
+
+        def report(progress: Dict[str, Any]):
+            conn.send(("progress", progress))
+
+        try:
+            with _redirect_output(payload.get("log_path")):
+                try:
+                    limits.set_cpu_budget(payload.get("cpu_seconds"))
+                    result = JOB_HANDLERS[kind](payload, report)
+                except BaseException:
+                    # Mirror the traceback into the job log like a subprocess would
+                    traceback.print_exc()
+                    raise
+                finally:
+                    limits.clear_cpu_budget()
+            conn.send(("ok", result))
+        except SystemExit as e:
+            if e.code in (None, 0):
+                conn.send(("ok", None))
+            else:
+                conn.send(("error", f"Script exited with status {e.code}"))
+        except limits.JobTerminatedError as e:
+            conn.send(("terminated", (e.reason, str(e))))
+        except MemoryError:
+            conn.send(("terminated", (limits.MEMORY_LIMIT, "Memory limit exceeded")))
+        except BaseException as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            gc.collect()
+
+
+# --- Pool side ---
+
+class _Worker:
+    """Handle on a single worker process and its control pipe."""
+
+    def __init__(self, ctx, warm_up: bool, max_memory: Optional[int] = None):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, warm_up, max_memory), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+        # Set when the pool kills the worker on purpose (see SimulationWorkerPool.cancel)
+        self.kill_reason = None
+
+    def kill(self, reason: str):
+        self.kill_reason = reason
+        self.process.kill()
+
+    def _crashed(self) -> Exception:
+        if self.kill_reason is not None:
+            return limits.JobTerminatedError(
+                f"Simulation stopped ({self.kill_reason})", self.kill_reason)
+        return WorkerCrashedError(
+            f"Worker crashed (exit code {self.process.exitcode})")
+
+    def wait_ready(self, timeout: float):
+        if not self.conn.poll(timeout):
+            raise WorkerCrashedError("Worker did not become ready in time")
+        try:
+            status, _ = self.conn.recv()
+        except EOFError:
+            self.process.join(1.0)
+            raise WorkerCrashedError(
+                f"Worker exited during warm-up (exit code {self.process.exitcode})")
+        if status != "ready":
+            raise WorkerCrashedError(f"Unexpected worker handshake: {status}")
+
+    def run(self, kind: str, payload: Dict[str, Any], on_progress: Optional[ProgressCallback] = None):
+        self.conn.send((kind, payload))
+        while True:
+            while not self.conn.poll(0.5):
+                if not self.process.is_alive():
+                    raise self._crashed()
+            try:
+                status, result = self.conn.recv()
+            except (EOFError, OSError):
+                self.process.join(1.0)
+                raise self._crashed()
+            if status != "progress":
+                break
+            if on_progress is not None:
+                try:
+                    on_progress(result)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed: {e!r}")
+        if status == "terminated":
+            reason, message = result
+            raise limits.JobTerminatedError(message, reason)
+        if status != "ok":
+            raise SimulationJobError(result)
+        return result
+
+    def stop(self, timeout: float = 5.0):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SimulationWorkerPool:
+    """
+    A pool of long-lived worker processes that have already imported and
+    JIT-warmed PyElastica.
+
+    Each slot owns one worker and runs one job at a time on it. A worker that
+    crashes fails only the job it was running and is replaced; a worker that has
+    completed `max_jobs_per_worker` jobs is recycled.
+
+    Every job runs under a CPU-time budget (`cpu_seconds`) and every worker
+    under an address-space limit (`max_memory` bytes); None disables either.
+    Running jobs can be stopped with `cancel`, which kills their worker.
+    """
+
+    def __init__(self, size: Optional[int] = None, max_jobs_per_worker: int = DEFAULT_MAX_JOBS_PER_WORKER,
+                 warm_up: bool = True, cpu_seconds: Optional[float] = None, max_memory: Optional[int] = None):
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.warm_up = warm_up
+        self.cpu_seconds = cpu_seconds
+        self.max_memory = max_memory
+        self._ctx = multiprocessing.get_context("spawn")
+        self._jobs = queue.Queue()
+        # Running job futures -> their worker (None while it is being spawned)
+        self._running: Dict[Future, Optional[_Worker]] = {}
+        self._kill_requests: Dict[Future, str] = {}
+        self._lock = threading.Lock()
+        self._slots = []
+        for i in range(self.size):
+            thread = threading.Thread(
+                target=self._slot_loop, name=f"sim-worker-{i}", daemon=True)
+            thread.start()
+            self._slots.append(thread)
+
+    def submit(self, kind: str, payload: Dict[str, Any], on_progress: Optional[ProgressCallback] = None) -> Future:
+        """
+        Queues a job for the next free worker.
+
+        on_progress, if given, is called from a pool thread with each progress
+        report of the job: {"step", "total_steps", "sim_time", "wall_time"}.
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        future = Future()
+        self._jobs.put((future, kind, {"cpu_seconds": self.cpu_seconds, **payload}, on_progress))
+        return future
+
+    def cancel(self, future: Future, reason: str = limits.CANCELLED) -> bool:
+        """
+        Stops a job: a queued job is dropped, a running one has its worker
+        killed and fails with JobTerminatedError(reason). Returns False if the
+        job had already finished.
+        """
+        if future.cancel():
+            return True
+        with self._lock:
+            if future not in self._running:
+                return False
+            worker = self._running[future]
+            if worker is None:
+                self._kill_requests[future] = reason
+                return True
+            logger.info(f"Killing simulation worker {worker.process.pid} ({reason})")
+            worker.kill(reason)
+        return True
+
+    def run_script(self, script_path: str, cwd: str, log_path: Optional[str] = None):
+        """Runs a generated simulation script on a warm worker and waits for it."""
+        return self.submit("script", {
+            "script_path": script_path,
+            "cwd": cwd,
+            "log_path": log_path,
+        }).result()
+
+    def submit_scene(self, scene: Dict[str, Any], output_dir: str, log_path: Optional[str] = None,
+                     on_progress: Optional[ProgressCallback] = None) -> Future:
+        """Queues a scene dict to be built and run directly on a warm worker."""
+        return self.submit("scene", {
+            "scene": scene,
+            "output_dir": output_dir,
+            "log_path": log_path,
+        }, on_progress=on_progress)
+
+    def run_scene(self, scene: Dict[str, Any], output_dir: str, log_path: Optional[str] = None,
+                  on_progress: Optional[ProgressCallback] = None):
+        """Builds and runs a scene dict directly on a warm worker and waits for it."""
+        return self.submit_scene(scene, output_dir, log_path, on_progress).result()
+
+    def shutdown(self):
+        for _ in self._slots:
+            self._jobs.put(None)
+        for thread in self._slots:
+            thread.join()
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx, self.warm_up, self.max_memory)
+        try:
+            worker.wait_ready(WORKER_STARTUP_TIMEOUT)
+        except WorkerCrashedError:
+            worker.stop()
+            raise
+        logger.info(f"Simulation worker {worker.process.pid} ready")
+        return worker
+
+    def _slot_loop(self):
+        worker = None
+        while True:
+            if worker is None:
+                try:
+                    worker = self._spawn()
+                except WorkerCrashedError as e:
+                    logger.error(f"Failed to start simulation worker: {e}")
+
+            item = self._jobs.get()
+            if item is None:
+                break
+            future, kind, payload, on_progress = item
+            with self._lock:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._running[future] = None
+
+            try:
+                if worker is None:
+                    worker = self._spawn()
+                with self._lock:
+                    self._running[future] = worker
+                    reason = self._kill_requests.pop(future, None)
+                if reason is not None:
+                    raise limits.JobTerminatedError(f"Simulation stopped ({reason})", reason)
+                result = worker.run(kind, payload, on_progress)
+            except WorkerCrashedError as e:
+                logger.error(f"Simulation worker failed: {e}")
+                if worker is not None:
+                    worker.stop()
+                worker = None
+                future.set_exception(e)
+            except limits.JobTerminatedError as e:
+                # Killed, or over its CPU/memory limit: start the next job on a fresh worker
+                if worker is not None and (not worker.process.is_alive() or
+                                           e.reason == limits.MEMORY_LIMIT):
+                    worker.stop()
+                    worker = None
+                future.set_exception(e)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self._running.pop(future, None)
+                    self._kill_requests.pop(future, None)
+                if worker is not None and worker.kill_reason is not None:
+                    # Killed just as its job finished
+                    worker.stop()
+                    worker = None
+
+            if worker is None:
+                continue
+            worker.jobs_done += 1
+            if worker.jobs_done >= self.max_jobs_per_worker:
+                logger.info(
+                    f"Recycling simulation worker {worker.process.pid} after {worker.jobs_done} jobs")
+                worker.stop()
+                worker = None
+
+        if worker is not None:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> SimulationWorkerPool:
+    """
+    Returns the process-wide worker pool, starting it on first use.
+    Size and recycling are configured via SQUISHY_SIM_WORKERS and
+    SQUISHY_WORKER_MAX_JOBS, limits via SQUISHY_SIM_CPU_SECONDS and
+    SQUISHY_WORKER_MAX_MEMORY_MB.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            size = int(os.environ.get("SQUISHY_SIM_WORKERS", "0")) or None
+            max_jobs = int(os.environ.get(
+                "SQUISHY_WORKER_MAX_JOBS", DEFAULT_MAX_JOBS_PER_WORKER))
+            _pool = SimulationWorkerPool(
+                size=size, max_jobs_per_worker=max_jobs,
+                cpu_seconds=limits.sim_cpu_seconds(),
+                max_memory=limits.worker_memory_bytes())
+        return _pool
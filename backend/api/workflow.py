@@ -1,78 +1,383 @@
 import os
 import sys
+import json
 import time
-import datetime
+import asyncio
+import contextlib
 import subprocess
-from backend.api.pipeline import SceneGeneratorPipeline
+from typing import Optional, Dict, Any, List
+from backend.api.artifact_store import get_artifact_store
+from backend.api import limits
+from backend.api.cost_model import get_cost_model
+from backend.api.jobs import Job
+from backend.api.job_ids import new_job_id
+from backend.api.paths import get_output_dir
+from backend.api.pipeline import SceneGeneratorPipeline, AsyncSceneGeneratorPipeline
+from backend.api.render_cache import RenderParams, get_render_cache
+from backend.api.result_cache import get_result_cache, hash_scene
+from backend.api.scene_to_code import generate_script_from_scene, validate_scene
+from backend.api.scheduler import get_scheduler
+from backend.api.worker_pool import get_worker_pool, use_worker_pool
 
+SCENE_FILENAME = "scene.json"
+METADATA_FILENAME = "metadata.json"
 
-def run_simulation_workflow(prompt: str, timestamp_id: str = None) -> str:
+
+def _write_metadata(output_dir: str, metadata: Dict[str, Any], job: Optional[Job] = None):
+    """Persists run metadata next to the artifacts and mirrors it onto the job record."""
+    if job is not None:
+        job.update(**metadata)
+    with open(os.path.join(output_dir, METADATA_FILENAME), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def _prepare_output_dir(timestamp_id: Optional[str]):
+    """
+    Creates the run directory. Returns (timestamp_id, output_dir).
+
+    Raises:
+        FileExistsError: If the directory already exists; runs never share one.
+    """
+    if timestamp_id is None:
+        timestamp_id = new_job_id()
+
+    output_dir = get_output_dir(timestamp_id)
+    os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+    os.mkdir(output_dir)
+    # Protected from eviction until the workflow finishes
+    get_artifact_store().begin(output_dir)
+    print(f"Output directory created: {output_dir}")
+    return timestamp_id, output_dir
+
+
+def _save_scene(scene: Dict[str, Any], output_dir: str, job: Optional[Job], mode: str):
+    """
+    Validates and saves the scene, then tries the result cache.
+    Returns (scene_hash, cache_hit).
     """
-    Runs the full simulation pipeline.
+    validate_scene(scene)
+
+    # The script for the code view is generated from the scene on demand
+    scene_path = os.path.join(output_dir, SCENE_FILENAME)
+    print(f"\n[3/5] Saving scene to: {scene_path}")
+    with open(scene_path, "w") as f:
+        json.dump(scene, f, indent=2)
+
+    # Identical scenes produce identical results: reuse them when available
+    scene_hash = hash_scene(scene)
+    cache = get_result_cache()
+    hit = cache.restore(scene_hash, output_dir)
+    if hit:
+        get_artifact_store().touch_path(cache.entry_dir(scene_hash))
+        print(f"\nCache hit for scene {scene_hash}, skipping simulation.")
+    _write_metadata(output_dir, {"scene_hash": scene_hash,
+                    "cache": "hit" if hit else "miss", "mode": mode}, job)
+    return scene_hash, hit
+
+
+def _estimate_cost(scene: Dict[str, Any], job: Optional[Job]) -> Dict[str, Any]:
+    """Predicts the simulation's runtime and memory and publishes it on the job."""
+    estimate = get_cost_model().estimate(scene)
+    print(f"Estimated simulation cost: {estimate['wall_seconds']:.1f}s, "
+          f"{estimate['peak_memory_mb']:.0f} MB peak")
+    if job is not None:
+        job.update(estimate=estimate)
+    return estimate
+
+
+def _observe_cost(scene: Dict[str, Any], job: Optional[Job]):
+    """Calibrates the cost model with the integration time reported by the worker."""
+    report = job.info.get("simulation") if job is not None else None
+    if report is not None:
+        get_cost_model().observe(scene, report["wall_time"])
+
+
+def _write_script(scene: Dict[str, Any], output_dir: str) -> List[str]:
+    """Writes the generated script for subprocess execution. Returns its command."""
+    script_filename = "generated_simulation.py"
+    with open(os.path.join(output_dir, script_filename), "w") as f:
+        f.write(generate_script_from_scene(scene))
+    print(f"\n[4/5] Running simulation script ({script_filename})...")
+    return [sys.executable, script_filename]
+
+
+def _record_failure(timestamp_id: str, output_dir: str, e: Exception):
+    print(f"Workflow failed for ID {timestamp_id}: {e}")
+    # Write error to a status file
+    with open(os.path.join(output_dir, "error.log"), "w") as f:
+        f.write(str(e))
+
+
+def _scene_object_reporter(job: Optional[Job]):
+    """on_object callback for streamed scene generation."""
+    def on_object(index: int, rod: Dict[str, Any], dt_estimate: float):
+        print(f"Scene rod {index} validated ({rod['material']}, dt ~ {dt_estimate:.3g})")
+        if job is not None:
+            job.update(scene_objects=index + 1, dt_estimate=dt_estimate)
+    return on_object
+
+
+# LLM pipeline step -> job stage
+_LLM_STAGES = {"polish": "polishing", "scene": "scene", "fused": "scene"}
+
+
+def _set_stage(job: Optional[Job], stage: str, progress: Optional[float] = None):
+    if job is not None:
+        job.set_stage(stage, progress)
+
+
+def _simulation_progress_reporter(job: Optional[Job]):
+    """on_progress callback of the worker pool, reports percent done and ETA."""
+    def on_progress(report: Dict[str, Any]):
+        if job is None:
+            return
+        step, total_steps = report["step"], report["total_steps"]
+        eta_seconds = report["wall_time"] / step * (total_steps - step)
+        job.report_progress(
+            round(100.0 * step / total_steps, 1),
+            eta_seconds=round(eta_seconds, 1),
+            simulation={**report, "steps_per_second": step / max(report["wall_time"], 1e-9)},
+        )
+    return on_progress
+
+
+def _llm_step_reporter(job: Optional[Job]):
+    """on_step callback of the pipeline, moves the job to the matching stage."""
+    def on_step(kind: str):
+        _set_stage(job, _LLM_STAGES.get(kind, "scene"))
+    return on_step
+
+
+def run_simulation_workflow(prompt: str, timestamp_id: str = None, job: Optional[Job] = None,
+                            mode: str = "two_step", stream: bool = True) -> str:
+    """
+    Runs the simulation pipeline up to the recorded trajectory; outputs are
+    rendered on request (see render_cache).
     If timestamp_id is provided, uses it for the folder name.
-    Otherwise, generates a new timestamp.
+    Otherwise, generates a new job ID.
+    If job is provided, run metadata (scene hash, cache hit/miss) is recorded on it.
+    mode selects the scene generation mode ("two_step" or "fused"); stream
+    validates the scene rod by rod while the LLM is still responding.
     Returns the timestamp_id used.
     """
     # 0. Setup Directories
-    # backend/api/workflow.py -> backend/api -> backend
-    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timestamp_id, output_dir = _prepare_output_dir(timestamp_id)
 
-    if os.environ.get("VERCEL"):
-        generated_base_dir = os.path.join("/tmp", "generated")
-    else:
-        generated_base_dir = os.path.join(backend_dir, "generated")
+    try:
+        # 1. Initialize Pipeline
+        print("\n[1/5] Initializing SceneGeneratorPipeline...")
+        pipeline = SceneGeneratorPipeline(on_step=_llm_step_reporter(job))
 
-    if timestamp_id is None:
-        timestamp_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 2. Generate Scene
+        print(f"\n[2/5] Generating scene for prompt: '{prompt}'")
+        scene = pipeline.generate_scene(
+            prompt, mode=mode, stream=stream, on_object=_scene_object_reporter(job))
 
-    output_dir = os.path.join(generated_base_dir, timestamp_id)
-    os.makedirs(output_dir, exist_ok=True)
-    print(f"Output directory created: {output_dir}")
+        # 3. Save Scene
+        _set_stage(job, "codegen")
+        scene_hash, cache_hit = _save_scene(scene, output_dir, job, mode)
+        if cache_hit:
+            print(f"Workflow completed successfully for ID: {timestamp_id}")
+            return timestamp_id
+        get_scheduler().admit(_estimate_cost(scene, job))
+
+        # 4. Run Simulation
+        _set_stage(job, "simulating", progress=0.0)
+        # Capture output to log file for debugging
+        sim_log_path = os.path.join(output_dir, "simulation.log")
+        if use_worker_pool():
+            # Warm worker builds the simulator straight from the scene,
+            # PyElastica is already imported and JIT-compiled
+            print("\n[4/5] Running simulation on worker pool...")
+            get_worker_pool().run_scene(
+                scene, output_dir=output_dir, log_path=sim_log_path,
+                on_progress=_simulation_progress_reporter(job))
+        else:
+            cmd_sim = _write_script(scene, output_dir)
+            # Run inside the output_dir so output files appear there
+            with open(sim_log_path, "w") as log_file:
+                result = subprocess.run(cmd_sim, cwd=output_dir, preexec_fn=_child_limits(),
+                                        stdout=log_file, stderr=subprocess.STDOUT)
+            _check_returncode(result.returncode, cmd_sim)
+
+        # Outputs are rendered on request, see render_cache
+        get_result_cache().store(scene_hash, output_dir)
+        _observe_cost(scene, job)
+
+        print(f"Workflow completed successfully for ID: {timestamp_id}")
+        return timestamp_id
+
+    except Exception as e:
+        _record_failure(timestamp_id, output_dir, e)
+        raise e
+    finally:
+        get_artifact_store().finish(output_dir)
+
+
+def _child_limits():
+    """preexec_fn giving simulation and render subprocesses the job's CPU and memory limits."""
+    return limits.subprocess_limits(limits.sim_cpu_seconds(), limits.worker_memory_bytes())
+
+
+def _check_returncode(returncode: int, cmd: List[str]):
+    if returncode == 0:
+        return
+    terminated = limits.termination_from_returncode(returncode)
+    if terminated is not None:
+        raise terminated
+    raise subprocess.CalledProcessError(returncode, cmd)
+
+
+async def _run_subprocess_async(cmd: List[str], cwd: str, log_path: str):
+    """
+    asyncio equivalent of subprocess.run(cmd, check=True) with output to a log
+    file. The child runs under the job's CPU and memory limits and is killed
+    if the awaiting task is cancelled.
+    """
+    with open(log_path, "w") as log_file:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, cwd=cwd, stdout=log_file, stderr=asyncio.subprocess.STDOUT,
+            preexec_fn=_child_limits())
+        try:
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            await asyncio.shield(process.wait())
+            raise
+    _check_returncode(returncode, cmd)
+
+
+async def _await_pool_job(future):
+    """Awaits a worker pool job; cancelling the awaiting task kills its worker."""
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        get_worker_pool().cancel(future)
+        raise
+
+
+def _simulation_slot(job: Optional[Job], estimate: Dict[str, Any]):
+    """
+    Admits the estimate and waits for a scheduler slot. Runs without a job
+    (outside the scheduler) only check the admission limits.
+    """
+    scheduler = get_scheduler()
+    if job is None:
+        scheduler.admit(estimate)
+        return contextlib.nullcontext()
+    return scheduler.slot(job, estimate)
+
+
+def _record_termination(timestamp_id: str, output_dir: str, job: Optional[Job]):
+    reason = job.info.get("termination_reason", limits.CANCELLED) if job else limits.CANCELLED
+    _record_failure(timestamp_id, output_dir,
+                    limits.JobTerminatedError(f"Job was terminated ({reason})", reason))
+
+
+async def _simulate_async(scene: Dict[str, Any], scene_hash: str, output_dir: str,
+                          job: Optional[Job], render: bool = False):
+    """
+    Steps 4 and 5 of the async workflows: simulate and cache a saved scene,
+    then render the default GIF into the render cache if asked to. Otherwise
+    the first request for the GIF (or a video or frame) renders it.
+    """
+    # Simulations wait for a scheduler slot, shortest job first
+    async with _simulation_slot(job, _estimate_cost(scene, job)):
+        # 4. Run Simulation
+        _set_stage(job, "simulating", progress=0.0)
+        sim_log_path = os.path.join(output_dir, "simulation.log")
+        if use_worker_pool():
+            print("\n[4/5] Running simulation on worker pool...")
+            await _await_pool_job(get_worker_pool().submit_scene(
+                scene, output_dir=output_dir, log_path=sim_log_path,
+                on_progress=_simulation_progress_reporter(job)))
+        else:
+            cmd_sim = _write_script(scene, output_dir)
+            await _run_subprocess_async(cmd_sim, output_dir, sim_log_path)
+
+    get_result_cache().store(scene_hash, output_dir)
+    _observe_cost(scene, job)
+
+    # 5. Run Renderer
+    if render:
+        _set_stage(job, "rendering")
+        print("\n[5/5] Running renderer...")
+        await get_render_cache().render(output_dir, RenderParams())
+
+
+async def run_simulation_workflow_async(prompt: str, timestamp_id: str = None, job: Optional[Job] = None,
+                                        mode: str = "two_step", stream: bool = True,
+                                        render: bool = False) -> str:
+    """
+    Asynchronous version of run_simulation_workflow.
+
+    LLM calls go through AsyncOpenAI, the simulation runs on the worker pool
+    (or an asyncio subprocess) and the renderer runs as an asyncio subprocess,
+    so an in-flight job holds no thread while it waits. The job ends with the
+    trajectory; outputs are rendered on first request unless `render` asks
+    for the GIF up front.
+
+    Meant to be started with `JobScheduler.prepare`: scene generation runs
+    immediately, then the job queues for a slot with the scene's cost estimate.
+    """
+    # 0. Setup Directories
+    timestamp_id, output_dir = _prepare_output_dir(timestamp_id)
 
     try:
         # 1. Initialize Pipeline
-        print("\n[1/5] Initializing SceneGeneratorPipeline...")
-        pipeline = SceneGeneratorPipeline()
+        print("\n[1/5] Initializing AsyncSceneGeneratorPipeline...")
+        pipeline = AsyncSceneGeneratorPipeline(on_step=_llm_step_reporter(job))
 
-        # 2. Generate Script
+        # 2. Generate Scene
         print(f"\n[2/5] Generating scene for prompt: '{prompt}'")
-        scene = pipeline.generate_scene(prompt)
-        script_content = pipeline.generate_python_script(scene)
+        scene = await pipeline.generate_scene(
+            prompt, mode=mode, stream=stream, on_object=_scene_object_reporter(job))
 
-        # 3. Save Script
-        script_filename = "generated_simulation.py"
-        script_path = os.path.join(output_dir, script_filename)
+        # 3. Save Scene
+        _set_stage(job, "codegen")
+        scene_hash, cache_hit = _save_scene(scene, output_dir, job, mode)
+        if cache_hit:
+            print(f"Workflow completed successfully for ID: {timestamp_id}")
+            return timestamp_id
 
-        print(f"\n[3/5] Saving generated script to: {script_path}")
-        with open(script_path, "w") as f:
-            f.write(script_content)
+        await _simulate_async(scene, scene_hash, output_dir, job, render=render)
 
-        # 4. Run Simulation
-        print(f"\n[4/5] Running simulation script ({script_filename})...")
-        cmd_sim = [sys.executable, script_filename]
+        print(f"Workflow completed successfully for ID: {timestamp_id}")
+        return timestamp_id
 
-        # Run inside the output_dir so output files appear there
-        # Capture output to log file for debugging
-        with open(os.path.join(output_dir, "simulation.log"), "w") as log_file:
-            subprocess.run(cmd_sim, cwd=output_dir, check=True,
-                           stdout=log_file, stderr=subprocess.STDOUT)
+    except asyncio.CancelledError:
+        _record_termination(timestamp_id, output_dir, job)
+        raise
+    except Exception as e:
+        _record_failure(timestamp_id, output_dir, e)
+        raise e
+    finally:
+        get_artifact_store().finish(output_dir)
 
-        # 5. Run Renderer
-        renderer_path = os.path.join(backend_dir, "api", "elastica_render.py")
-        pkl_filename = "simulation_data.pkl"
-        print(f"\n[5/5] Running renderer...")
 
-        cmd_render = [sys.executable, renderer_path, pkl_filename]
-        with open(os.path.join(output_dir, "render.log"), "w") as log_file:
-            subprocess.run(cmd_render, cwd=output_dir, check=True,
-                           stdout=log_file, stderr=subprocess.STDOUT)
+async def run_scene_workflow_async(scene: Dict[str, Any], timestamp_id: str = None,
+                                   job: Optional[Job] = None, render: bool = False) -> str:
+    """
+    Simulates (and optionally renders) a given scene, skipping the LLM steps
+    of run_simulation_workflow_async. Used for the points of parameter sweeps.
+    Returns the timestamp_id used.
+    """
+    timestamp_id, output_dir = _prepare_output_dir(timestamp_id)
+
+    try:
+        _set_stage(job, "codegen")
+        scene_hash, cache_hit = _save_scene(scene, output_dir, job, "scene")
+        if not cache_hit:
+            await _simulate_async(scene, scene_hash, output_dir, job, render=render)
 
         print(f"Workflow completed successfully for ID: {timestamp_id}")
         return timestamp_id
 
+    except asyncio.CancelledError:
+        _record_termination(timestamp_id, output_dir, job)
+        raise
     except Exception as e:
-        print(f"Workflow failed for ID {timestamp_id}: {e}")
-        # Write error to a status file
-        with open(os.path.join(output_dir, "error.log"), "w") as f:
-            f.write(str(e))
+        _record_failure(timestamp_id, output_dir, e)
         raise e
+    finally:
+        get_artifact_store().finish(output_dir)
@@ -0,0 +1,123 @@
+"""
+Per-step cost of the MuscleTorques forcing: the former NumPy implementation
+(cumsum, cosine profile and np.outer, allocating on every call) against the
+Numba kernel writing straight into external_torques. Reports the time and
+the bytes a call allocates, the largest difference between the two, and
+the per-step time of a whole snake simulation with each.
+
+Usage (from the repository root):
+    python -m backend.benchmarks.bench_muscle_torques --calls 20000
+"""
+import io
+import time
+import argparse
+import tracemalloc
+import contextlib
+
+import numpy as np
+
+from backend.api import templates
+from backend.api.scene_runner import SceneRunner
+from backend.api.scene_to_code import normalize_scene
+
+
+class LegacyMuscleTorques(templates.MuscleTorques):
+    """The NumPy implementation MuscleTorques replaced."""
+
+    def apply_torques(self, system, time: float = 0.0):
+        factor = 1.0
+        if time < self.ramp:
+            factor = time / self.ramp
+        s = np.cumsum(system.lengths)
+        s -= 0.5 * system.lengths[0]
+        torque_mag = factor * self.amplitude * np.cos(
+            self.wave_number * s - 2 * np.pi * self.frequency * time + self.phase
+        )
+        system.external_torques += np.outer(self.direction, torque_mag)
+
+
+class _Rod:
+    def __init__(self, n_elem: int):
+        rng = np.random.default_rng(0)
+        self.lengths = 1.0 / n_elem * (1.0 + 0.01 * rng.standard_normal(n_elem))
+        self.external_torques = np.zeros((3, n_elem))
+
+
+def _forcing(cls, n_elem: int):
+    return cls(amplitude=1e-3, wave_length=1.0, frequency=2.0, phase=0.3, ramp=0.5,
+               n_elems=n_elem, direction=(0.0, 1.0, 0.0))
+
+
+def time_calls(cls, n_elem: int, calls: int):
+    """Returns (microseconds per call, peak bytes allocated by a call, torques after one call)."""
+    forcing, rod = _forcing(cls, n_elem), _Rod(n_elem)
+    forcing.apply_torques(rod, 0.7)  # Compile the kernel
+    reference = rod.external_torques.copy()
+
+    times = np.linspace(0.0, 10.0, calls)
+    start = time.perf_counter()
+    for t in times:
+        forcing.apply_torques(rod, t)
+    per_call = (time.perf_counter() - start) / calls * 1e6
+
+    tracemalloc.start()
+    forcing.apply_torques(rod, 0.7)
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return per_call, allocated, reference
+
+
+def time_simulation(cls, duration: float):
+    """Microseconds per time step of a snake scene using the given forcing."""
+    original = templates.MuscleTorques
+    templates.MuscleTorques = cls
+    try:
+        runner = SceneRunner(SNAKE_SCENE | {"render": {"duration": duration, "fps": 30}})
+        runner.build()
+        steps = int(runner.final_time / runner.dt)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            templates.finalize_and_integrate(
+                runner.sim, final_time=runner.final_time, total_steps=steps,
+                progress_callback=lambda *args: None, progress_interval=float("inf"))
+        return (time.perf_counter() - start) / steps * 1e6
+    finally:
+        templates.MuscleTorques = original
+
+
+SNAKE_SCENE = normalize_scene({"objects": [{
+    "type": "rod", "material": "soft_biological_tissue", "n_elem": 50, "length": 1.0,
+    "radius": 0.025, "direction": [1.0, 0.0, 0.0], "normal": [0.0, 1.0, 0.0],
+    "forces": [
+        {"type": "gravity", "acc": [0.0, -9.81, 0.0]},
+        {"type": "muscle_activity", "amplitude": 0.01, "wave_length": 1.0,
+         "frequency": 2.0, "phase": 0.0, "ramp": 0.5},
+        {"type": "anisotropic_friction", "static_friction": [0.2, 0.4, 0.8],
+         "kinetic_friction": [0.1, 0.2, 0.4]},
+    ]}]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=20000,
+                        help="apply_torques calls per measurement")
+    parser.add_argument("--duration", type=float, default=2.0,
+                        help="Simulated seconds of the snake scene")
+    args = parser.parse_args()
+
+    print(f"{'n_elem':>7} {'legacy us':>10} {'kernel us':>10} {'speedup':>8} "
+          f"{'legacy B':>9} {'kernel B':>9} {'max diff':>9}")
+    for n_elem in (10, 50, 200, 1000):
+        legacy_us, legacy_bytes, legacy = time_calls(LegacyMuscleTorques, n_elem, args.calls)
+        kernel_us, kernel_bytes, kernel = time_calls(templates.MuscleTorques, n_elem, args.calls)
+        print(f"{n_elem:>7} {legacy_us:>10.2f} {kernel_us:>10.2f} {legacy_us / kernel_us:>7.1f}x "
+              f"{legacy_bytes:>9.0f} {kernel_bytes:>9.0f} {np.abs(legacy - kernel).max():>9.1e}")
+
+    time_simulation(templates.MuscleTorques, 0.1)  # Compile PyElastica's kernels
+    legacy_step = time_simulation(LegacyMuscleTorques, args.duration)
+    kernel_step = time_simulation(templates.MuscleTorques, args.duration)
+    print(f"\nsnake (n=50) per step: legacy {legacy_step:.1f} us, kernel {kernel_step:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+GIF production time of the two renderers: matplotlib (a canvas.draw per
+frame) against the NumPy/Pillow rasterizer. Records a snake scene once, then
+runs the renderer script on its trajectory the way the render cache does,
+once per renderer and number of rendering processes, and reports wall time,
+frames per second and GIF size.
+
+Usage (from the repository root):
+    python -m backend.benchmarks.bench_render --duration 5
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+from backend.api.paths import get_backend_dir
+from backend.api.scene_runner import SceneRunner
+from backend.api.trajectory import TRAJECTORY_FILENAME, read_trajectory
+from backend.benchmarks.bench_muscle_torques import SNAKE_SCENE
+
+
+def render(output_dir: str, renderer: str, workers: int) -> float:
+    """Runs the renderer script in `output_dir`; returns its wall time in seconds."""
+    renderer_path = os.path.join(get_backend_dir(), "api", "elastica_render.py")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, renderer_path, TRAJECTORY_FILENAME, "--renderer", renderer,
+                    "--workers", str(workers)],
+                   cwd=output_dir, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="Simulated seconds of the snake scene (30 frames each)")
+    parser.add_argument("--renderers", nargs="+", default=["matplotlib", "fast"],
+                        choices=["matplotlib", "fast"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="Numbers of rendering processes to compare")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        runner = SceneRunner(SNAKE_SCENE | {"render": {"duration": args.duration, "fps": 30}})
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            runner.run_to_file(output_dir)
+        n_frames = read_trajectory(os.path.join(output_dir, TRAJECTORY_FILENAME)).n_frames
+
+        print(f"{'renderer':>10} {'workers':>7} {'seconds':>8} {'frames/s':>9} {'GIF MB':>7}")
+        results = {}
+        for renderer in args.renderers:
+            for workers in args.workers:
+                seconds = render(output_dir, renderer, workers)
+                size = os.path.getsize(os.path.join(output_dir, "simulation.gif")) / 2**20
+                results[renderer, workers] = seconds
+                print(f"{renderer:>10} {workers:>7} {seconds:>8.2f} {n_frames / seconds:>9.1f} "
+                      f"{size:>7.2f}")
+
+    for workers in args.workers:
+        if ("matplotlib", workers) in results and ("fast", workers) in results:
+            print(f"\n{n_frames} frames, {workers} workers: fast renderer "
+                  f"{results['matplotlib', workers] / results['fast', workers]:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
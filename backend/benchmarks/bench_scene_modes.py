@@ -0,0 +1,244 @@
+"""
+Compares end-to-end latency and scene-validity rate of the two scene
+generation modes ("two_step" and "fused"), optionally also with streamed
+scene completions (time to the first validated rod is reported as well).
+
+By default the pipeline talks to a local stub LLM: an OpenAI-compatible HTTP
+server that answers with canned responses after a latency of
+`--base-latency + output_tokens * --token-latency`, and that truncates a
+fraction (`--invalid-rate`) of its JSON answers to exercise validation.
+Pass `--base-url` (and set KEYWORDSAI_API_KEY) to benchmark a real endpoint.
+
+Usage (from the repository root):
+    python -m backend.benchmarks.bench_scene_modes --runs 20 --stream
+"""
+import os
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Every run must reach the LLM
+os.environ["SQUISHY_LLM_CACHE"] = "0"
+
+from backend.api.pipeline import SceneGeneratorPipeline, SCENE_MODES
+from backend.api.scene_to_code import validate_scene
+
+PROMPTS = [
+    "A rubber rod clamped at one end sagging under gravity",
+    "A soft snake slithering on the ground",
+    "A chain of five rubber rods hanging from the ceiling",
+    "A rod pulled sideways at its free end",
+]
+
+STUB_POLISHED = (
+    "A soft, flexible Cosserat rod performing undulatory locomotion on a frictional "
+    "surface using a traveling sinusoidal wave of internal torque. The environment "
+    "requires anisotropic friction. Use a small time step and light damping."
+)
+
+STUB_SCENE = {
+    "objects": [{
+        "type": "rod",
+        "start": [0.0, 0.0, 0.0],
+        "direction": [1.0, 0.0, 0.0],
+        "normal": [0.0, 1.0, 0.0],
+        "length": 1.0,
+        "radius": 0.025,
+        "material": "soft_biological_tissue",
+        "n_elem": 50,
+        "nu": 0.002,
+        "constraints": [],
+        "forces": [
+            {"type": "gravity", "acc": [0.0, -9.81, 0.0]},
+            {"type": "muscle_activity", "amplitude": 0.01, "wave_length": 1.0,
+             "frequency": 2.0, "phase": 0.0, "ramp": 0.5},
+            {"type": "anisotropic_friction", "static_friction": [0.2, 0.4, 0.8],
+             "kinetic_friction": [0.1, 0.2, 0.4], "plane_normal": [0.0, 1.0, 0.0],
+             "plane_origin": [0.0, -0.025, 0.0]},
+        ],
+    }],
+    "render": {"duration": 5.0, "fps": 30.0},
+    "connections": [],
+}
+
+
+class StubLLM:
+    """Local OpenAI-compatible chat-completions server with simulated latency."""
+
+    def __init__(self, base_latency: float, token_latency: float, invalid_rate: float, seed: int = 0):
+        self.base_latency = base_latency
+        self.token_latency = token_latency
+        self.invalid_rate = invalid_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(
+                    int(self.headers["Content-Length"])))
+                if body.get("stream"):
+                    self.stream(body)
+                    return
+                content = stub.respond(body)
+                payload = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, body):
+                content = stub.respond(body, delay=False)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                time.sleep(stub.base_latency)
+                # Roughly four characters per token, one token per event
+                for start in range(0, len(content), 4):
+                    time.sleep(stub.token_latency)
+                    event = {
+                        "id": "stub",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "stub"),
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"content": content[start:start + 4]},
+                            "finish_reason": None,
+                        }],
+                    }
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/"
+
+    def respond(self, body, delay: bool = True) -> str:
+        system_prompt = body["messages"][0]["content"]
+        if body.get("response_format") is None:
+            content = STUB_POLISHED
+        elif '"polished_description"' in system_prompt:
+            content = json.dumps(
+                {"polished_description": STUB_POLISHED, "scene": STUB_SCENE})
+        else:
+            content = json.dumps(STUB_SCENE)
+
+        with self.lock:
+            corrupt = content.startswith("{") and self.rng.random() < self.invalid_rate
+        if corrupt:
+            content = content[: len(content) // 2]
+
+        if delay:
+            # Roughly four characters per output token
+            time.sleep(self.base_latency + len(content) /
+                       4 * self.token_latency)
+        return content
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+
+def run_mode(pipeline: SceneGeneratorPipeline, mode: str, runs: int, stream: bool = False):
+    latencies = []
+    first_rod = []
+    valid = 0
+    for i in range(runs):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        start = time.perf_counter()
+        seen = []
+
+        def on_object(index, rod, dt_estimate):
+            if not seen:
+                seen.append(time.perf_counter() - start)
+
+        try:
+            scene = pipeline.generate_scene(
+                prompt, mode=mode, stream=stream, on_object=on_object)
+            validate_scene(scene)
+            valid += 1
+        except Exception:
+            pass
+        latencies.append(time.perf_counter() - start)
+        first_rod.extend(seen)
+    return latencies, first_rod, valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--base-url", default=None,
+                        help="Real OpenAI-compatible endpoint (default: local stub)")
+    parser.add_argument("--base-latency", type=float, default=0.4,
+                        help="Stub: seconds per request before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01,
+                        help="Stub: seconds per output token")
+    parser.add_argument("--invalid-rate", type=float, default=0.05,
+                        help="Stub: fraction of JSON answers that are truncated")
+    parser.add_argument("--stream", action="store_true",
+                        help="Also benchmark streamed scene completions")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Invalid responses are expected and counted; keep the table readable
+    logging.getLogger("backend.api.pipeline").setLevel(logging.CRITICAL)
+
+    def report(base_url):
+        os.environ.setdefault("KEYWORDSAI_API_KEY", "stub")
+        pipeline = SceneGeneratorPipeline(base_url=base_url)
+        print(f"{'mode':<17} {'runs':>5} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} "
+              f"{'1st rod s':>10} {'valid':>7}")
+        variants = [(mode, False) for mode in SCENE_MODES]
+        if args.stream:
+            variants += [(mode, True) for mode in SCENE_MODES]
+        for mode, stream in variants:
+            latencies, first_rod, valid = run_mode(
+                pipeline, mode, args.runs, stream)
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            first = f"{statistics.mean(first_rod):.3f}" if first_rod else "-"
+            name = f"{mode} (stream)" if stream else mode
+            print(f"{name:<17} {args.runs:>5} {statistics.mean(latencies):>8.3f} "
+                  f"{statistics.median(latencies):>8.3f} {p95:>8.3f} {first:>10} "
+                  f"{valid / args.runs:>7.0%}")
+
+    if args.base_url:
+        report(args.base_url)
+    else:
+        with StubLLM(args.base_latency, args.token_latency, args.invalid_rate) as stub:
+            report(stub.base_url)
+
+
+if __name__ == "__main__":
+    main()
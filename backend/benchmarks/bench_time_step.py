@@ -0,0 +1,107 @@
+"""
+Compares the physics-based time step (`compute_time_step`) with the former
+heuristic dt = 0.01 * min element length on a set of representative scenes:
+step count, wall time, whether the run stays stable, and how far its final
+rod positions drift from a reference run at a quarter of the new time step.
+
+Usage (from the repository root):
+    python -m backend.benchmarks.bench_time_step --duration 0.5
+"""
+import io
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+from backend.api import templates
+from backend.api.scene_runner import SceneRunner
+from backend.api.scene_to_code import compute_time_step, normalize_scene
+
+# Speeds (m/s) above which a run counts as having blown up
+MAX_STABLE_SPEED = 50.0
+
+
+def _rod(material, n_elem=50, length=1.0, radius=0.025, start=(0.0, 0.0, 0.0), **kwargs):
+    rod = {
+        "type": "rod", "material": material, "n_elem": n_elem, "length": length,
+        "radius": radius, "nu": 1e-4, "start": list(start),
+        "direction": [1.0, 0.0, 0.0], "normal": [0.0, 1.0, 0.0],
+        "forces": [{"type": "gravity", "acc": [0.0, -9.81, 0.0]}],
+    }
+    rod.update(kwargs)
+    return rod
+
+
+def _pair(material, joint):
+    return {
+        "objects": [_rod(material, n_elem=20, length=0.5, constraints=["clamped_start"]),
+                    _rod(material, n_elem=20, length=0.5, start=(0.5, 0.0, 0.0))],
+        "connections": [{"type": joint, "rod_a_index": 0, "rod_b_index": 1}],
+    }
+
+
+SCENES = {
+    "snake (soft, friction)": {"objects": [_rod("soft_biological_tissue", forces=[
+        {"type": "gravity", "acc": [0.0, -9.81, 0.0]},
+        {"type": "muscle_activity", "amplitude": 0.01, "wave_length": 1.0,
+         "frequency": 2.0, "phase": 0.0, "ramp": 0.5},
+        {"type": "anisotropic_friction", "static_friction": [0.2, 0.4, 0.8],
+         "kinetic_friction": [0.1, 0.2, 0.4]},
+    ])]},
+    "soft fine (n=200)": {"objects": [_rod("soft_biological_tissue", n_elem=200, radius=0.01,
+                                           constraints=["clamped_start"])]},
+    "rubber cantilever": {"objects": [_rod("rubber", constraints=["clamped_start"])]},
+    "soft hinge pair": _pair("soft_biological_tissue", "hinge_joint"),
+    "rubber fixed pair": _pair("rubber", "fixed_joint"),
+}
+
+
+def run(scene, dt: float, duration: float):
+    """Integrates the scene with the given dt. Returns (positions, max speed, steps, seconds)."""
+    runner = SceneRunner(scene)
+    runner.dt = dt
+    runner.build()
+    steps = max(1, int(round(duration / dt)))
+    start = time.perf_counter()
+    # Silence tqdm and PyElastica's finalize messages
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        templates.finalize_and_integrate(
+            runner.sim, final_time=steps * dt, total_steps=steps,
+            progress_callback=lambda *args: None, progress_interval=float("inf"))
+    elapsed = time.perf_counter() - start
+    positions = np.concatenate([rod.position_collection for rod in runner.rods], axis=1)
+    speed = max(float(np.abs(rod.velocity_collection).max()) for rod in runner.rods)
+    return positions, speed, steps, elapsed
+
+
+def _stable(positions, speed) -> bool:
+    return bool(np.all(np.isfinite(positions))) and speed < MAX_STABLE_SPEED
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=0.5,
+                        help="Simulated seconds per run")
+    args = parser.parse_args()
+
+    print(f"{'scene':<24} {'legacy dt':>10} {'new dt':>10} {'fewer':>7} "
+          f"{'legacy s':>9} {'new s':>7} {'legacy':>8} {'new':>8} {'drift m':>9}")
+    for name, spec in SCENES.items():
+        scene = normalize_scene({**spec, "render": {"duration": args.duration, "fps": 30}})
+        legacy_dt = 0.01 * min(rod["length"] / rod["n_elem"] for rod in scene["objects"])
+        dt = compute_time_step(scene)
+
+        legacy_pos, legacy_speed, legacy_steps, legacy_s = run(scene, legacy_dt, args.duration)
+        pos, speed, steps, new_s = run(scene, dt, args.duration)
+        ref_pos, _, _, _ = run(scene, dt / 4, args.duration)
+
+        drift = float(np.abs(pos - ref_pos).max())
+        print(f"{name:<24} {legacy_dt:>10.2e} {dt:>10.2e} {legacy_steps / steps:>6.1f}x "
+              f"{legacy_s:>9.2f} {new_s:>7.2f} "
+              f"{'stable' if _stable(legacy_pos, legacy_speed) else 'BLOWUP':>8} "
+              f"{'stable' if _stable(pos, speed) else 'BLOWUP':>8} {drift:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
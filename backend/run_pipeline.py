@@ -1,4 +1,5 @@
 from backend.api.pipeline import SceneGeneratorPipeline
+from backend.api.trajectory import TRAJECTORY_FILENAME
 import os
 import subprocess
 import sys
@@ -70,11 +71,10 @@ def main():
         print(f"Failed to run simulation: {e}")
         return
 
-    # Check if pkl exists
-    pkl_filename = "simulation_data.pkl"
-    pkl_path = os.path.join(output_dir, pkl_filename)
-    if not os.path.exists(pkl_path):
-        print(f"Error: {pkl_path} was not created by the simulation.")
+    # Check if the trajectory exists
+    trajectory_path = os.path.join(output_dir, TRAJECTORY_FILENAME)
+    if not os.path.exists(trajectory_path):
+        print(f"Error: {trajectory_path} was not created by the simulation.")
         return
 
     # 5. Run Renderer
@@ -86,9 +86,9 @@ def main():
         print(f"Renderer not found at {renderer_path}")
         return
 
-    # We run the renderer, passing the pkl file path
+    # We run the renderer, passing the trajectory file path
     # Since we are running from output_dir context (cwd), passing just filename works if we set cwd
-    cmd_render = [sys.executable, renderer_path, pkl_filename]
+    cmd_render = [sys.executable, renderer_path, TRAJECTORY_FILENAME]
 
     try:
         result_render = subprocess.run(cmd_render, cwd=output_dir, check=True)
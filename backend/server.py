@@ -1,10 +1,25 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import Literal, Dict, Any, List
 import os
-import datetime
-from backend.api.workflow import run_simulation_workflow
+import json
+import asyncio
+from backend.api.scene_to_code import generate_script_from_scene, validate_scene
+from backend.api.jobs import Job
+from backend.api import limits, paths
+from backend.api.artifact_store import get_artifact_store
+from backend.api.cost_model import get_cost_model
+from backend.api.job_ids import new_job_id
+from backend.api.scheduler import get_scheduler, QueueFullError
+from backend.api.sweeps import start_sweep, SWEEP_FILENAME
+from backend.api.render_cache import RENDERERS, RenderError, RenderParams, get_render_cache
+from backend.api.video import QUALITY_PRESETS, VIDEO_FORMATS, ffmpeg_executable, video_filename
+from backend.api.playback import encode_playback, payload_size, playback_header
+from backend.api.trajectory import open_trajectory
+from backend.api.workflow import run_simulation_workflow_async, SCENE_FILENAME
 
 app = FastAPI(title="Text-to-Physics API")
 
@@ -21,86 +36,400 @@ router = APIRouter(prefix="/api")
 
 class PromptRequest(BaseModel):
     prompt: str
+    # Higher priority jobs are taken from the queue first
+    priority: int = 0
+    # "two_step" (polish, then scene) or "fused" (one LLM round-trip)
+    mode: Literal["two_step", "fused"] = "two_step"
+    # Stream the scene completion, validating rods as they arrive
+    stream: bool = True
+    # Render the GIF before the job completes instead of on the first /gif request
+    render: bool = False
+
+
+class EstimateRequest(BaseModel):
+    scene: Dict[str, Any]
+
+
+class SweepRequest(BaseModel):
+    scene: Dict[str, Any]
+    # Dotted scene path -> values, e.g. {"objects.0.n_elem": [20, 50]}
+    axes: Dict[str, List[Any]]
+    # Below interactive jobs by default
+    priority: int = -1
+    # Points only simulate unless rendering is asked for
+    render: bool = False
+
+
+# Seconds between keep-alive comments on idle event streams
+EVENTS_KEEPALIVE = 15.0
+
+# Largest frame side rendered on request
+MAX_RENDER_SIZE = 4096
+DEFAULT_RENDER = RenderParams()
 
 
 def get_output_dir(timestamp_id: str):
-    if os.environ.get("VERCEL"):
-        # On Vercel, we can only write to /tmp
-        generated_dir = os.path.join("/tmp", "generated")
-    else:
-        backend_dir = os.path.dirname(os.path.abspath(__file__))
-        generated_dir = os.path.join(backend_dir, "generated")
+    try:
+        return paths.get_output_dir(timestamp_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Generation ID not found")
+
+
+def get_job_status(job: Job):
+    status = job.status()
+    if job.state == "queued":
+        status["queue_position"] = get_scheduler().queue_position(job.id)
+    return status
 
-    return os.path.join(generated_dir, timestamp_id)
+
+def get_legacy_status(timestamp_id: str):
+    """
+    Status of a run that is not in the job registry (e.g. from before the
+    last restart), derived from its artifacts. Blocking; None if unknown.
+    """
+    output_dir = get_output_dir(timestamp_id)
+    if not os.path.exists(output_dir):
+        return None
+
+    error_log = os.path.join(output_dir, "error.log")
+    if os.path.exists(error_log):
+        with open(error_log, "r") as f:
+            error = f.read()
+        return {"status": "failed", "stage": "failed", "error": error}
+
+    gif_path = os.path.join(output_dir, "simulation.gif")
+    if os.path.exists(gif_path):
+        return {"status": "completed", "stage": "done"}
+
+    # Runs that were not rendered are done once their trajectory is
+    try:
+        if open_trajectory(output_dir).complete:
+            return {"status": "completed", "stage": "done"}
+    except (FileNotFoundError, ValueError):
+        pass
+
+    return {"status": "processing"}
 
 
 @router.post("/generate")
-async def generate_simulation(request: PromptRequest, background_tasks: BackgroundTasks):
+async def generate_simulation(request: PromptRequest):
     """
-    Starts a simulation generation task in the background.
-    Returns the generation ID.
+    Starts a simulation generation job. The scene is generated right away;
+    the job then queues for a simulation slot with its cost estimate, which
+    status and events report as `estimate`.
+    Returns the generation ID, or 429 with Retry-After when the queue is full.
     """
-    timestamp_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp_id = new_job_id()
+    scheduler = get_scheduler()
 
-    # Run the workflow in the background
-    background_tasks.add_task(run_simulation_workflow,
-                              request.prompt, timestamp_id)
+    job = Job(timestamp_id, priority=request.priority)
+    try:
+        scheduler.prepare(job, run_simulation_workflow_async,
+                         request.prompt, timestamp_id, job=job, mode=request.mode,
+                         stream=request.stream, render=request.render)
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(e)},
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
     return {
         "id": timestamp_id,
         "status": "processing",
-        "message": "Simulation started in background. Poll /status/{id} or check /gif/{id}."
+        "message": "Simulation started. Follow /jobs/{id}/events or poll /status/{id}."
+    }
+
+
+@router.post("/estimate")
+async def estimate_scene(request: EstimateRequest):
+    """
+    Predicts a scene's simulation runtime and peak memory, and whether it
+    would be admitted.
+    """
+    try:
+        validate_scene(request.scene)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    estimate = get_cost_model().estimate(request.scene)
+    try:
+        get_scheduler().admit(estimate)
+    except limits.CostLimitExceededError as e:
+        return {**estimate, "admitted": False, "detail": str(e)}
+    return {**estimate, "admitted": True}
+
+
+@router.post("/sweeps")
+async def create_sweep(request: SweepRequest):
+    """
+    Runs a scene over the Cartesian product of parameter axes. Every point is
+    its own job (see /status/{id}); the sweep job aggregates their summary
+    metrics into a table, served by /sweeps/{id}.
+    Returns 422 for an invalid sweep and 429 when the queue has no room for it.
+    """
+    try:
+        job, points = start_sweep(request.scene, request.axes,
+                                  priority=request.priority, render=request.render)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(e)},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    return {
+        "id": job.id,
+        "status": "processing",
+        "points": points,
+        "message": "Sweep started. Follow /jobs/{id}/events or poll /sweeps/{id}."
     }
 
 
+def _read_sweep(sweep_path: str):
+    with open(sweep_path, "r") as f:
+        return json.load(f)
+
+
+@router.get("/sweeps/{sweep_id}")
+async def get_sweep(sweep_id: str):
+    """Status of a sweep and its table of per-point parameters and metrics."""
+    get_artifact_store().touch(sweep_id)
+    job = get_scheduler().get(sweep_id)
+    if job is not None and "sweep_points" in job.info:
+        return {"id": sweep_id, **get_job_status(job)}
+
+    sweep_path = os.path.join(get_output_dir(sweep_id), SWEEP_FILENAME)
+    if not await run_in_threadpool(os.path.exists, sweep_path):
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    sweep = await run_in_threadpool(_read_sweep, sweep_path)
+    return {"id": sweep_id, "status": "completed", "stage": "done", "table": sweep["table"]}
+
+
 @router.get("/status/{timestamp_id}")
 async def get_status(timestamp_id: str):
-    output_dir = get_output_dir(timestamp_id)
-    if not os.path.exists(output_dir):
+    get_artifact_store().touch(timestamp_id)
+    job = get_scheduler().get(timestamp_id)
+    if job is not None:
+        return get_job_status(job)
+
+    # Jobs from before the last restart are only known from their artifacts
+    status = await run_in_threadpool(get_legacy_status, timestamp_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Generation ID not found")
+    return status
 
-    error_log = os.path.join(output_dir, "error.log")
-    if os.path.exists(error_log):
-        with open(error_log, "r") as f:
-            error = f.read()
-        return {"status": "failed", "error": error}
 
-    gif_path = os.path.join(output_dir, "simulation.gif")
-    if os.path.exists(gif_path):
-        return {"status": "completed"}
+def _sse(data) -> str:
+    return f"data: {json.dumps(data)}\n\n"
 
-    return {"status": "processing"}
+
+@router.get("/jobs/{timestamp_id}/events")
+async def job_events(timestamp_id: str):
+    """
+    Server-Sent Events stream of a job's status. Sends the current status
+    immediately, then one event per stage or progress change, and closes
+    after the job is done or failed.
+    """
+    job = get_scheduler().get(timestamp_id)
+    if job is None:
+        status = await run_in_threadpool(get_legacy_status, timestamp_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Generation ID not found")
+
+        async def legacy_events():
+            yield _sse(status)
+        return StreamingResponse(legacy_events(), media_type="text/event-stream")
+
+    # Subscribe before the first snapshot so no transition is missed
+    queue = job.subscribe()
+
+    async def events():
+        try:
+            status = get_job_status(job)
+            yield _sse(status)
+            while status["status"] not in ("completed", "failed"):
+                try:
+                    status = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if status["status"] == "queued":
+                    status["queue_position"] = get_scheduler().queue_position(job.id)
+                yield _sse(status)
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class RenderQuery:
+    """Query parameters of the rendered outputs; defaults match the job's own render."""
+
+    def __init__(self, width: int = Query(DEFAULT_RENDER.width, ge=16, le=MAX_RENDER_SIZE),
+                 height: int = Query(DEFAULT_RENDER.height, ge=16, le=MAX_RENDER_SIZE),
+                 dpi: float = Query(DEFAULT_RENDER.dpi, gt=0, le=1000),
+                 elev: float = Query(DEFAULT_RENDER.elevation, ge=-90, le=90),
+                 azim: float = Query(DEFAULT_RENDER.azimuth, ge=-360, le=360),
+                 renderer: Literal[RENDERERS] = Query(None)):
+        self.params = RenderParams(width=width, height=height, dpi=dpi, elevation=elev,
+                                   azimuth=azim, renderer=renderer)
+
+
+async def _rendered(timestamp_id: str, params: RenderParams, media_type: str,
+                    run_filename: str = None):
+    """
+    Serves a rendered output of a run, rendering it on the first request.
+    Runs rendered with the job (or before rendering was on request) keep
+    their default output as `run_filename` in the run directory.
+    """
+    output_dir = get_output_dir(timestamp_id)
+    get_artifact_store().touch(timestamp_id)
+    if run_filename is not None and params == DEFAULT_RENDER._replace(format=params.format):
+        run_path = os.path.join(output_dir, run_filename)
+        if os.path.exists(run_path):
+            return FileResponse(run_path, media_type=media_type)
+
+    if params.format in VIDEO_FORMATS:
+        try:
+            ffmpeg_executable()
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    try:
+        path = await get_render_cache().render(output_dir, params)
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(output_dir, "error.log")):
+            raise HTTPException(
+                status_code=400, detail="Simulation failed. Check status.")
+        raise HTTPException(
+            status_code=404, detail="Simulation not finished or ID not found")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except (RenderError, limits.JobTerminatedError) as e:
+        raise HTTPException(status_code=500, detail=f"Rendering failed: {e}")
+    return FileResponse(path, media_type=media_type)
 
 
 @router.get("/gif/{timestamp_id}")
-async def get_gif(timestamp_id: str):
+async def get_gif(timestamp_id: str, query: RenderQuery = Depends(),
+                  fps: float = Query(None, gt=0)):
+    """
+    The run's animation as a GIF, rendered on the first request for the
+    given frame size, text scale (`dpi`), camera angles and frame rate.
+    """
+    params = query.params._replace(format="gif", fps=fps)
+    return await _rendered(timestamp_id, params, "image/gif", "simulation.gif")
+
+
+@router.get("/video/{timestamp_id}")
+async def get_video(timestamp_id: str, format: Literal["mp4", "webm"] = "mp4",
+                    query: RenderQuery = Depends(), fps: float = Query(None, gt=0),
+                    quality: Literal[tuple(QUALITY_PRESETS)] = Query(None)):
+    """
+    The run's animation as H.264 MP4 or VP9 WebM, rendered on the first
+    request like /gif. Returns 503 when ffmpeg is not installed.
+    """
+    params = query.params._replace(format=format, fps=fps, quality=quality)
+    return await _rendered(timestamp_id, params, VIDEO_FORMATS[format]["media_type"],
+                           video_filename(format))
+
+
+@router.get("/frame/{timestamp_id}")
+async def get_frame(timestamp_id: str, index: int = Query(..., ge=0),
+                    query: RenderQuery = Depends()):
+    """One frame of the run as a PNG, rendered on the first request."""
+    params = query.params._replace(format="png", frame=index)
+    return await _rendered(timestamp_id, params, "image/png")
+
+
+@router.get("/trajectory/{timestamp_id}")
+async def get_trajectory(timestamp_id: str, encoding: Literal["float32", "uint16"] = "float32",
+                         stride: int = Query(1, ge=1)):
+    """
+    The run's rod positions as a compact binary payload for client-side
+    playback (see backend/api/playback.py): a JSON header, then per frame
+    every rod's nodes as xyz, float32 or quantized to uint16 over the run's
+    bounds. `stride` keeps every n-th frame. Available while the simulation
+    is still running, with the frames recorded so far (`complete` false).
+    """
     output_dir = get_output_dir(timestamp_id)
-    gif_path = os.path.join(output_dir, "simulation.gif")
+    get_artifact_store().touch(timestamp_id)
+
+    def prepare():
+        trajectory = open_trajectory(output_dir)
+        return trajectory, playback_header(trajectory, encoding, stride)
 
-    if not os.path.exists(gif_path):
-        # Check if failed
+    try:
+        trajectory, header = await run_in_threadpool(prepare)
+    except (FileNotFoundError, ValueError):
         if os.path.exists(os.path.join(output_dir, "error.log")):
             raise HTTPException(
                 status_code=400, detail="Simulation failed. Check status.")
         raise HTTPException(
-            status_code=404, detail="GIF not ready or ID not found")
+            status_code=404, detail="Trajectory not ready or ID not found")
 
-    return FileResponse(gif_path, media_type="image/gif")
+    return StreamingResponse(encode_playback(trajectory, header),
+                             media_type="application/octet-stream",
+                             headers={"Content-Length": str(payload_size(header))})
 
 
 @router.get("/code/{timestamp_id}")
 async def get_code(timestamp_id: str):
     output_dir = get_output_dir(timestamp_id)
+    get_artifact_store().touch(timestamp_id)
     code_path = os.path.join(output_dir, "generated_simulation.py")
 
     if not os.path.exists(code_path):
-        raise HTTPException(status_code=404, detail="Code not found")
+        # Runs executed directly from the scene only keep scene.json;
+        # the equivalent script is generated for viewing on request.
+        scene_path = os.path.join(output_dir, SCENE_FILENAME)
+        if not os.path.exists(scene_path):
+            raise HTTPException(status_code=404, detail="Code not found")
+        with open(scene_path, "r") as f:
+            scene = json.load(f)
+        return PlainTextResponse(generate_script_from_scene(scene))
 
     with open(code_path, "r") as f:
         content = f.read()
 
     return PlainTextResponse(content)
 
+@router.delete("/jobs/{timestamp_id}")
+async def cancel_job(timestamp_id: str):
+    """
+    Cancels a job: removes it from the queue, or kills its running stage
+    (LLM request, simulation worker or renderer). The job's record is then
+    dropped; its status comes from its artifacts.
+    """
+    scheduler = get_scheduler()
+    job = scheduler.get(timestamp_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Generation ID not found")
+    if not scheduler.cancel(timestamp_id):
+        raise HTTPException(status_code=409, detail=f"Job already {job.state}")
+    status = get_job_status(job)
+    scheduler.forget(timestamp_id)
+    return {"id": timestamp_id, "cancelled": True, **status}
+
+
+@router.put("/jobs/{timestamp_id}/pin")
+async def pin_run(timestamp_id: str):
+    """Exempts a run's artifacts from eviction."""
+    output_dir = get_output_dir(timestamp_id)
+    if not await run_in_threadpool(os.path.isdir, output_dir):
+        raise HTTPException(status_code=404, detail="Generation ID not found")
+    await run_in_threadpool(get_artifact_store().pin, timestamp_id)
+    return {"id": timestamp_id, "pinned": True}
+
+
+@router.delete("/jobs/{timestamp_id}/pin")
+async def unpin_run(timestamp_id: str):
+    get_output_dir(timestamp_id)
+    await run_in_threadpool(get_artifact_store().unpin, timestamp_id)
+    return {"id": timestamp_id, "pinned": False}
+
 app.include_router(router)
 
 if __name__ == "__main__":
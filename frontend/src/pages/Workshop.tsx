@@ -7,11 +7,81 @@ import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
 import { Send, Loader2, Sparkles, RotateCcw } from "lucide-react";
 import PythonEditor from "@/components/workshop/PythonEditor";
 
+interface JobStatus {
+  status: "queued" | "processing" | "completed" | "failed";
+  stage?: string;
+  progress?: number;
+  eta_seconds?: number;
+  queue_position?: number;
+  error?: string;
+}
+
+const STAGE_LABELS: Record<string, string> = {
+  queued: "Waiting in queue",
+  polishing: "Refining your description",
+  scene: "Designing the scene",
+  codegen: "Building the simulation",
+  simulating: "Simulating physics",
+  rendering: "Rendering animation",
+};
+
+const isFinal = (status: JobStatus) =>
+  status.status === "completed" || status.status === "failed";
+
+// Follows a job over Server-Sent Events, falling back to polling /status
+// when EventSource is unavailable or the stream fails before the job ends.
+const followJob = (
+  id: string,
+  onStatus: (status: JobStatus) => Promise<void>,
+  onError: (err: unknown) => void,
+) => {
+  const poll = () => {
+    const pollInterval = setInterval(async () => {
+      try {
+        const statusRes = await fetch(`/api/status/${id}`);
+        const statusData: JobStatus = await statusRes.json();
+        if (isFinal(statusData)) clearInterval(pollInterval);
+        await onStatus(statusData);
+      } catch (err) {
+        clearInterval(pollInterval);
+        onError(err);
+      }
+    }, 2000);
+  };
+
+  if (typeof EventSource === "undefined") {
+    poll();
+    return;
+  }
+
+  const source = new EventSource(`/api/jobs/${id}/events`);
+  let finished = false;
+  source.onmessage = async (event) => {
+    const statusData: JobStatus = JSON.parse(event.data);
+    if (isFinal(statusData)) {
+      finished = true;
+      source.close();
+    }
+    try {
+      await onStatus(statusData);
+    } catch (err) {
+      onError(err);
+    }
+  };
+  source.onerror = () => {
+    source.close();
+    if (!finished) poll();
+  };
+};
+
 const Workshop = () => {
   const [prompt, setPrompt] = useState("");
   const [isGenerating, setIsGenerating] = useState(false);
   const [generatedGif, setGeneratedGif] = useState<string | null>(null);
   const [generatedCode, setGeneratedCode] = useState<string | null>(null);
+  const [stage, setStage] = useState<string | null>(null);
+  const [progress, setProgress] = useState<number | null>(null);
+  const [eta, setEta] = useState<number | null>(null);
 
   const handleGenerate = async () => {
     if (!prompt.trim()) return;
@@ -19,6 +89,9 @@ const Workshop = () => {
     setIsGenerating(true);
     setGeneratedGif(null);
     setGeneratedCode(null);
+    setStage(null);
+    setProgress(null);
+    setEta(null);
 
     try {
       // 1. Send generation request
@@ -38,60 +111,57 @@ const Workshop = () => {
       const id = data.id;
       console.log("Generation started with ID:", id);
 
-      // 2. Poll for status
-      const pollInterval = setInterval(async () => {
-        try {
-          const statusRes = await fetch(`/api/status/${id}`);
-          const statusData = await statusRes.json();
-
-          if (statusData.status === "completed") {
-            clearInterval(pollInterval);
-
-            // 3. Fetch results
-            const gifUrl = `/api/gif/${id}?t=${Date.now()}`;
-
-            // Preload the image to prevent race conditions or 404s
-            const preloadImage = (url: string) => {
-              return new Promise<void>((resolve, reject) => {
-                const img = new Image();
-                img.onload = () => resolve();
-                img.onerror = () => reject();
-                img.src = url;
-              });
-            };
-
-            // Try to load the image, retrying a few times if necessary
-            let retries = 5;
-            while (retries > 0) {
-              try {
-                await preloadImage(gifUrl);
-                break;
-              } catch (e) {
-                retries--;
-                if (retries === 0) console.error("Failed to preload generated GIF");
-                await new Promise(r => setTimeout(r, 500));
-              }
-            }
+      const handleStatus = async (statusData: JobStatus) => {
+        setStage(statusData.stage ?? null);
+        setProgress(statusData.progress ?? null);
+        setEta(statusData.eta_seconds ?? null);
 
-            setGeneratedGif(gifUrl);
+        if (statusData.status === "completed") {
+          // 3. Fetch results
+          const gifUrl = `/api/gif/${id}?t=${Date.now()}`;
 
-            const codeRes = await fetch(`/api/code/${id}`);
-            const codeText = await codeRes.text();
-            setGeneratedCode(codeText);
+          // Preload the image to prevent race conditions or 404s
+          const preloadImage = (url: string) => {
+            return new Promise<void>((resolve, reject) => {
+              const img = new Image();
+              img.onload = () => resolve();
+              img.onerror = () => reject();
+              img.src = url;
+            });
+          };
 
-            setIsGenerating(false);
-          } else if (statusData.status === "failed") {
-            clearInterval(pollInterval);
-            setIsGenerating(false);
-            console.error("Generation failed:", statusData.error);
-            // Ideally show error toast here
+          // Try to load the image, retrying a few times if necessary
+          let retries = 5;
+          while (retries > 0) {
+            try {
+              await preloadImage(gifUrl);
+              break;
+            } catch (e) {
+              retries--;
+              if (retries === 0) console.error("Failed to preload generated GIF");
+              await new Promise(r => setTimeout(r, 500));
+            }
           }
-        } catch (err) {
-          console.error("Polling error:", err);
-          clearInterval(pollInterval);
+
+          setGeneratedGif(gifUrl);
+
+          const codeRes = await fetch(`/api/code/${id}`);
+          const codeText = await codeRes.text();
+          setGeneratedCode(codeText);
+
+          setIsGenerating(false);
+        } else if (statusData.status === "failed") {
           setIsGenerating(false);
+          console.error("Generation failed:", statusData.error);
+          // Ideally show error toast here
         }
-      }, 2000);
+      };
+
+      // 2. Follow job progress (falls back to polling without SSE)
+      followJob(id, handleStatus, (err) => {
+        console.error("Status error:", err);
+        setIsGenerating(false);
+      });
 
     } catch (error) {
       console.error("Error:", error);
@@ -229,7 +299,11 @@ const Workshop = () => {
                           </div>
                           <div>
                             <p className="font-display font-medium">AI agent is working...</p>
-                            <p className="text-sm text-muted-foreground">Reasoning and generating your model</p>
+                            <p className="text-sm text-muted-foreground">
+                              {stage && STAGE_LABELS[stage]
+                                ? `${STAGE_LABELS[stage]}${progress != null && progress > 0 ? ` (${Math.round(progress)}%${eta != null ? `, ~${Math.ceil(eta)}s left` : ""})` : ""}...`
+                                : "Reasoning and generating your model"}
+                            </p>
                           </div>
                         </div>
                       ) : generatedGif ? (